@@ -0,0 +1,349 @@
+""" imagebox benchmarks
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output new.json --compare results.json --threshold 0.15
+    python -m benchmarks.run --filter processor --repeat 10
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+from . import synthetic
+#
+# CONSTANTS
+#
+REPEAT=5
+THRESHOLD=0.1
+WINDOW=(384,384,256,256)
+RASTER_SIZE=2048
+CASES=[]
+
+
+#
+# CASES
+#
+def case(name):
+    """ register benchmark case
+
+    The decorated function takes the fixtures dict and returns 
+    (callable, nbytes). nbytes (the bytes processed per call) is used 
+    for throughput.
+    """
+    def decorator(func):
+        CASES.append((name,func))
+        return func
+    return decorator
+
+
+def _read_case(layout):
+    def _case(fixtures):
+        import imagebox.io as io
+        path=fixtures[layout]
+        return (lambda: io.read(path,window=WINDOW)), 4*256*256*2
+    return _case
+
+
+for layout in ['tiled_lzw','tiled_deflate','tiled_none','striped_lzw']:
+    case(f'io.read.window.{layout}')(_read_case(layout))
+
+
+@case('io.read.full')
+def _io_read_full(fixtures):
+    import imagebox.io as io
+    path=fixtures['tiled_lzw']
+    return (lambda: io.read(path)), 4*RASTER_SIZE**2*2
+
+
+@case('io.read.overview')
+def _io_read_overview(fixtures):
+    import imagebox.io as io
+    path=fixtures['overviews']
+    return (lambda: io.read(path,scale=0.25)), 4*(RASTER_SIZE//4)**2*2
+
+
+@case('handler.input')
+def _handler_input(fixtures):
+    handler=_handler()
+    path=fixtures['input']
+    return (lambda: handler.input(path,window=WINDOW)), 4*256*256*2
+
+
+@case('handler.target')
+def _handler_target(fixtures):
+    handler=_handler()
+    path=fixtures['target']
+    return (lambda: handler.target(path,window=WINDOW)), 256*256
+
+
+@case('handler.sample')
+def _handler_sample(fixtures):
+    handler=_handler()
+    input_path,target_path=fixtures['input'],fixtures['target']
+    return (lambda: handler.sample(input_path,target_path,seed=1)), 4*256*256*2+256*256
+
+
+@case('handler.batch.8')
+def _handler_batch(fixtures):
+    handler=_handler()
+    specs=[(fixtures['input'],fixtures['target'],None,i) for i in range(8)]
+    return (lambda: handler.batch(specs)), 8*(4*256*256*2+256*256)
+
+
+@case('processor.map_values')
+def _map_values(fixtures):
+    import imagebox.processor as proc
+    im=synthetic.image((1024,1024),dtype='uint8',nb_categories=8)
+    value_map={1:[2,3],4:[5,6],7:[0]}
+    return (lambda: proc.map_values(im,value_map)), im.nbytes
+
+
+@case('processor.to_categorical')
+def _to_categorical(fixtures):
+    import imagebox.processor as proc
+    im=synthetic.image((1024,1024),dtype='uint8',nb_categories=8)
+    return (lambda: proc.to_categorical(im,8)), im.nbytes
+
+
+@case('processor.augment')
+def _augment(fixtures):
+    import imagebox.processor as proc
+    im=synthetic.image((4,1024,1024),dtype='float32')
+    return (lambda: proc.augment(im,k=1,flip=True)), im.nbytes
+
+
+@case('processor.normalize')
+def _normalize(fixtures):
+    import imagebox.processor as proc
+    im=synthetic.image((4,1024,1024),dtype='uint16')
+    means,stdevs=[1000]*4,[500]*4
+    return (lambda: proc.normalize(im,means=means,stdevs=stdevs)), im.nbytes
+
+
+@case('processor.downsample.mode')
+def _downsample(fixtures):
+    import imagebox.processor as proc
+    im=synthetic.image((1,1024,1024),dtype='uint8',nb_categories=8)
+    return (lambda: proc.downsample(im,4)), im.nbytes
+
+
+@case('indices.ndvi')
+def _ndvi(fixtures):
+    import imagebox.indices as indices
+    im=synthetic.image((6,1024,1024),dtype='uint16')
+    return (lambda: indices.index(im,'ndvi')), 2*1024*1024*2
+
+
+@case('indices.evi_modis')
+def _evi(fixtures):
+    import imagebox.indices as indices
+    im=synthetic.image((6,1024,1024),dtype='uint16')
+    return (lambda: indices.index(im,'evi_modis')), 3*1024*1024*2
+
+
+@case('tiller.windows')
+def _tiller(fixtures):
+    from imagebox.handler import Tiller
+    tiller=Tiller(boundary_shape=(20000,20000),size=256,overlap=16)
+    return (lambda: [tiller[i] for i in range(len(tiller))]), 0
+
+
+@case('tiller.build')
+def _tiller_build(fixtures):
+    from imagebox.handler import Tiller
+    return (lambda: Tiller(boundary_shape=(20000,20000),size=256,overlap=16).windows), 0
+
+
+def _import_case(module):
+    def _case(fixtures):
+        root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env=dict(os.environ,PYTHONPATH=os.pathsep.join(
+            [root]+[p for p in [os.environ.get('PYTHONPATH')] if p]))
+        command=[sys.executable,'-c',f'import {module}']
+        return (lambda: subprocess.run(command,check=True,env=env)), 0
+    return _case
+
+
+for module in ['imagebox.handler','imagebox.loader']:
+    case(f'import.{module}')(_import_case(module))
+
+
+#
+# RUN
+#
+def fixtures(folder):
+    """ write synthetic rasters used by the cases """
+    paths={}
+    for layout,kwargs in [
+            ('tiled_lzw',{'compress':'lzw'}),
+            ('tiled_deflate',{'compress':'deflate'}),
+            ('tiled_none',{'compress':None}),
+            ('striped_lzw',{'compress':'lzw','tiled':False}),
+            ('overviews',{'compress':'lzw','overviews':True}) ]:
+        paths[layout]=synthetic.raster(
+            os.path.join(folder,f'{layout}.tif'),
+            size=RASTER_SIZE,
+            **kwargs)
+    paths['input'],paths['target']=synthetic.pair(folder,size=RASTER_SIZE)
+    return paths
+
+
+def run(names=None,repeat=REPEAT,folder=None,verbose=True):
+    """ run benchmarks
+
+    Args:
+        names<list|str|None>: case names (or substring) to run. None runs all.
+        repeat<int>: number of timed calls per case
+        folder<str|None>: folder for synthetic rasters (defaults to a temp folder)
+        verbose<bool>: print results as they run
+    Returns:
+        <dict> {'meta': {...}, 'results': {name: stats}}
+    """
+    if isinstance(names,str):
+        names=[names]
+    cleanup=folder is None
+    folder=folder or tempfile.mkdtemp(prefix='imagebox-bench-')
+    try:
+        paths=fixtures(folder)
+        results={}
+        for name,func in CASES:
+            if names and not any(n in name for n in names):
+                continue
+            results[name]=_time_case(func(paths),repeat)
+            if verbose:
+                _print_result(name,results[name])
+    finally:
+        if cleanup:
+            shutil.rmtree(folder,ignore_errors=True)
+    return {'meta': _meta(repeat), 'results': results}
+
+
+def compare(baseline,current,threshold=THRESHOLD):
+    """ regressions of current relative to baseline
+
+    Args:
+        baseline,current<dict>: run results (or paths to results json)
+        threshold<float>: relative slow-down allowed (0.1 = 10%)
+    Returns:
+        <list> (name, baseline-seconds, current-seconds, ratio) for regressed cases
+    """
+    baseline=_load(baseline)['results']
+    current=_load(current)['results']
+    regressions=[]
+    for name,stats in current.items():
+        base=baseline.get(name)
+        if base and base['median']>0:
+            ratio=stats['median']/base['median']
+            if ratio>1+threshold:
+                regressions.append((name,base['median'],stats['median'],ratio))
+    return regressions
+
+
+def main(args=None):
+    parser=argparse.ArgumentParser(description='imagebox benchmarks')
+    parser.add_argument('--output',help='write results json')
+    parser.add_argument('--compare',help='baseline results json')
+    parser.add_argument('--threshold',type=float,default=THRESHOLD)
+    parser.add_argument('--filter',nargs='*',help='run cases containing these names')
+    parser.add_argument('--repeat',type=int,default=REPEAT)
+    parser.add_argument('--folder',help='folder for synthetic rasters')
+    args=parser.parse_args(args)
+    results=run(names=args.filter,repeat=args.repeat,folder=args.folder)
+    if args.output:
+        with open(args.output,'w') as file:
+            json.dump(results,file,indent=2)
+    if args.compare:
+        regressions=compare(args.compare,results,threshold=args.threshold)
+        for name,base,current,ratio in regressions:
+            print(f'REGRESSION {name}: {base:.6f}s -> {current:.6f}s ({ratio:.2f}x)')
+        if regressions:
+            return 1
+    return 0
+
+
+#
+# INTERNAL
+#
+def _handler():
+    from imagebox.handler import InputTargetHandler, Tiller
+    return InputTargetHandler(
+        tiller=Tiller(boundary_shape=(RASTER_SIZE,RASTER_SIZE),size=256),
+        size=256,
+        float_cropping=8,
+        means=[1000]*4,
+        stdevs=[500]*4,
+        band_indices=['ndvi'],
+        value_map={1:[1],2:[2,3]},
+        default_mapped_value=0,
+        to_categorical=True,
+        nb_categories=3)
+
+
+def _time_case(case,repeat):
+    func,nbytes=case
+    func()
+    times=[]
+    for _ in range(repeat):
+        start=time.perf_counter()
+        func()
+        times.append(time.perf_counter()-start)
+    tracemalloc.start()
+    func()
+    _,peak=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    median=float(np.median(times))
+    return {
+        'median': median,
+        'min': float(np.min(times)),
+        'max': float(np.max(times)),
+        'repeat': repeat,
+        'bytes': nbytes,
+        'mb_per_second': (nbytes/1e6/median) if (nbytes and median) else None,
+        'peak_bytes': peak }
+
+
+def _meta(repeat):
+    import rasterio
+    try:
+        commit=subprocess.run(
+            ['git','rev-parse','HEAD'],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit=None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'rasterio': rasterio.__version__,
+        'gdal': rasterio.__gdal_version__,
+        'platform': platform.platform(),
+        'repeat': repeat }
+
+
+def _load(results):
+    if isinstance(results,str):
+        with open(results,'r') as file:
+            return json.load(file)
+    return results
+
+
+def _print_result(name,stats):
+    throughput=stats['mb_per_second']
+    throughput=f'{throughput:10.1f} MB/s' if throughput else ' '*15
+    print(
+        f'{name:<32} {stats["median"]*1000:10.3f} ms {throughput} '
+        f'peak {stats["peak_bytes"]/1e6:8.2f} MB')
+
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import os
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+#
+# CONSTANTS
+#
+CRS='EPSG:32633'
+ORIGIN=(500000,4000000)
+RES=10
+BLOCK_SIZE=256
+OVERVIEWS=[2,4,8]
+
+
+#
+# METHODS
+#
+def raster(
+        path,
+        size=1024,
+        count=4,
+        dtype='uint16',
+        compress='lzw',
+        tiled=True,
+        block_size=BLOCK_SIZE,
+        overviews=None,
+        nb_categories=None,
+        nodata=None,
+        res=RES,
+        seed=0):
+    """ write a synthetic GeoTIFF
+
+    Args:
+        path<str>: destination path
+        size<int|tuple>: size or (height, width)
+        count<int>: number of bands
+        dtype<str>: data type
+        compress<str|None>: compression (lzw, deflate, None, ...)
+        tiled<bool>: tiled or striped layout
+        block_size<int>: tile size (if tiled)
+        overviews<list|True|None>: overview factors (True for [2,4,8])
+        nb_categories<int|None>: if passed write smooth categorical values in [0, nb_categories)
+        nodata<number|None>: nodata value
+        res<float>: resolution
+        seed<int>: random seed
+    Returns:
+        <str> path
+    """
+    if isinstance(size,int):
+        size=(size,size)
+    height,width=size
+    rng=np.random.default_rng(seed)
+    if nb_categories:
+        im=_categorical(rng,count,height,width,nb_categories).astype(dtype)
+    else:
+        im=_continuous(rng,count,height,width,dtype)
+    profile={
+        'driver': 'GTiff',
+        'width': width,
+        'height': height,
+        'count': count,
+        'dtype': dtype,
+        'crs': CRS,
+        'transform': from_origin(ORIGIN[0],ORIGIN[1],res,res),
+        'nodata': nodata }
+    if compress:
+        profile['compress']=compress
+    if tiled:
+        profile.update(tiled=True,blockxsize=block_size,blockysize=block_size)
+    dirname=os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname,exist_ok=True)
+    with rio.open(path,'w',**profile) as dst:
+        dst.write(im)
+        if overviews:
+            if overviews is True:
+                overviews=OVERVIEWS
+            dst.build_overviews(overviews,Resampling.nearest)
+    return path
+
+
+def pair(
+        folder,
+        name='pair',
+        size=1024,
+        count=4,
+        dtype='uint16',
+        nb_categories=4,
+        **kwargs):
+    """ write a synthetic input/target pair
+
+    Returns:
+        <tuple> input_path, target_path
+    """
+    input_path=raster(
+        os.path.join(folder,f'{name}.input.tif'),
+        size=size,
+        count=count,
+        dtype=dtype,
+        **kwargs)
+    target_path=raster(
+        os.path.join(folder,f'{name}.target.tif'),
+        size=size,
+        count=1,
+        dtype='uint8',
+        nb_categories=nb_categories,
+        **kwargs)
+    return input_path, target_path
+
+
+def image(shape=(4,512,512),dtype='uint16',nb_categories=None,seed=0):
+    """ synthetic in-memory image (2D or bands-first 3D shape) """
+    rng=np.random.default_rng(seed)
+    shape=tuple(shape)
+    if len(shape)==2:
+        return image((1,)+shape,dtype=dtype,nb_categories=nb_categories,seed=seed)[0]
+    if nb_categories:
+        return _categorical(rng,*shape,nb_categories).astype(dtype)
+    else:
+        return _continuous(rng,*shape,dtype)
+
+
+#
+# INTERNAL
+#
+def _continuous(rng,count,height,width,dtype):
+    y,x=np.mgrid[0:height,0:width]
+    im=np.empty((count,height,width),dtype=np.float64)
+    for b in range(count):
+        fx,fy=rng.uniform(0.001,0.02,size=2)
+        im[b]=1000+500*np.sin(fx*x+b)*np.cos(fy*y)+rng.normal(0,50,(height,width))
+    if np.issubdtype(np.dtype(dtype),np.integer):
+        info=np.iinfo(dtype)
+        im=im.clip(info.min,info.max).round()
+    return im.astype(dtype)
+
+
+def _categorical(rng,count,height,width,nb_categories):
+    cells=rng.integers(0,nb_categories,(count,height//32+1,width//32+1))
+    return cells.repeat(32,axis=1).repeat(32,axis=2)[:,:height,:width]
@@ -0,0 +1,313 @@
+import os
+import re
+import time
+import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+import urllib.request
+from contextlib import contextmanager
+import imagebox.config as config
+#
+# CONSTANTS
+#
+GCS_HEAD=r'^gs://'
+HTTP_HEAD=r'^https?://'
+DATA_EXT='.data'
+META_EXT='.json'
+LOCK_EXT='.lock'
+EVICTION_LOCK='.eviction.lock'
+TMP_EXT='.tmp'
+STALE_TMP_SECONDS=3600
+CHUNK_SIZE=1024*1024
+UNSUPPORTED_URL_ERROR='imagebox.cache: unsupported remote url'
+
+
+#
+# RemoteCache
+#
+class RemoteCache(object):
+    """ RemoteCache
+
+    Read-through local disk cache for remote images.
+
+    Objects are downloaded once and stored under `root`, keyed by the url and
+    the object's version (GCS generation or HTTP ETag/Last-Modified), so a 
+    changed remote object is fetched again. Windowed reads then go to the 
+    local copy, and remote traffic is paid once per dataset rather than once
+    per read. The total size is kept under `max_bytes` by evicting the least 
+    recently used objects.
+
+    The cache is safe to share between threads and worker processes: 
+    downloads go to a temporary file that is atomically renamed into place,
+    concurrent requests for the same object are serialized with a file lock,
+    and eviction holds a cache-wide lock. Temporary files left by crashed
+    downloads (not written to for STALE_TMP_SECONDS) are removed on eviction.
+
+    Usage:
+        cache=RemoteCache('/tmp/imagebox-cache',max_bytes=50*1024**3)
+        local_path=cache.path('gs://bucket/path/image.tif')
+        im,profile=io.read(local_path,window=window)
+
+    Args:
+        root<str|None>: cache directory (defaults to config.REMOTE_CACHE_DIR)
+        max_bytes<int|None>: 
+            - maximum cache size in bytes
+            - defaults to config.REMOTE_CACHE_SIZE (unlimited if not set)
+        fetch<callable|None>: 
+            - fetch(url,dest) download url to local path dest
+            - defaults to gcs (gs://) or urllib (http/https)
+        version<callable|None>: 
+            - version(url) returns a string identifying the object version
+            - defaults to gcs generation or http ETag/Last-Modified
+        revalidate<int|float|None>: 
+            - seconds a looked-up version is trusted before checking again
+            - None: look up each url's version once per process
+    """
+    def __init__(self,
+            root=None,
+            max_bytes=None,
+            fetch=None,
+            version=None,
+            revalidate=None):
+        self.root=config.get('REMOTE_CACHE_DIR',root)
+        self.max_bytes=config.get('REMOTE_CACHE_SIZE',max_bytes)
+        self.fetch=fetch or fetch_url
+        self.version=version or url_version
+        self.revalidate=revalidate
+        self._versions={}
+        self._lock=threading.Lock()
+        os.makedirs(self.root,exist_ok=True)
+
+
+    def path(self,url):
+        """ local path for url (downloading the object if it is not cached) """
+        key=self.key(url)
+        dest=self._data_path(key)
+        if os.path.exists(dest):
+            _touch(dest)
+            return dest
+        with _file_lock(self._lock_path(key)):
+            if not os.path.exists(dest):
+                self._download(url,key,dest)
+        self.evict()
+        return dest
+
+
+    def read(self,url,reader,**kwargs):
+        """ reader(local_path,**kwargs) for url
+
+        Retries once if the object is evicted between download and read.
+        """
+        try:
+            return reader(self.path(url),**kwargs)
+        except Exception:
+            if os.path.exists(self._data_path(self.key(url))):
+                raise
+            return reader(self.path(url),**kwargs)
+
+
+    def key(self,url):
+        """ cache key for url and its current version """
+        version=self._version(url)
+        return hashlib.sha1(f'{url}@{version}'.encode()).hexdigest()
+
+
+    def evict(self,max_bytes=None):
+        """ remove least recently used objects until size <= max_bytes """
+        self._remove_stale_tmp()
+        if max_bytes is None:
+            max_bytes=self.max_bytes
+        if max_bytes is None:
+            return
+        with _file_lock(os.path.join(self.root,EVICTION_LOCK)):
+            entries=self.entries()
+            size=sum(e['size'] for e in entries)
+            for entry in sorted(entries,key=lambda e: e['atime']):
+                if size<=max_bytes:
+                    break
+                with _file_lock(self._lock_path(entry['key']),blocking=False) as locked:
+                    if locked:
+                        self._remove(entry['key'])
+                        size-=entry['size']
+
+
+    def entries(self):
+        """ list of cached objects (key, url, version, size, atime) """
+        entries=[]
+        for name in os.listdir(self.root):
+            if name.endswith(DATA_EXT):
+                key=name[:-len(DATA_EXT)]
+                try:
+                    stat=os.stat(self._data_path(key))
+                    with open(self._meta_path(key),'r') as file:
+                        meta=json.load(file)
+                except (OSError,ValueError):
+                    continue
+                meta.update({'key':key,'size':stat.st_size,'atime':stat.st_mtime})
+                entries.append(meta)
+        return entries
+
+
+    def size(self):
+        """ total size of cached objects in bytes """
+        return sum(e['size'] for e in self.entries())
+
+
+    def clear(self):
+        """ remove all cached objects """
+        for entry in self.entries():
+            with _file_lock(self._lock_path(entry['key'])):
+                self._remove(entry['key'])
+        self._remove_stale_tmp()
+
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        del state['_lock']
+        return state
+
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock=threading.Lock()
+
+
+    #
+    # INTERNAL
+    #
+    def _version(self,url):
+        with self._lock:
+            version,checked=self._versions.get(url,(None,None))
+        expired=(self.revalidate is not None) and (
+            (checked is None) or (time.time()-checked>self.revalidate))
+        if (checked is None) or expired:
+            version=self.version(url)
+            with self._lock:
+                self._versions[url]=(version,time.time())
+        return version
+
+
+    def _download(self,url,key,dest):
+        fd,tmp=tempfile.mkstemp(dir=self.root,suffix=TMP_EXT)
+        os.close(fd)
+        try:
+            self.fetch(url,tmp)
+            with open(self._meta_path(key),'w') as file:
+                json.dump({'url':url,'version':self._version(url)},file)
+            os.replace(tmp,dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+    def _remove(self,key):
+        """ remove a cached object (the caller holds its lock, see _file_lock) """
+        for path in (self._data_path(key),self._meta_path(key),self._lock_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+    def _remove_stale_tmp(self,max_age=STALE_TMP_SECONDS):
+        """ remove temporary downloads not modified for max_age seconds """
+        now=time.time()
+        for name in os.listdir(self.root):
+            if name.endswith(TMP_EXT):
+                path=os.path.join(self.root,name)
+                try:
+                    if now-os.stat(path).st_mtime>=max_age:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+    def _data_path(self,key):
+        return os.path.join(self.root,f'{key}{DATA_EXT}')
+
+
+    def _meta_path(self,key):
+        return os.path.join(self.root,f'{key}{META_EXT}')
+
+
+    def _lock_path(self,key):
+        return os.path.join(self.root,f'{key}{LOCK_EXT}')
+
+
+#
+# FETCHERS
+#
+def fetch_url(url,dest):
+    """ download gs:// or http(s):// url to dest """
+    if re.search(GCS_HEAD,url):
+        _gcs_blob(url).download_to_filename(dest)
+    elif re.search(HTTP_HEAD,url):
+        with urllib.request.urlopen(url) as src, open(dest,'wb') as dst:
+            shutil.copyfileobj(src,dst,CHUNK_SIZE)
+    else:
+        raise ValueError(f'{UNSUPPORTED_URL_ERROR}: {url}')
+
+
+def url_version(url):
+    """ version string for gs:// (generation) or http(s):// (etag) url """
+    if re.search(GCS_HEAD,url):
+        blob=_gcs_blob(url)
+        blob.reload()
+        return str(blob.generation)
+    elif re.search(HTTP_HEAD,url):
+        request=urllib.request.Request(url,method='HEAD')
+        with urllib.request.urlopen(request) as response:
+            headers=response.headers
+            return headers.get('ETag') or headers.get('Last-Modified') or ''
+    else:
+        raise ValueError(f'{UNSUPPORTED_URL_ERROR}: {url}')
+
+
+#
+# INTERNAL
+#
+def _gcs_blob(url):
+    from google.cloud import storage
+    import gcs_helpers.fetch as gfetch
+    bucket,key=gfetch.bucket_key_from_path(url)
+    return storage.Client().bucket(bucket).blob(key)
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def _file_lock(path,blocking=True):
+    """ exclusive flock on path (yields False if not blocking and the lock is held)
+
+    Lock files are removed with their object, so after acquiring the lock 
+    check it is still the file at path (a waiter may have opened a lock file 
+    that was removed while it waited) and retry if not.
+    """
+    flags=fcntl.LOCK_EX if blocking else fcntl.LOCK_EX|fcntl.LOCK_NB
+    while True:
+        with open(path,'a') as file:
+            try:
+                fcntl.flock(file,flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                current=(os.stat(path).st_ino==os.fstat(file.fileno()).st_ino)
+            except FileNotFoundError:
+                current=False
+            if not current:
+                fcntl.flock(file,fcntl.LOCK_UN)
+                continue
+            try:
+                yield True
+            finally:
+                fcntl.flock(file,fcntl.LOCK_UN)
+            return
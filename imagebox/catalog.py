@@ -0,0 +1,262 @@
+import os
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from affine import Affine
+import imagebox.io as io
+import imagebox.config as config
+import imagebox.resources as resources
+#
+# CONSTANTS
+#
+TABLE='rasters'
+SCAN='catalog.scan'
+COLUMNS=[
+    'path',
+    'width',
+    'height',
+    'count',
+    'dtype',
+    'block_width',
+    'block_height',
+    'res',
+    'transform',
+    'crs',
+    'nodata',
+    'overviews',
+    'mtime',
+    'size' ]
+JSON_COLUMNS=['res','transform','overviews']
+SCHEMA=f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    path TEXT PRIMARY KEY,
+    width INTEGER,
+    height INTEGER,
+    count INTEGER,
+    dtype TEXT,
+    block_width INTEGER,
+    block_height INTEGER,
+    res TEXT,
+    transform TEXT,
+    crs TEXT,
+    nodata TEXT,
+    overviews TEXT,
+    mtime REAL,
+    size INTEGER
+)
+"""
+NOT_FOUND_ERROR='imagebox.catalog: path not in catalog'
+
+
+#
+# Catalog
+#
+class Catalog(object):
+    """ Catalog
+
+    Persistent (sqlite) raster metadata catalog.
+
+    Scan a set of rasters once (in parallel) and store shape, band count, 
+    dtype, block size, resolution, transform, crs, nodata and overview levels.
+    The handler (`catalog=`), `io.info` and `Catalog.tiller` query the catalog 
+    instead of opening the files.
+
+    Usage:
+        catalog=Catalog('rasters.db')
+        catalog.scan(paths,workers=16)
+        catalog.shape(paths[0])
+        catalog.profile(paths[0])
+        tiller=catalog.tiller(paths[0],size=256)
+        handler=InputTargetHandler(example_path=paths[0],catalog=catalog,...)
+
+    Args:
+        path<str>: sqlite database path (':memory:' for an in-memory catalog)
+    """
+    def __init__(self,path):
+        self.path=path
+        self._lock=threading.Lock()
+        self._connect()
+
+
+    def scan(self,paths,workers=None,refresh=False):
+        """ add rasters to the catalog
+
+        Args:
+            paths<list>: raster paths
+            workers<int|None>: number of threads (defaults to config.MAX_WORKERS, capped by the worker budget)
+            refresh<bool>: 
+                - if True re-scan all paths
+                - else only scan paths that are new or whose file has changed
+        Returns:
+            <int> number of rasters scanned
+        """
+        if not refresh:
+            paths=[p for p in paths if self._stale(p)]
+        if not paths:
+            return 0
+        governor=resources.governor()
+        workers=governor.workers(SCAN,workers or config.MAX_WORKERS)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                records=list(pool.map(io.info,paths))
+        finally:
+            governor.release_workers(SCAN)
+        self.add(records)
+        return len(records)
+
+
+    def add(self,records):
+        """ insert or replace io.info records """
+        rows=[self._to_row(r) for r in records]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f'INSERT OR REPLACE INTO {TABLE} ({",".join(COLUMNS)}) '
+                f'VALUES ({",".join("?"*len(COLUMNS))})',
+                rows)
+
+
+    def get(self,path):
+        """ metadata record for path (or None) """
+        with self._lock:
+            row=self._conn.execute(
+                f'SELECT {",".join(COLUMNS)} FROM {TABLE} WHERE path=?',
+                (path,)).fetchone()
+        if row:
+            return self._from_row(row)
+
+
+    def records(self,paths=None):
+        """ list of metadata records (for paths or all rasters) """
+        if paths is None:
+            with self._lock:
+                rows=self._conn.execute(
+                    f'SELECT {",".join(COLUMNS)} FROM {TABLE} ORDER BY path').fetchall()
+            return [self._from_row(r) for r in rows]
+        else:
+            return [self._record(p) for p in paths]
+
+
+    def paths(self):
+        """ list of cataloged paths """
+        with self._lock:
+            rows=self._conn.execute(f'SELECT path FROM {TABLE} ORDER BY path').fetchall()
+        return [r[0] for r in rows]
+
+
+    def shape(self,path,bands_first=None):
+        """ image shape (bands-first or bands-last) """
+        bands_first=config.get('BANDS_FIRST',bands_first)
+        record=self._record(path)
+        if bands_first:
+            return record['count'], record['height'], record['width']
+        else:
+            return record['height'], record['width'], record['count']
+
+
+    def profile(self,path):
+        """ rasterio style profile for path """
+        record=self._record(path)
+        return {
+            'driver': 'GTiff',
+            'crs': record['crs'],
+            'transform': record['transform'],
+            'width': record['width'],
+            'height': record['height'],
+            'count': record['count'],
+            'dtype': record['dtype'],
+            'nodata': record['nodata'],
+            'blockxsize': record['block_width'],
+            'blockysize': record['block_height'] }
+
+
+    def tiller(self,path,**tiller_config):
+        """ Tiller for the raster's shape """
+        from imagebox.handler import Tiller
+        record=self._record(path)
+        return Tiller(
+            boundary_shape=(record['height'],record['width']),
+            **tiller_config)
+
+
+    def remove(self,paths):
+        """ remove paths from the catalog """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f'DELETE FROM {TABLE} WHERE path=?',
+                [(p,) for p in paths])
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {TABLE}').fetchone()[0]
+
+
+    def __contains__(self,path):
+        return self.get(path) is not None
+
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        del state['_lock']
+        del state['_conn']
+        return state
+
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock=threading.Lock()
+        self._connect()
+
+
+    #
+    # INTERNAL
+    #
+    def _connect(self):
+        self._conn=sqlite3.connect(self.path,check_same_thread=False)
+        with self._conn:
+            self._conn.execute(SCHEMA)
+
+
+    def _record(self,path):
+        record=self.get(path)
+        if record is None:
+            raise KeyError(f'{NOT_FOUND_ERROR}: {path}')
+        return record
+
+
+    def _stale(self,path):
+        record=self.get(path)
+        if record is None:
+            return True
+        if (record['mtime'] is None) or (not os.path.exists(path)):
+            return False
+        return os.stat(path).st_mtime!=record['mtime']
+
+
+    def _to_row(self,record):
+        record=record.copy()
+        record['res']=list(record['res'])
+        record['transform']=list(record['transform'])[:6]
+        for key in JSON_COLUMNS:
+            record[key]=json.dumps(record[key])
+        # nodata is stored as text: sqlite stores a NaN REAL as NULL
+        if record['nodata'] is not None:
+            record['nodata']=repr(float(record['nodata']))
+        return [record[c] for c in COLUMNS]
+
+
+    def _from_row(self,row):
+        record=dict(zip(COLUMNS,row))
+        for key in JSON_COLUMNS:
+            record[key]=json.loads(record[key])
+        record['res']=tuple(record['res'])
+        record['transform']=Affine(*record['transform'])
+        if record['nodata'] is not None:
+            record['nodata']=float(record['nodata'])
+        return record
@@ -0,0 +1,847 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from rasterio.windows import Window
+import imagebox.io as io
+import imagebox.resources as resources
+import imagebox.processor as proc
+import imagebox.indices as indices
+import imagebox.jobs as jobs
+import imagebox.mosaic as mosaic
+from imagebox.catalog import Catalog
+from imagebox.handler import Tiller, PAD, EDGE_MODES
+from imagebox.config import FIRST
+#
+# CONSTANTS
+#
+EXTENSIONS=('.tif','.tiff')
+BLOCK_SIZE=1024
+TILE_SIZE=256
+WORKERS='cli.workers'
+UNITS='cli.units'
+INFLIGHT_PER_WORKER=2
+WORKING_COPIES=2
+UNITS_SUFFIXES={ 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4 }
+STATS_KEYS=['count','mean','std','min','max']
+NO_PATHS_ERROR='imagebox.cli: no input rasters found'
+NORMALIZE_ERROR='imagebox.cli.normalize: pass stats or means and stdevs'
+BYTES_ERROR='imagebox.cli: memory limit must be bytes or a number with a K/M/G/T suffix'
+BLOCK_SIZE_ERROR='imagebox.cli: block_size of written rasters must be a multiple of 16'
+
+
+#
+# COMMANDS
+#
+def tile(
+        paths,
+        output_dir,
+        size=TILE_SIZE,
+        overlap=0,
+        edge=None,
+        workers=None,
+        catalog=None,
+        progress=True,
+        job=None,
+        shards=1,
+        shard=None,
+        retry=False):
+    """ cut rasters into tiles (one file per tiller window)
+
+    Tiles are written to `output_dir/<name>_<col_off>_<row_off>.tif`.
+
+    If `job` is passed the run is resumable/shardable (see imagebox.jobs): 
+    finished tiles are recorded in the job's journal and skipped on restart.
+
+    Args:
+        paths<list>: raster paths
+        output_dir<str>: output directory
+        size,overlap,edge: Tiller args (edge='pad' tiles are read boundless)
+        workers<int|None>: number of processes (defaults to all cores, capped by the worker budget)
+        catalog<str|Catalog|None>: catalog (or catalog path) used for raster metadata
+        progress<bool>: report progress on stderr
+        job<str|None>: job directory
+        shards<int>: number of shards (nodes) of the job
+        shard<int|None>: 
+            - shard to run
+            - if None claim an unclaimed shard (or run every unit if shards=1)
+        retry<bool>: retry quarantined units
+    Returns:
+        <list> tile paths (written by this run)
+    """
+    catalog=_catalog(catalog)
+    infos=_infos(paths,catalog)
+    units=[]
+    unit_bytes=0
+    for info in infos:
+        tiller=Tiller(
+            boundary_shape=(info['height'],info['width']),
+            size=size,
+            overlap=overlap,
+            edge=edge)
+        units+=_units(info,tiller.windows)
+        unit_bytes=max(
+            unit_bytes,
+            _window_bytes(tiller.tile_width,tiller.tile_height,info['count'],np.float64))
+    tile_paths=[]
+    if job is None:
+        run(_tile_unit,
+            units,
+            args=(output_dir,edge==PAD),
+            workers=workers,
+            unit_bytes=unit_bytes,
+            on_result=lambda unit,tile_path: tile_paths.append(tile_path),
+            progress=progress and 'tile')
+    else:
+        job=jobs.Job(
+            job,
+            paths,
+            shards=shards,
+            size=size,
+            overlap=overlap,
+            edge=edge,
+            catalog=catalog)
+        if (shard is None) and (shards>1):
+            shard=job.claim()
+            if shard is None:
+                return tile_paths
+        job.run(_tile_unit,
+            shard=shard,
+            args=(output_dir,edge==PAD),
+            workers=workers,
+            unit_bytes=unit_bytes,
+            on_result=lambda index,tile_path: tile_paths.append(tile_path),
+            retry=retry,
+            progress=progress and 'tile')
+    return tile_paths
+
+
+def index(
+        paths,
+        output_dir,
+        index_name,
+        indices_name=None,
+        block_size=BLOCK_SIZE,
+        workers=None,
+        catalog=None,
+        progress=True):
+    """ band index (see imagebox.indices) for each raster
+
+    Outputs are single band float32 rasters `output_dir/<name>_<index_name>.tif`.
+
+    Args:
+        paths<list>: raster paths
+        output_dir<str>: output directory
+        index_name<str>: index key (e.g. 'ndvi')
+        indices_name<str|None>: band ordering of the indices ('ordered','s2_1020' or None)
+        block_size<int>: size of the windows processed by each unit of work (and of the output blocks, a multiple of 16)
+        workers,catalog,progress: see tile
+    Returns:
+        <list> output paths
+    """
+    return _map_blocks(
+        _index_unit,
+        paths,
+        output_dir,
+        args=(index_name,indices_name),
+        suffix=index_name,
+        profile={ 'count': 1, 'dtype': 'float32', 'nodata': None },
+        block_size=block_size,
+        workers=workers,
+        catalog=catalog,
+        progress=progress and 'index')
+
+
+def normalize(
+        paths,
+        output_dir,
+        means=None,
+        stdevs=None,
+        stats=None,
+        dtype='float32',
+        block_size=BLOCK_SIZE,
+        workers=None,
+        catalog=None,
+        progress=True):
+    """ normalize rasters with band-wise means and stdevs
+
+    Args:
+        paths<list>: raster paths
+        output_dir<str>: output directory
+        means/stdevs<list|None>: band-wise means and standard deviations
+        stats<dict|str|None>:
+            - output of `stats` (or path to the stats json)
+            - used for means/stdevs if they are not passed
+        dtype<str>: output dtype
+        block_size,workers,catalog,progress: see index
+    Returns:
+        <list> output paths
+    """
+    if stats is not None:
+        if isinstance(stats,str):
+            with open(stats,'r') as file:
+                stats=json.load(file)
+        if means is None:
+            means=stats['mean']
+        if stdevs is None:
+            stdevs=stats['std']
+    if (means is None) or (stdevs is None):
+        raise ValueError(NORMALIZE_ERROR)
+    return _map_blocks(
+        _normalize_unit,
+        paths,
+        output_dir,
+        args=(list(means),list(stdevs),dtype),
+        profile={ 'dtype': dtype, 'nodata': None },
+        block_size=block_size,
+        workers=workers,
+        catalog=catalog,
+        progress=progress and 'normalize')
+
+
+def remap(
+        paths,
+        output_dir,
+        value_map,
+        default_value=proc.DEFAULT_VMAP_VALUE,
+        dtype=None,
+        block_size=BLOCK_SIZE,
+        workers=None,
+        catalog=None,
+        progress=True):
+    """ remap raster values (see processor.map_values)
+
+    Args:
+        paths<list>: raster paths
+        output_dir<str>: output directory
+        value_map<dict>: { new_value: [values,...], ... }
+        default_value<number|'image'>: value for unmapped values ('image' keeps them)
+        dtype<str|None>: output dtype (defaults to the input dtype)
+        block_size,workers,catalog,progress: see index
+    Returns:
+        <list> output paths
+    """
+    profile={}
+    if dtype:
+        profile['dtype']=dtype
+    return _map_blocks(
+        _remap_unit,
+        paths,
+        output_dir,
+        args=(value_map,default_value,dtype),
+        profile=profile,
+        block_size=block_size,
+        workers=workers,
+        catalog=catalog,
+        progress=progress and 'remap')
+
+
+def stats(
+        paths,
+        block_size=BLOCK_SIZE,
+        per_file=False,
+        workers=None,
+        catalog=None,
+        progress=True):
+    """ band-wise count, mean, std, min and max over all rasters
+
+    Nodata and non-finite values are ignored. Partial statistics of each
+    window are merged exactly (parallel mean/variance), so the result does
+    not depend on the block size or number of workers.
+
+    Args:
+        paths<list>: raster paths (with the same number of bands)
+        block_size,workers,catalog,progress: see index
+        per_file<bool>: if True include the statistics of each file (under 'files')
+    Returns:
+        <dict> count, mean, std, min, max (lists with a value for each band)
+    """
+    infos=_infos(paths,catalog)
+    units=[]
+    for info in infos:
+        units+=_units(info,_blocks(info,block_size))
+    totals={}
+    def _add(unit,partial):
+        totals[unit[0]]=_merge_stats(totals.get(unit[0]),partial)
+    run(_stats_unit,
+        units,
+        workers=workers,
+        unit_bytes=_window_bytes(block_size,block_size,_max_count(infos),np.float64),
+        on_result=_add,
+        progress=progress and 'stats')
+    total=None
+    for info in infos:
+        total=_merge_stats(total,totals.get(info['path']))
+    out=_stats_dict(total)
+    if per_file:
+        out['files']={ info['path']: _stats_dict(totals.get(info['path'])) for info in infos }
+    return out
+
+
+#
+# RUNNER
+#
+def run(
+        worker,
+        units,
+        args=(),
+        workers=None,
+        unit_bytes=None,
+        on_result=None,
+        progress=True):
+    """ run worker(*unit,*args) for each (path, window, ...) unit in a process pool
+
+    The number of processes is capped by the worker budget and the number of
+    units in flight is capped so that in-flight units fit in the memory
+    budget (see imagebox.resources). Each process gets an equal share of the
+    remaining budgets. Results are passed to `on_result(unit,result)` in the
+    parent process as they complete.
+
+    Args:
+        worker<func>: picklable function returning (result, bytes_read)
+        units<list>: tuples of worker args (usually (path, window, ...))
+        args<tuple>: extra worker args
+        workers<int|None>: number of processes (defaults to all cores)
+        unit_bytes<int|None>: estimated memory used by a unit
+        on_result<func|None>: result callback
+        progress<bool|str>: report progress (a string is used as the progress label)
+    Returns:
+        <int> number of units run
+    """
+    governor=resources.governor()
+    workers=governor.workers(WORKERS,workers or os.cpu_count() or 1)
+    inflight=INFLIGHT_PER_WORKER*workers
+    available=governor.available()
+    if unit_bytes and (available is not None):
+        inflight=max(1,min(inflight,available//unit_bytes))
+        workers=min(workers,inflight)
+    reservation=governor.reserve(UNITS,inflight*(unit_bytes or 0),strict=False)
+    report=Progress(
+        len(units),
+        name=progress if isinstance(progress,str) else '',
+        enabled=bool(progress))
+    try:
+        if workers==1:
+            for unit in units:
+                _handle(unit,worker(*unit,*args),on_result,report)
+        else:
+            _run_pool(worker,units,args,workers,inflight,on_result,report)
+    finally:
+        report.close()
+        reservation.release()
+        governor.release_workers(WORKERS)
+    return len(units)
+
+
+class Progress(object):
+    """ Progress
+
+    Units done, units per second and MB per second (of data read) on stderr.
+
+    Args:
+        total<int>: number of units
+        name<str>: label
+        stream<file|None>: output stream (defaults to sys.stderr)
+        interval<float>: minimum seconds between updates
+        enabled<bool>: if False do nothing
+    """
+    def __init__(self,total,name='',stream=None,interval=0.5,enabled=True):
+        self.total=total
+        self.name=name
+        self.stream=stream or sys.stderr
+        self.interval=interval
+        self.enabled=enabled
+        self.done=0
+        self.nbytes=0
+        self.start=time.perf_counter()
+        self._reported=0
+        self._written=None
+
+
+    def update(self,nbytes=0,units=1):
+        self.done+=units
+        self.nbytes+=nbytes
+        now=time.perf_counter()
+        if self.enabled and ((now-self._reported>=self.interval) or (self.done==self.total)):
+            self._reported=now
+            self._write()
+
+
+    def message(self):
+        elapsed=max(time.perf_counter()-self.start,1e-9)
+        label=f'{self.name}: ' if self.name else ''
+        return (
+            f'{label}{self.done}/{self.total} units | '
+            f'{self.done/elapsed:.1f} units/s | '
+            f'{self.nbytes/elapsed/1024**2:.1f} MB/s | '
+            f'{elapsed:.1f}s')
+
+
+    def close(self):
+        if self.enabled:
+            if self._written!=self.done:
+                self._write()
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+    def _write(self):
+        self._written=self.done
+        self.stream.write(f'\r{self.message()}')
+        self.stream.flush()
+
+
+#
+# MAIN
+#
+def main(argv=None):
+    """ imagebox command line interface (see `imagebox --help`) """
+    args=_parser().parse_args(argv)
+    if args.memory_limit:
+        resources.configure(memory_budget=_bytes(args.memory_limit))
+    paths=_paths(args.paths)
+    if not paths:
+        raise SystemExit(NO_PATHS_ERROR)
+    common={
+        'workers': args.workers,
+        'catalog': args.catalog,
+        'progress': not args.quiet }
+    if args.command=='tile':
+        tile(paths,
+            args.output_dir,
+            size=_size(args.size),
+            overlap=args.overlap,
+            edge=args.edge,
+            job=args.job,
+            shards=args.shards,
+            shard=args.shard,
+            retry=args.retry,
+            **common)
+    elif args.command=='index':
+        index(paths,
+            args.output_dir,
+            args.index,
+            indices_name=args.indices,
+            block_size=args.block_size,
+            **common)
+    elif args.command=='normalize':
+        normalize(paths,
+            args.output_dir,
+            means=args.means,
+            stdevs=args.stdevs,
+            stats=args.stats,
+            dtype=args.dtype,
+            block_size=args.block_size,
+            **common)
+    elif args.command=='remap':
+        remap(paths,
+            args.output_dir,
+            _value_map(args.map),
+            default_value=_number(args.default),
+            dtype=args.dtype,
+            block_size=args.block_size,
+            **common)
+    elif args.command=='mosaic':
+        mosaic.Mosaic(
+            paths,
+            rule=args.rule,
+            priorities=args.priorities,
+            res=args.res,
+            crs=args.crs,
+            nodata=_number(args.nodata),
+            dtype=args.dtype,
+            block_size=args.block_size,
+            catalog=args.catalog).run(
+                args.output,
+                workers=args.workers,
+                progress=not args.quiet)
+    elif args.command=='stats':
+        out=stats(paths,block_size=args.block_size,per_file=args.per_file,**common)
+        if args.output:
+            with open(args.output,'w') as file:
+                json.dump(out,file,indent=4)
+        else:
+            print(json.dumps(out,indent=4))
+
+
+#
+# WORKERS
+#
+def _tile_unit(path,window,output_dir,boundless):
+    im,profile=io.read(path,window=window,band_ordering=FIRST,boundless=boundless)
+    for key in ['tiled','blockxsize','blockysize']:
+        profile.pop(key,None)
+    tile_path=_output_path(output_dir,path,f'{window[0]}_{window[1]}')
+    io.write(im,tile_path,profile)
+    return tile_path, im.nbytes
+
+
+def _index_unit(path,window,index_name,indices_name):
+    im=io.read(path,window=window,return_profile=False)
+    out=indices.index(im,index_name,indices_name).astype(np.float32)
+    return out[None], im.nbytes
+
+
+def _normalize_unit(path,window,means,stdevs,dtype):
+    im=io.read(path,window=window,return_profile=False,band_ordering=FIRST)
+    out=proc.normalize(im,means=means,stdevs=stdevs,bands_first=True)
+    return out.astype(dtype), im.nbytes
+
+
+def _remap_unit(path,window,value_map,default_value,dtype):
+    im=io.read(path,window=window,return_profile=False,band_ordering=FIRST)
+    out=proc.map_values(im,value_map,default_value=default_value)
+    if dtype:
+        out=out.astype(dtype)
+    return out, im.nbytes
+
+
+def _stats_unit(path,window):
+    im,profile=io.read(path,window=window,band_ordering=FIRST)
+    nodata=profile['nodata']
+    nb_bands=im.shape[0]
+    im=im.reshape(nb_bands,-1).astype(np.float64)
+    valid=np.isfinite(im)
+    if nodata is not None:
+        valid&=(im!=nodata)
+    count=valid.sum(axis=1)
+    safe=np.maximum(count,1)
+    total=np.where(valid,im,0).sum(axis=1)
+    mean=total/safe
+    m2=(np.where(valid,im-mean[:,None],0)**2).sum(axis=1)
+    partial={
+        'count': count.astype(np.float64),
+        'mean': mean,
+        'm2': m2,
+        'min': np.where(valid,im,np.inf).min(axis=1),
+        'max': np.where(valid,im,-np.inf).max(axis=1) }
+    return partial, im.nbytes
+
+
+def _init_worker(budgets):
+    memory_budget,worker_budget=budgets
+    resources.configure(memory_budget=memory_budget,worker_budget=worker_budget)
+
+
+#
+# INTERNAL
+#
+def _run_pool(worker,units,args,workers,inflight,on_result,report):
+    governor=resources.governor()
+    memory=governor.available()
+    if memory is not None:
+        memory=memory//workers
+    budgets=(memory,max(1,governor.worker_budget//workers))
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(budgets,)) as pool:
+        pending={}
+        units=iter(units)
+        try:
+            while True:
+                while len(pending)<inflight:
+                    unit=next(units,None)
+                    if unit is None:
+                        break
+                    pending[pool.submit(worker,*unit,*args)]=unit
+                if not pending:
+                    break
+                done,_=wait(pending,return_when=FIRST_COMPLETED)
+                for future in done:
+                    _handle(pending.pop(future),future.result(),on_result,report)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _handle(unit,output,on_result,report):
+    result,nbytes=output
+    if on_result:
+        on_result(unit,result)
+    report.update(nbytes)
+
+
+def _map_blocks(
+        worker,
+        paths,
+        output_dir,
+        args,
+        profile,
+        suffix=None,
+        block_size=BLOCK_SIZE,
+        workers=None,
+        catalog=None,
+        progress=True):
+    """ run a block worker over the windows of each raster and write the outputs
+
+    Workers return the output array for their window. Outputs are written by
+    the parent process (one open dataset per raster, closed once all of its
+    windows are written). Outputs are tiled with block_size blocks so each
+    window is written as whole blocks.
+    """
+    if block_size%16:
+        raise ValueError(BLOCK_SIZE_ERROR)
+    infos=_infos(paths,catalog)
+    units=[]
+    writers={}
+    for info in infos:
+        blocks=_blocks(info,block_size)
+        units+=_units(info,blocks)
+        writers[info['path']]=_Writer(
+            _output_path(output_dir,info['path'],suffix),
+            _output_profile(info,profile,block_size),
+            len(blocks))
+    try:
+        run(worker,
+            units,
+            args=args,
+            workers=workers,
+            unit_bytes=_window_bytes(
+                block_size,
+                block_size,
+                _max_count(infos),
+                np.float64)*WORKING_COPIES,
+            on_result=lambda unit,im: writers[unit[0]].write(im,unit[1]),
+            progress=progress)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return [w.path for w in writers.values()]
+
+
+class _Writer(object):
+    """ windowed writer that opens on the first and closes after the last window """
+    def __init__(self,path,profile,nb_windows):
+        self.path=path
+        self.profile=profile
+        self.remaining=nb_windows
+        self.dst=None
+
+
+    def write(self,im,window):
+        if self.dst is None:
+            self.dst=io.open_writer(self.path,self.profile)
+        self.dst.write(im,window=Window(*window))
+        self.remaining-=1
+        if not self.remaining:
+            self.close()
+
+
+    def close(self):
+        if self.dst is not None:
+            self.dst.close()
+            self.dst=None
+
+
+def _catalog(catalog=None):
+    if isinstance(catalog,Catalog):
+        return catalog
+    return Catalog(catalog or ':memory:')
+
+
+def _infos(paths,catalog=None):
+    catalog=_catalog(catalog)
+    catalog.scan(paths)
+    return [io.info(p,catalog=catalog) for p in paths]
+
+
+def _units(info,windows):
+    """ (path, window) units """
+    return [ (info['path'],tuple(int(v) for v in w)) for w in windows ]
+
+
+def _blocks(info,block_size):
+    """ windows covering the raster (edge windows are clipped to the raster) """
+    tiller=Tiller(
+        boundary_shape=(info['height'],info['width']),
+        size=block_size,
+        edge=PAD)
+    windows=tiller.windows.copy()
+    windows[:,2]=np.minimum(windows[:,2],info['width']-windows[:,0])
+    windows[:,3]=np.minimum(windows[:,3],info['height']-windows[:,1])
+    return windows
+
+
+def _output_path(output_dir,path,suffix=None):
+    name,ext=os.path.splitext(os.path.basename(path))
+    if suffix:
+        name=f'{name}_{suffix}'
+    return os.path.join(output_dir,f'{name}{ext or ".tif"}')
+
+
+def _output_profile(info,updates,block_size=BLOCK_SIZE):
+    profile={
+        'driver': 'GTiff',
+        'width': info['width'],
+        'height': info['height'],
+        'count': info['count'],
+        'dtype': info['dtype'],
+        'crs': info['crs'],
+        'transform': info['transform'],
+        'nodata': info['nodata'],
+        'tiled': True,
+        'blockxsize': block_size,
+        'blockysize': block_size,
+        'compress': 'lzw' }
+    profile.update(updates)
+    return profile
+
+
+def _window_bytes(width,height,count,dtype):
+    return int(width*height*count*np.dtype(dtype).itemsize)
+
+
+def _max_count(infos):
+    return max([info['count'] for info in infos] or [1])
+
+
+def _merge_stats(a,b):
+    """ merge partial (count, mean, m2, min, max) statistics """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    count=a['count']+b['count']
+    safe=np.maximum(count,1)
+    delta=b['mean']-a['mean']
+    return {
+        'count': count,
+        'mean': a['mean']+delta*b['count']/safe,
+        'm2': a['m2']+b['m2']+delta**2*a['count']*b['count']/safe,
+        'min': np.minimum(a['min'],b['min']),
+        'max': np.maximum(a['max'],b['max']) }
+
+
+def _stats_dict(partial):
+    if partial is None:
+        return { k: [] for k in STATS_KEYS }
+    count=partial['count']
+    std=np.sqrt(partial['m2']/np.maximum(count,1))
+    out={
+        'count': count.astype(int).tolist(),
+        'mean': partial['mean'].tolist(),
+        'std': std.tolist(),
+        'min': partial['min'].tolist(),
+        'max': partial['max'].tolist() }
+    for key in ['mean','std','min','max']:
+        out[key]=[v if c else None for v,c in zip(out[key],out['count'])]
+    return out
+
+
+def _paths(paths):
+    """ expand directories to the rasters they contain """
+    out=[]
+    for path in paths:
+        if os.path.isdir(path):
+            out+=sorted(
+                os.path.join(path,name) for name in os.listdir(path)
+                if name.lower().endswith(EXTENSIONS))
+        else:
+            out.append(path)
+    return out
+
+
+def _bytes(value):
+    value=str(value).strip().upper().rstrip('B')
+    try:
+        if value and (value[-1] in UNITS_SUFFIXES):
+            return int(float(value[:-1])*UNITS_SUFFIXES[value[-1]])
+        return int(value)
+    except ValueError:
+        raise ValueError(BYTES_ERROR)
+
+
+def _size(size):
+    if len(size)==1:
+        return size[0]
+    return tuple(size)
+
+
+def _number(value):
+    if value in [None,proc.IMAGE]:
+        return value
+    return json.loads(value)
+
+
+def _value_map(value):
+    """ value map from a json string or a json/yaml file """
+    if os.path.isfile(value):
+        with open(value,'r') as file:
+            if value.lower().endswith(('.yaml','.yml')):
+                import yaml
+                value_map=yaml.safe_load(file)
+            else:
+                value_map=json.load(file)
+    else:
+        value_map=json.loads(value)
+    return {
+        (k if k=='.default' else _number(str(k))): v
+        for k,v in value_map.items() }
+
+
+def _parser():
+    common=argparse.ArgumentParser(add_help=False)
+    common.add_argument('paths',nargs='+',help='rasters or directories of rasters')
+    common.add_argument('-w','--workers',type=int,default=None,
+        help='number of processes (defaults to all cores, capped by the worker budget)')
+    common.add_argument('-m','--memory-limit',default=None,
+        help='memory budget in bytes (or with a K/M/G/T suffix)')
+    common.add_argument('--catalog',default=None,
+        help='catalog database used/updated for raster metadata')
+    common.add_argument('-q','--quiet',action='store_true',help='no progress output')
+    blocks=argparse.ArgumentParser(add_help=False)
+    blocks.add_argument('--block-size',type=int,default=BLOCK_SIZE,
+        help='size of the windows processed by each unit of work (a multiple of 16 for written rasters)')
+    outputs=argparse.ArgumentParser(add_help=False)
+    outputs.add_argument('-o','--output-dir',required=True,help='output directory')
+    parser=argparse.ArgumentParser(
+        prog='imagebox',
+        description='ImageBox: parallel bulk raster jobs')
+    commands=parser.add_subparsers(dest='command',required=True)
+    cmd=commands.add_parser('tile',parents=[common,outputs],help='cut rasters into tiles')
+    cmd.add_argument('--size',type=int,nargs='+',default=[TILE_SIZE],help='tile size (or width height)')
+    cmd.add_argument('--overlap',type=int,default=0)
+    cmd.add_argument('--edge',choices=[e for e in EDGE_MODES if e],default=None)
+    cmd.add_argument('--job',default=None,
+        help='job directory (on a shared filesystem) for resumable/sharded runs')
+    cmd.add_argument('--shards',type=int,default=1,help='number of job shards (nodes)')
+    cmd.add_argument('--shard',type=int,default=None,
+        help='shard to run (defaults to claiming an unclaimed shard)')
+    cmd.add_argument('--retry',action='store_true',help='retry quarantined units')
+    cmd=commands.add_parser('index',parents=[common,outputs,blocks],help='band indices')
+    cmd.add_argument('--index',required=True,help='index name (e.g. ndvi)')
+    cmd.add_argument('--indices',choices=[indices.ORDERED,indices.S2_1020],default=None,
+        help='band ordering of the indices')
+    cmd=commands.add_parser('normalize',parents=[common,outputs,blocks],help='normalize rasters')
+    cmd.add_argument('--stats',default=None,help='stats json (output of `imagebox stats`)')
+    cmd.add_argument('--means',type=float,nargs='+',default=None)
+    cmd.add_argument('--stdevs',type=float,nargs='+',default=None)
+    cmd.add_argument('--dtype',default='float32')
+    cmd=commands.add_parser('remap',parents=[common,outputs,blocks],help='remap raster values')
+    cmd.add_argument('--map',required=True,
+        help='value map (json string or json/yaml file): {new_value: [values,...]}')
+    cmd.add_argument('--default',default=proc.IMAGE,
+        help="value for unmapped values ('image' keeps them)")
+    cmd.add_argument('--dtype',default=None)
+    cmd=commands.add_parser('mosaic',parents=[common],help='mosaic rasters into one raster')
+    cmd.add_argument('-o','--output',required=True,help='output path')
+    cmd.add_argument('--rule',choices=mosaic.RULES,default=FIRST)
+    cmd.add_argument('--priorities',type=float,nargs='+',default=None,
+        help="priority for each path (rule 'priority')")
+    cmd.add_argument('--res',type=float,default=None)
+    cmd.add_argument('--crs',default=None)
+    cmd.add_argument('--nodata',default=None)
+    cmd.add_argument('--dtype',default=None)
+    cmd.add_argument('--block-size',type=int,default=mosaic.BLOCK_SIZE)
+    cmd=commands.add_parser('stats',parents=[common,blocks],help='band statistics')
+    cmd.add_argument('--output',default=None,help='json output path (defaults to stdout)')
+    cmd.add_argument('--per-file',action='store_true',help='include the statistics of each file')
+    return parser
+
+
+if __name__=='__main__':
+    main()
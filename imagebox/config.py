@@ -1,34 +1,139 @@
 import os
-import yaml
 #
 # CONSTANTS
 #
-IMAGE_BOX_CONFIG_FILE=f'{os.getcwd()}/imagebox.config.yaml'
+CONFIG_FILENAME='imagebox.config.yaml'
 FIRST='first'
 LAST='last'
 NOISY=os.environ.get('IMAGE_BOX_NOISE',False)
+SETTINGS=[
+    'IMAGE_BOX_CONFIG_FILE',
+    'BAND_ORDERING',
+    'BANDS_FIRST',
+    'MAX_WORKERS',
+    'REMOTE_CACHE_DIR',
+    'REMOTE_CACHE_SIZE',
+    'PROFILE',
+    'MEMORY_BUDGET',
+    'WORKER_BUDGET',
+    'GDAL_CACHE' ]
 
 
 #
 # CONFIG
 #
-try: 
-    with open(IMAGE_BOX_CONFIG_FILE,'rb') as file:
-        _config=yaml.safe_load(file)
-        if NOISY:
-            print(f'IMAGE_BOX: config file loaded ({IMAGE_BOX_CONFIG_FILE})')
-except Exception as e:
-    _config={}
-    if NOISY:
-        print(f'IMAGE_BOX: config file ({IMAGE_BOX_CONFIG_FILE}) not found')
+# The config is loaded on first use (the first access of a setting such as
+# `config.BANDS_FIRST`), not on import. Settings are then set as module
+# attributes so later lookups are plain attribute lookups.
+#
+_config=None
+
+
+def load(path=None):
+    """ load config (if it has not been loaded) and return the settings
+
+    Args:
+        path<str|None>:
+            - yaml config file
+            - defaults to env IMAGE_BOX_CONFIG_FILE or imagebox.config.yaml in the cwd
+    """
+    if _config is None:
+        return reload(path)
+    else:
+        return _current()
+
+
+def reload(path=None):
+    """ (re)load config file/env-variables and return the settings
+
+    Note: values imported with `from imagebox.config import X` and objects
+    already created with the old settings are not updated.
+    """
+    global _config
+    if path is None:
+        path=os.environ.get(
+            'IMAGE_BOX_CONFIG_FILE',
+            os.path.join(os.getcwd(),CONFIG_FILENAME))
+    _config=_read(path)
+    globals().update(_settings(_config,path))
+    return _current()
+
+
+def settings():
+    """ dict of the current settings """
+    return load()
 
 
-BAND_ORDERING=_config.get(
-    'band_ordering',
-    os.environ.get('IMAGE_BOX_BAND_ORDERING',FIRST))
+def get(name,value=None):
+    """ value if not None else the setting `name` (e.g. get('BANDS_FIRST',bands_first)) """
+    if value is None:
+        if _config is None:
+            load()
+        return globals()[name]
+    else:
+        return value
+
+
+def __getattr__(name):
+    if (name in SETTINGS) and (_config is None):
+        load()
+        return globals()[name]
+    raise AttributeError(f"module 'imagebox.config' has no attribute '{name}'")
 
 
 #
-# DERIVED
+# INTERNAL
 #
-BANDS_FIRST=BAND_ORDERING==FIRST
+def _current():
+    return { name: globals()[name] for name in SETTINGS }
+
+
+def _read(path):
+    try:
+        import yaml
+        with open(path,'rb') as file:
+            config=yaml.safe_load(file) or {}
+            if NOISY:
+                print(f'IMAGE_BOX: config file loaded ({path})')
+    except Exception as e:
+        config={}
+        if NOISY:
+            print(f'IMAGE_BOX: config file ({path}) not found')
+    return config
+
+
+def _settings(config,path):
+    band_ordering=config.get(
+        'band_ordering',
+        os.environ.get('IMAGE_BOX_BAND_ORDERING',FIRST))
+    remote_cache_size=config.get(
+        'remote_cache_size',
+        os.environ.get('IMAGE_BOX_REMOTE_CACHE_SIZE'))
+    if remote_cache_size is not None:
+        remote_cache_size=int(remote_cache_size)
+    return {
+        'IMAGE_BOX_CONFIG_FILE': path,
+        'BAND_ORDERING': band_ordering,
+        'BANDS_FIRST': band_ordering==FIRST,
+        'MAX_WORKERS': int(config.get(
+            'max_workers',
+            os.environ.get('IMAGE_BOX_MAX_WORKERS',4))),
+        'REMOTE_CACHE_DIR': config.get(
+            'remote_cache_dir',
+            os.environ.get(
+                'IMAGE_BOX_REMOTE_CACHE_DIR',
+                os.path.join(os.path.expanduser('~'),'.cache','imagebox'))),
+        'REMOTE_CACHE_SIZE': remote_cache_size,
+        'MEMORY_BUDGET': _int_or_none(config,'memory_budget','IMAGE_BOX_MEMORY_BUDGET'),
+        'WORKER_BUDGET': _int_or_none(config,'worker_budget','IMAGE_BOX_WORKER_BUDGET'),
+        'GDAL_CACHE': _int_or_none(config,'gdal_cache','IMAGE_BOX_GDAL_CACHE'),
+        'PROFILE': str(config.get(
+            'profile',
+            os.environ.get('IMAGE_BOX_PROFILE',False))).lower() in ['true','1'] }
+
+
+def _int_or_none(config,key,env):
+    value=config.get(key,os.environ.get(env))
+    if value is not None:
+        value=int(value)
+    return value
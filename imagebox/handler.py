@@ -1,22 +1,38 @@
+import os
 import math
-from random import randint
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from rasterio.enums import Resampling
 import numpy as np
-import gcs_helpers.fetch as gfetch
 import imagebox.io as io
 import imagebox.processor as proc
 import imagebox.indices as indices
-from imagebox.config import FIRST, LAST, BAND_ORDERING, BANDS_FIRST
+import imagebox.profiler as profiler
+import imagebox.resources as resources
+from imagebox.cache import RemoteCache
+import imagebox.config as config
+from imagebox.config import FIRST, LAST
 
 #
 # CONSTANTS
 # 
-INPUT_DTYPE=np.float
+INPUT_DTYPE=np.float64
 TARGET_DTYPE=np.int64
+PRECISIONS=['float64','float32','float16']
 DEFAULT_SIZE=256
 DEFAULT_OVERLAP=0
+EXECUTOR='handler.executor'
+READ_CACHE='handler.read_cache'
+SHIFT='shift'
+PAD='pad'
+EDGE_MODES=[None,SHIFT,PAD]
 INPUT_RESAMPLING=Resampling.bilinear
 TARGET_RESAMPLING=Resampling.mode
+MEMORY_RESAMPLING={
+    Resampling.mode: proc.MODE,
+    Resampling.average: proc.MEAN,
+    Resampling.nearest: proc.NEAREST }
 TO_CATEGORICAL_ERROR=(
     'imagebox.handler: '
     'nb_categories required for to_categorical' )
@@ -27,6 +43,24 @@ SAFE_RESCALE_ERROR=(
 DIMS_REQUIRED_ERROR=(
     'imagebox.handler: '
     'width and height, or example_path, required for (float)cropping' )
+BATCH_LIST_VALUE_MAP_ERROR=(
+    'imagebox.handler: '
+    'batch does not support list value_maps' )
+PRECISION_ERROR=(
+    'imagebox.handler: '
+    f'precision must be one of {PRECISIONS}' )
+TARGET_DTYPE_ERROR=(
+    'imagebox.handler: '
+    'target_dtype can not hold the target values' )
+WEIGHTS_ERROR=(
+    'imagebox.handler: '
+    "weights must be 'tiles', 'files' or per-file weights" )
+EDGE_MODE_ERROR=(
+    'imagebox.handler: '
+    f'tiller edge must be one of {EDGE_MODES}' )
+MULTI_CROP_ERROR=(
+    'imagebox.handler: '
+    'multi_crop requires float_cropping' )
 
 #
 # InputTargetHandler
@@ -69,6 +103,11 @@ class InputTargetHandler(object):
             - set only one of these to be true
         target/input_resolution: rescale input or target with input/target resampling method
         input/target_resampling: resampling method for input or target
+        memory_resampling<bool>:
+            - if True, and input/target_resolution is an integer factor (or 1/integer) 
+              of the native resolution, read at native resolution and rescale in memory 
+              with processor.rescale instead of GDAL
+            - supports mode, average and nearest resampling (others use GDAL)
         padding|input/target_padding<int|None>: 
             - amount to pad images|input/target-image after processing the image
             - will be ignored if there is cropping
@@ -81,12 +120,37 @@ class InputTargetHandler(object):
             - 2*float_cropping must be int
         width<int|None>: image width (required if float cropping and not tiller)
         height<int|None>: image height (required if float cropping and not tiller)
-        tiller<Tiller|True|None>:
-            tile the image then read in a specific tile
+        example_path<str|None>: image used to get width/height (if not passed)
+        catalog<catalog.Catalog|None>: metadata catalog used instead of opening example_path
+        tiller<Tiller|MultiTiller|True|None>:
+            - tile the image then read in a specific tile
+            - for a MultiTiller window-indices are global indices. pass the
+              matching paths (see MultiTiller.specs/sample)
         tiller_config<dict>:
             if tiller is True create tiller=Tiller(**tiller_config)
-        input_dtype<str>: input data type
-        target_dtype<str>: target data type
+        read_from_gcs<bool>: read images from gcs
+        remote_cache<RemoteCache|str|True|None>:
+            - local read-through cache for read_from_gcs (see imagebox.cache)
+            - str: cache directory
+            - True: cache in config.REMOTE_CACHE_DIR
+        read_cache<resources.ArrayCache|int|True|None>:
+            - in-memory LRU cache of decoded reads (keyed by path, window and resolution)
+            - int: cache size in bytes
+            - True: limited only by the memory budget (see imagebox.resources)
+            - cached bytes are drawn from the resource governor's memory budget
+              and are evicted first when higher priority consumers need memory
+        precision<str|None>:
+            - None: compute in float64 and cast inputs to input_dtype at the end
+            - 'float64'|'float32'|'float16': cast inputs to precision on read and 
+              carry it through normalization, indices, padding and augmentation
+        input_dtype<str|None>: 
+            - input data type 
+            - defaults to precision (or INPUT_DTYPE)
+        target_dtype<str|None>: 
+            - target data type
+            - defaults to TARGET_DTYPE, or if precision is set the smallest 
+              integer type that holds the target values
+            - must be able to hold nb_categories and the value_map values
 
     """ 
     def __init__(self,
@@ -107,6 +171,7 @@ class InputTargetHandler(object):
             input_bounds=None,
             input_resampling=INPUT_RESAMPLING,
             target_resampling=TARGET_RESAMPLING,
+            memory_resampling=False,
             padding=None,
             input_padding=None,
             target_padding=None,
@@ -124,6 +189,7 @@ class InputTargetHandler(object):
             width=None,
             height=None,
             example_path=None,
+            catalog=None,
             tiller=None,
             tiller_config={},
             target_expand_axis=None,
@@ -131,8 +197,12 @@ class InputTargetHandler(object):
             target_preprocess=None,
             target_squeeze=True,
             read_from_gcs=False,
-            input_dtype=INPUT_DTYPE,
-            target_dtype=TARGET_DTYPE ):
+            remote_cache=None,
+            read_cache=None,
+            precision=None,
+            input_dtype=None,
+            target_dtype=None ):
+        self.catalog=catalog
         if tiller is True:
             self.tiller=Tiller(**tiller_config)
         else:
@@ -157,6 +227,7 @@ class InputTargetHandler(object):
         self.input_bounds=input_bounds
         self.input_resampling=input_resampling
         self.target_resampling=target_resampling
+        self.memory_resampling=memory_resampling
         self.set_augmentation()
         self.input_padding=input_padding or padding
         self.target_padding=target_padding or padding
@@ -180,68 +251,94 @@ class InputTargetHandler(object):
         self.target_preprocess=target_preprocess
         self.target_squeeze=target_squeeze
         self.read_from_gcs=read_from_gcs
-        self.input_dtype=input_dtype
-        self.target_dtype=target_dtype
+        if remote_cache is True:
+            remote_cache=RemoteCache()
+        elif isinstance(remote_cache,str):
+            remote_cache=RemoteCache(remote_cache)
+        self.remote_cache=remote_cache
+        if read_cache is True:
+            read_cache=resources.ArrayCache(name=READ_CACHE)
+        elif isinstance(read_cache,int):
+            read_cache=resources.ArrayCache(max_bytes=read_cache,name=READ_CACHE)
+        self.read_cache=read_cache
+        self._set_precision(precision,input_dtype,target_dtype)
 
 
     def input(self,path,window=None,means=None,stdevs=None,return_profile=False):
         self.input_path=path
-        im,profile=self._read(
+        im,profile=self._input(
             path,
-            self.input_resolution,
-            self.target_resampling,
-            window or self.input_window )
-        if means is None:
-            means=self.means
-        if stdevs is None:
-            stdevs=self.stdevs
-
-        im=process_input(
-            im,
-            preprocess=self.input_preprocess,
-            flip=self.flip_input,
-            input_bands=self.input_bands,
-            band_indices=self.band_indices,
-            indices_dict=self.indices_dict,
-            padding=self.input_padding,
-            padding_value=self.input_padding_value,
-            bounds=self.input_bounds,
-            means=means,
-            stdevs=stdevs,
-            dtype=self.input_dtype )
-        return self._return_data(
-            im,
-            profile,
-            return_profile )
+            window or self.input_window,
+            means,
+            stdevs,
+            self.k,
+            self.flip)
+        return self._return_data(im,profile,return_profile)
 
 
     def target(self,path,window=None,return_profile=False):
         self.target_path=path
-        im,profile=self._read(
+        im,profile=self._target(
             path,
-            self.target_resolution,
-            self.target_resampling,
-            window or self.target_window )
-        im=process_target(
-            im,
-            preprocess=self.target_preprocess,
-            flip=self.flip_target,
-            value_map=self.value_map,
-            list_value_map=self.list_value_map,
-            default_mapped_value=self.default_mapped_value,
-            categorical=self.to_categorical,
-            nb_categories=self.nb_categories,
-            padding=self.target_padding,
-            padding_value=self.target_padding_value,
-            expand_axis=self.target_expand_axis,
-            squeeze=self.target_squeeze,
-            dtype=self.target_dtype )
+            window or self.target_window,
+            self.k,
+            self.flip)
         if self.value_map and self.list_value_map:
-            return [self._return_data(o,profile,False) for o in im]
+            return im
         else:
             return self._return_data(im,profile,return_profile)
 
 
+    def input_target(self,
+            input_path,
+            target_path,
+            input_window=None,
+            target_window=None,
+            means=None,
+            stdevs=None,
+            return_profiles=False):
+        """ read/process input and target concurrently
+
+        The input and target images are read on the shared thread-pool 
+        (see `executor`) using the current window and augmentation. 
+
+        Args:
+            input_path<str>: input image path
+            target_path<str>: target image path
+            input/target_window<tuple|None>: 
+                - window to read 
+                - if None use the current input/target_window
+            means,stdevs<list|np.array|None>: overrides for self.means/stdevs
+            return_profiles<bool>: if true also return input/target profiles
+        Returns:
+            - input, target
+            - if return_profiles: input, target, input_profile, target_profile
+        """
+        self.input_path=input_path
+        self.target_path=target_path
+        pool=executor()
+        inpt=pool.submit(
+            self._input,
+            input_path,
+            input_window or self.input_window,
+            means,
+            stdevs,
+            self.k,
+            self.flip)
+        targ=pool.submit(
+            self._target,
+            target_path,
+            target_window or self.target_window,
+            self.k,
+            self.flip)
+        inpt,inpt_profile=inpt.result()
+        targ,targ_profile=targ.result()
+        if return_profiles:
+            return inpt, targ, inpt_profile, targ_profile
+        else:
+            return inpt, targ
+
+
     def set_augmentation(self,k=None,flip=None):
         if self.augment:
             self.k, self.flip=proc.augmentation(k,flip)
@@ -251,42 +348,215 @@ class InputTargetHandler(object):
     
 
     def set_window(self,window=None,window_index=None,example_path=None):
-        if window:
-            input_window=window
-            target_window=window
-        elif self.tiller:
-            if window_index is None:
-                window_index=randint(0,len(self.tiller)-1)
-            self.window_index=window_index            
-            target_window=self.tiller[self.window_index]
-            input_window=target_window
-        else:
-            self.window_index=False
-            input_window=0,0,self.input_width,self.input_height
-            target_window=0,0,self.target_width,self.target_height
-        self.input_window=self._shift_crop_window(
-                input_window,
-                dx=self.input_cropping,
-                dy=self.input_cropping,
-                crop=self.input_cropping)
-        self.target_window=self._shift_crop_window(
-                target_window,
-                dx=self.target_cropping,
-                dy=self.target_cropping,
-                crop=self.target_cropping)
+        params=self._window_params(window,window_index)
+        if not window:
+            self.window_index=params['window_index']
+        self.input_window=params['input_window']
+        self.target_window=params['target_window']
         if self.float_cropping:
-            self.float_x=self._random_delta()
-            self.float_y=self._random_delta()
-            self.input_window=self._shift_crop_window(
-                    self.input_window,
-                    dx=self.float_x,
-                    dy=self.float_y,
-                    crop=self.float_cropping )
-            self.target_window=self._shift_crop_window(
-                    self.target_window,
-                    dx=self._target_rescale(self.float_x),
-                    dy=self._target_rescale(self.float_y),
-                    crop=self._target_rescale(self.float_cropping) )
+            self.float_x=params['float_x']
+            self.float_y=params['float_y']
+
+
+    def batch(self,specs,inputs=None,targets=None):
+        """ read/process a batch of input/target pairs into contiguous arrays
+
+        Samples are read on the shared thread-pool (see `executor`) and 
+        written directly into the (preallocated) batch arrays. Windows and 
+        augmentations are selected per sample without changing the handler's
+        current window/augmentation.
+
+        Args:
+            specs<list>: 
+                - list of (input_path, target_path, window[, seed]) tuples
+                - window<tuple|int|None>: 
+                    * window tuple (col_off, row_off, width, height)
+                    * tiller window-index
+                    * None: random tiller window (or full image)
+                - seed<int|None>: see sample_params
+            inputs/targets<np.array|None>:
+                - preallocated (N,C,H,W) arrays filled in place
+                - if None, arrays are allocated from the first sample
+        Returns:
+            inputs, targets, params
+            - params<list>: per-sample dicts containing window_index, 
+              input/target_window, float_x/y, k and flip
+        """
+        if self.value_map and self.list_value_map:
+            raise ValueError(BATCH_LIST_VALUE_MAP_ERROR)
+        params=[self._spec_params(spec) for spec in specs]
+        pool=executor()
+        if (inputs is None) or (targets is None):
+            inpt=pool.submit(self._input_for,specs[0][0],params[0])
+            targ=pool.submit(self._target_for,specs[0][1],params[0])
+            inpt=inpt.result()[0]
+            targ=targ.result()[0]
+            if inputs is None:
+                inputs=np.empty((len(specs),)+inpt.shape,dtype=inpt.dtype)
+            if targets is None:
+                targets=np.empty((len(specs),)+targ.shape,dtype=targ.dtype)
+            inputs[0]=inpt
+            targets[0]=targ
+            first=1
+        else:
+            first=0
+        futures=[]
+        for i in range(first,len(specs)):
+            input_path,target_path=specs[i][:2]
+            futures.append(pool.submit(
+                self._fill,inputs,i,self._input_for,input_path,params[i]))
+            futures.append(pool.submit(
+                self._fill,targets,i,self._target_for,target_path,params[i]))
+        for future in futures:
+            future.result()
+        return inputs, targets, params
+
+
+    def sample_params(self,window=None,window_index=None,seed=None):
+        """ select window and augmentation for a sample
+
+        Does not modify the handler.
+
+        Args:
+            window<tuple|None>: window (col_off, row_off, width, height)
+            window_index<int|None>: 
+                - tiller window-index
+                - if None (and no window) a random tiller window is selected
+            seed<int|None>: 
+                - seed for the random window-index, float-cropping and augmentation 
+                - if None use the (global) random module
+        Returns:
+            <dict> window_index, input/target_window, float_x/y, k, flip
+        """
+        if seed is None:
+            rng=random
+        else:
+            rng=random.Random(seed)
+        params=self._window_params(window,window_index,rng)
+        if self.augment:
+            params['k'],params['flip']=proc.augmentation(rng=rng)
+        else:
+            params['k'],params['flip']=False,False
+        return params
+
+
+    def sample(self,
+            input_path=None,
+            target_path=None,
+            window=None,
+            window_index=None,
+            seed=None,
+            params=None,
+            return_profiles=False):
+        """ stateless read/process of an input/target sample
+
+        Unlike input/target this does not use or modify the handler's 
+        current window/augmentation, so a single handler can be shared
+        between threads.
+
+        Args:
+            input_path<str|None>: input path (if None input is not read)
+            target_path<str|None>: target path (if None target is not read)
+            window,window_index,seed: see sample_params
+            params<dict|None>: 
+                - sample params (see sample_params)
+                - if None: params=sample_params(window,window_index,seed)
+            return_profiles<bool>: if true also return input/target profiles
+        Returns:
+            - input, target, params
+            - if return_profiles: input, target, params, input_profile, target_profile
+        """
+        if params is None:
+            params=self.sample_params(window,window_index,seed)
+        inpt=targ=inpt_profile=targ_profile=None
+        if input_path:
+            inpt,inpt_profile=self._input_for(input_path,params)
+        if target_path:
+            targ,targ_profile=self._target_for(target_path,params)
+        if return_profiles:
+            return inpt, targ, params, inpt_profile, targ_profile
+        else:
+            return inpt, targ, params
+
+
+    def multi_crop(self,
+            input_path,
+            target_path,
+            nb_crops,
+            window=None,
+            window_index=None,
+            seed=None):
+        """ multiple float-cropped samples from a single read
+
+        The full (un-floated) input and target windows are read once, 
+        concurrently, and `nb_crops` independent float-crops/augmentations
+        are sliced from the decoded arrays. Each crop is identical to 
+        `sample(input_path,target_path,params=crop_params)` but the I/O is 
+        paid once for all crops.
+
+        Args:
+            input_path<str>: input image path
+            target_path<str>: target image path
+            nb_crops<int>: number of crops
+            window,window_index: window or tiller window-index (see sample_params)
+            seed<int|None>: seed for window-index, float-cropping and augmentation
+        Returns:
+            inputs, targets, params
+            - inputs/targets<np.array>: (nb_crops,C,H,W) arrays
+            - params<list>: per-crop params (see sample_params)
+        """
+        if not self.float_cropping:
+            raise ValueError(MULTI_CROP_ERROR)
+        if self.value_map and self.list_value_map:
+            raise ValueError(BATCH_LIST_VALUE_MAP_ERROR)
+        if seed is None:
+            rng=random
+        else:
+            rng=random.Random(seed)
+        base=self._window_params(window,window_index,rng,floating=False)
+        pool=executor()
+        inpt=pool.submit(
+            self._read,
+            input_path,
+            self.input_resolution,
+            self.input_resampling,
+            base['input_window'])
+        targ=pool.submit(
+            self._read,
+            target_path,
+            self.target_resolution,
+            self.target_resampling,
+            base['target_window'])
+        inpt=inpt.result()[0]
+        targ=targ.result()[0]
+        inputs=targets=None
+        params=[]
+        for i in range(nb_crops):
+            crop_params=self._float_params(
+                base,
+                self._random_delta(rng),
+                self._random_delta(rng))
+            if self.augment:
+                crop_params['k'],crop_params['flip']=proc.augmentation(rng=rng)
+            else:
+                crop_params['k'],crop_params['flip']=False,False
+            im=self._process_input(
+                _crop_window(inpt,base['input_window'],crop_params['input_window']),
+                None,
+                None,
+                crop_params['k'],
+                crop_params['flip'])
+            targ_im=self._process_target(
+                _crop_window(targ,base['target_window'],crop_params['target_window']),
+                crop_params['k'],
+                crop_params['flip'])
+            if inputs is None:
+                inputs=np.empty((nb_crops,)+im.shape,dtype=im.dtype)
+                targets=np.empty((nb_crops,)+targ_im.shape,dtype=targ_im.dtype)
+            inputs[i]=im
+            targets[i]=targ_im
+            params.append(crop_params)
+        return inputs, targets, params
 
 
     #
@@ -334,6 +604,56 @@ class InputTargetHandler(object):
             self.target_cropping=cropping or 0
 
 
+    def _set_precision(self,precision,input_dtype,target_dtype):
+        if precision is not None:
+            if str(np.dtype(precision)) not in PRECISIONS:
+                raise ValueError(PRECISION_ERROR)
+            precision=np.dtype(precision)
+        self.precision=precision
+        if input_dtype is None:
+            input_dtype=INPUT_DTYPE if precision is None else precision
+        self.input_dtype=input_dtype
+        target_range=self._target_range()
+        if target_dtype is None:
+            if (precision is None) or (target_range is None):
+                target_dtype=TARGET_DTYPE
+            else:
+                target_dtype=np.promote_types(
+                    np.min_scalar_type(target_range[0]),
+                    np.min_scalar_type(target_range[1]))
+        elif (target_range is not None) and np.issubdtype(target_dtype,np.integer):
+            iinfo=np.iinfo(target_dtype)
+            if (target_range[0]<iinfo.min) or (iinfo.max<target_range[1]):
+                raise ValueError(f'{TARGET_DTYPE_ERROR}: {target_dtype}, {target_range}')
+        self.target_dtype=target_dtype
+
+
+    def _target_range(self):
+        """ (min, max) of the (known) target values, or None if unknown 
+
+        The range is unknown if unmapped values keep the image value
+        (a '.default' of 'image').
+        """
+        if self.to_categorical:
+            return 0, 1
+        values=[]
+        if self.nb_categories:
+            values+=[0,self.nb_categories]
+        value_maps=self.value_map if self.list_value_map else [self.value_map]
+        for value_map in value_maps:
+            if value_map:
+                values+=[
+                    k for k in value_map.keys() 
+                    if isinstance(k,(int,np.integer)) ]
+                default=value_map.get('.default',self.default_mapped_value)
+                if isinstance(default,(int,np.integer)):
+                    values.append(default)
+                else:
+                    return None
+        if values:
+            return min(values), max(values)
+
+
     def _target_rescale(self,value):
         if self.target_ratio==1:
             return value
@@ -347,24 +667,230 @@ class InputTargetHandler(object):
 
 
     def _read(self,path,resolution,resampling,window):
-        if self.read_from_gcs:
+        method=MEMORY_RESAMPLING.get(resampling)
+        if resolution and self.memory_resampling and method:
+            # decide from the header (or catalog) so non-integer scales are read once
+            scale=abs(io.info(path,catalog=self.catalog)['res'][0])/resolution
+            if proc.integer_factor(scale):
+                im,p=self._read_image(path,None,resampling,window)
+                with profiler.stage('rescale') as timer:
+                    im=timer.add(proc.rescale(im,scale,method=method))
+                if config.BANDS_FIRST:
+                    out_shape=im.shape[-2:]
+                else:
+                    out_shape=im.shape[:2]
+                return im, io.rescale_profile(p,out_shape)
+        return self._read_image(path,resolution,resampling,window)
+
+
+    def _read_image(self,path,resolution,resampling,window):
+        if self.read_cache is not None:
+            key=(path,resolution,str(resampling),tuple(window) if window else None)
+            cached=self.read_cache.get(key)
+            if cached is not None:
+                profiler.count('read_cache.hits')
+                return cached[0].copy(), cached[1].copy()
+        with profiler.stage('read') as timer:
+            im,p=self._read_source(path,resolution,resampling,window)
+            timer.add(im)
+        profiler.count('reads')
+        if self.read_cache is not None:
+            self.read_cache.put(key,(im.copy(),p.copy()))
+        return im,p
+
+
+    def _read_source(self,path,resolution,resampling,window):
+        if self.read_from_gcs and self.remote_cache:
+            im,p=self.remote_cache.read(
+                path,
+                io.read,
+                window=window,
+                res=resolution,
+                resampling=resampling,
+                boundless=self._boundless())
+        elif self.read_from_gcs:
+            import gcs_helpers.fetch as gfetch
             im,p=gfetch.image(
                 path=path,
                 window=window,
                 res=resolution,
                 resampling=resampling,
-                band_ordering=BAND_ORDERING)
+                band_ordering=config.BAND_ORDERING)
         else:
             im,p=io.read(
                 path,
                 window=window,
                 res=resolution,
-                resampling=resampling)
+                resampling=resampling,
+                boundless=self._boundless())
         return im,p
 
 
-    def _random_delta(self):
-        return randint(0,2*int(self.float_cropping*self.target_ratio))
+    def _boundless(self):
+        """ padded tiller windows may extend beyond the image """
+        return bool(self.tiller) and getattr(self.tiller,'boundless',False)
+
+
+    def _window_params(self,window=None,window_index=None,rng=None,floating=True):
+        if rng is None:
+            rng=random
+        if window:
+            window_index=None
+            input_window=window
+            target_window=window
+        elif self.tiller:
+            if window_index is None:
+                window_index=rng.randint(0,len(self.tiller)-1)
+            target_window=self.tiller[window_index]
+            input_window=target_window
+        else:
+            window_index=False
+            input_window=0,0,self.input_width,self.input_height
+            target_window=0,0,self.target_width,self.target_height
+        input_window=self._shift_crop_window(
+                input_window,
+                dx=self.input_cropping,
+                dy=self.input_cropping,
+                crop=self.input_cropping)
+        target_window=self._shift_crop_window(
+                target_window,
+                dx=self.target_cropping,
+                dy=self.target_cropping,
+                crop=self.target_cropping)
+        params={
+            'window_index': window_index,
+            'input_window': input_window,
+            'target_window': target_window,
+            'float_x': None,
+            'float_y': None }
+        if floating and self.float_cropping:
+            params=self._float_params(
+                params,
+                self._random_delta(rng),
+                self._random_delta(rng))
+        return params
+
+
+    def _float_params(self,params,float_x,float_y):
+        """ shift/crop the (un-floated) windows in params by float_x/y """
+        params=params.copy()
+        params['float_x']=float_x
+        params['float_y']=float_y
+        params['input_window']=self._shift_crop_window(
+                params['input_window'],
+                dx=float_x,
+                dy=float_y,
+                crop=self.float_cropping )
+        params['target_window']=self._shift_crop_window(
+                params['target_window'],
+                dx=self._target_rescale(float_x),
+                dy=self._target_rescale(float_y),
+                crop=self._target_rescale(self.float_cropping) )
+        return params
+
+
+    def _spec_params(self,spec):
+        """ sample-params from batch-spec (input_path, target_path[, window[, seed]]) """
+        window=spec[2] if len(spec)>2 else None
+        seed=spec[3] if len(spec)>3 else None
+        if isinstance(window,(int,np.integer)) and not isinstance(window,bool):
+            return self.sample_params(window_index=int(window),seed=seed)
+        else:
+            return self.sample_params(window=window,seed=seed)
+
+
+    def _input_for(self,path,params):
+        return self._input(
+            path,
+            params['input_window'],
+            None,
+            None,
+            params['k'],
+            params['flip'])
+
+
+    def _target_for(self,path,params):
+        return self._target(
+            path,
+            params['target_window'],
+            params['k'],
+            params['flip'])
+
+
+    def _fill(self,out,index,read,path,params):
+        out[index]=read(path,params)[0]
+
+
+    def _input(self,path,window,means,stdevs,k,flip):
+        im,profile=self._read(
+            path,
+            self.input_resolution,
+            self.input_resampling,
+            window )
+        return self._process_input(im,means,stdevs,k,flip), profile
+
+
+    def _process_input(self,im,means,stdevs,k,flip):
+        if means is None:
+            means=self.means
+        if stdevs is None:
+            stdevs=self.stdevs
+        im=process_input(
+            im,
+            preprocess=self.input_preprocess,
+            flip=self.flip_input,
+            input_bands=self.input_bands,
+            band_indices=self.band_indices,
+            indices_dict=self.indices_dict,
+            padding=self.input_padding,
+            padding_value=self.input_padding_value,
+            bounds=self.input_bounds,
+            means=means,
+            stdevs=stdevs,
+            compute_dtype=self.precision,
+            dtype=self.input_dtype )
+        return self._augment(im,k,flip)
+
+
+    def _target(self,path,window,k,flip):
+        im,profile=self._read(
+            path,
+            self.target_resolution,
+            self.target_resampling,
+            window )
+        return self._process_target(im,k,flip), profile
+
+
+    def _process_target(self,im,k,flip):
+        im=process_target(
+            im,
+            preprocess=self.target_preprocess,
+            flip=self.flip_target,
+            value_map=self.value_map,
+            list_value_map=self.list_value_map,
+            default_mapped_value=self.default_mapped_value,
+            categorical=self.to_categorical,
+            nb_categories=self.nb_categories,
+            padding=self.target_padding,
+            padding_value=self.target_padding_value,
+            expand_axis=self.target_expand_axis,
+            squeeze=self.target_squeeze,
+            dtype=self.target_dtype )
+        if self.value_map and self.list_value_map:
+            return [self._augment(o,k,flip) for o in im]
+        else:
+            return self._augment(im,k,flip)
+
+
+    def _augment(self,im,k,flip):
+        if self.augment:
+            with profiler.stage('augment') as timer:
+                im=timer.add(proc.augment(im,k,flip))
+        return im
+
+
+    def _random_delta(self,rng):
+        return rng.randint(0,2*int(self.float_cropping*self.target_ratio))
 
 
     def _shift_crop_window(self,window,dx=0,dy=0,crop=0):
@@ -381,18 +907,13 @@ class InputTargetHandler(object):
     def _ensure_dimensions(self,example_path):
         if not (self.input_width and self.input_height):
             if example_path:
-                shape=io.read(example_path,return_profile=False).shape
-                if BANDS_FIRST:
-                    self.input_height,self.input_width=shape[1:]
-                else:
-                    self.input_height,self.input_width=shape[:2]
+                info=io.info(example_path,catalog=self.catalog)
+                self.input_height,self.input_width=info['height'],info['width']
             elif self.input_cropping or self.target_cropping or self.float_cropping:
                 raise ValueError(DIMS_REQUIRED_ERROR)
 
 
     def _return_data(self,im,profile,return_profile):
-        if self.augment:
-            im=proc.augment(im,self.k,self.flip)
         if return_profile:
             return im, profile
         else:
@@ -402,6 +923,51 @@ class InputTargetHandler(object):
 #
 # HELPERS
 #
+_EXECUTOR=None
+_EXECUTOR_LOCK=threading.Lock()
+
+
+def executor():
+    """ shared thread-pool used for concurrent reads
+
+    The pool is created on first use with config.MAX_WORKERS threads (capped by
+    the resource governor's worker budget, see imagebox.resources).
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR=ThreadPoolExecutor(
+                max_workers=resources.governor().workers(EXECUTOR,config.MAX_WORKERS),
+                thread_name_prefix='imagebox')
+    return _EXECUTOR
+
+
+def _crop_window(im,window,crop_window):
+    """ slice crop_window (contained in window) from the image read for window """
+    if config.BANDS_FIRST:
+        height,width=im.shape[-2:]
+    else:
+        height,width=im.shape[:2]
+    scale_x=width/window[2]
+    scale_y=height/window[3]
+    x=round((crop_window[0]-window[0])*scale_x)
+    y=round((crop_window[1]-window[1])*scale_y)
+    w=round(crop_window[2]*scale_x)
+    h=round(crop_window[3]*scale_y)
+    if config.BANDS_FIRST:
+        return im[...,y:y+h,x:x+w]
+    else:
+        return im[y:y+h,x:x+w]
+
+
+def _reset_executor():
+    global _EXECUTOR
+    _EXECUTOR=None
+
+
+os.register_at_fork(after_in_child=_reset_executor)
+
+
 def process_input(
         im,
         rotate=False,
@@ -416,26 +982,35 @@ def process_input(
         means=None,
         stdevs=None,
         preprocess=None,
+        compute_dtype=None,
         dtype=INPUT_DTYPE):
     if preprocess:
-        im=preprocess(im)
-    im=proc.augment(im,k=rotate,flip=flip)
+        with profiler.stage('input.preprocess') as timer:
+            im=timer.add(preprocess(im))
+    if compute_dtype is not None:
+        with profiler.stage('input.cast') as timer:
+            im=timer.add(im.astype(compute_dtype,copy=False))
+    if (rotate is not False) or (flip is not False):
+        with profiler.stage('input.flip') as timer:
+            im=timer.add(proc.augment(im,k=rotate,flip=flip))
     if cropping:
         im=proc.crop(im,cropping)
     if band_indices:
-        index_bands=[indices.index(im,idx,indices_dict) for idx in band_indices]
+        with profiler.stage('input.indices') as timer:
+            index_bands=timer.add([indices.index(im,idx,indices_dict) for idx in band_indices])
     if means is not None:
-        if stdevs is None:
-            im=proc.center(im,means=means,to_int=False)
-        else:
-            im=proc.normalize(im,means=means,stdevs=stdevs)
+        with profiler.stage('input.normalize') as timer:
+            if stdevs is None:
+                im=timer.add(proc.center(im,means=means,to_int=False))
+            else:
+                im=timer.add(proc.normalize(im,means=means,stdevs=stdevs))
     if input_bands:
-        if BANDS_FIRST:
+        if config.BANDS_FIRST:
             im=im[input_bands]
         else:
             im=im[:,:,input_bands]
     if band_indices:
-        if BANDS_FIRST:
+        if config.BANDS_FIRST:
             if input_bands is False:
                 im=np.vstack([index_bands])
             else:
@@ -446,12 +1021,15 @@ def process_input(
             else:
                 im=np.dstack([im]+index_bands)
     if (not cropping) and padding:
-        im=proc.pad(im,padding=padding,value=padding_value)
+        with profiler.stage('input.pad') as timer:
+            im=timer.add(proc.pad(im,padding=padding,value=padding_value))
     if bounds:
-        for i,b in bounds.items():
-            i=int(i)
-            im[i]=im[i].clip(min=b.get('min'),max=b.get('max'))
-    return im.astype(dtype)
+        with profiler.stage('input.bounds'):
+            for i,b in bounds.items():
+                i=int(i)
+                im[i]=im[i].clip(min=b.get('min'),max=b.get('max'))
+    with profiler.stage('input.dtype') as timer:
+        return timer.add(im.astype(dtype,copy=False))
 
 
 def process_target(
@@ -471,8 +1049,11 @@ def process_target(
         squeeze=True,
         dtype=TARGET_DTYPE):
     if preprocess:
-        im=preprocess(im)
-    im=proc.augment(im,k=rotate,flip=flip)
+        with profiler.stage('target.preprocess') as timer:
+            im=timer.add(preprocess(im))
+    if (rotate is not False) or (flip is not False):
+        with profiler.stage('target.flip') as timer:
+            im=timer.add(proc.augment(im,k=rotate,flip=flip))
     if squeeze:
         im=np.squeeze(im)
     if value_map and list_value_map:
@@ -514,18 +1095,22 @@ def _post_process_target_images(
         expand_axis,
         dtype):
     if value_map:
-        im=proc.map_values(im,value_map)
+        with profiler.stage('target.map_values') as timer:
+            im=timer.add(proc.map_values(im,value_map))
     if categorical:
-        im=proc.to_categorical(im,nb_categories)
+        with profiler.stage('target.to_categorical') as timer:
+            im=timer.add(proc.to_categorical(im,nb_categories,dtype=dtype))
     if cropping:
         im=proc.crop(im,cropping)
     elif padding:
-        im=proc.pad(im,padding=padding,value=padding_value)
+        with profiler.stage('target.pad') as timer:
+            im=timer.add(proc.pad(im,padding=padding,value=padding_value))
     if expand_axis is not None:
         if expand_axis is True:
             expand_axis=0
         im=np.expand_dims(im,axis=expand_axis)
-    return im.astype(dtype)
+    with profiler.stage('target.dtype') as timer:
+        return timer.add(im.astype(dtype,copy=False))
 
 
 
@@ -538,6 +1123,10 @@ class Tiller(object):
     
     For a given boundary shape generate windows (x-offset, y-offset, width, height) of a given size and overlap
 
+    Windows are indexed column-major (index=col*rows+row). Window lookup is 
+    pure arithmetic (the tiller has no per-lookup state) and all windows are
+    available as a single (N,4) array.
+
     Usage:
         im=np.arange(1024**2).reshape((1024,1024))
         tiller=hand.Tiller(boundary_shape=im.shape,size=100,overlap=10)
@@ -546,13 +1135,12 @@ class Tiller(object):
         print("WINDOW-0:",xoff,yoff,width,height)
         im[yoff:yoff+height,xoff:xoff+width]
         ### output:
-        NB WINDOWS: 115600
-        WINDOW-0: 1 1 5 5
-        array([[1025, 1026, 1027, 1028, 1029],
-               [2049, 2050, 2051, 2052, 2053],
-               [3073, 3074, 3075, 3076, 3077],
-               [4097, 4098, 4099, 4100, 4101],
-               [5121, 5122, 5123, 5124, 5125]])
+        NB WINDOWS: 144
+        WINDOW-0: 22 22 100 100
+
+        tiller.windows          # (N,4) array of all windows
+        tiller[10:20]           # (10,4) array
+        tiller[mask]            # boolean mask or index array -> (M,4) array
 
     Args:
         boundary_width/height<int|None>: 
@@ -561,8 +1149,17 @@ class Tiller(object):
         boundary_shape<tuple|None>:
             - shape tuple
             - required if width/height not specified
-        size<int>: tile size (width/height - only supports square tiles)
-        overlap<int>: overlap between tiles
+        size<int|tuple>: tile size or (width, height)
+        overlap<int>: overlap between tiles (neighboring tiles share 2*overlap pixels)
+        edge<str|None>:
+            - None: only complete tiles, with the grid centered in the boundary 
+              (the remainder strips at the edges are not tiled)
+            - 'shift': cover the full boundary. the last tile of each row/column is
+              shifted back so it ends on the boundary (if the boundary is smaller 
+              than a tile there is nothing to shift: the single tile is padded as
+              with 'pad')
+            - 'pad': cover the full boundary starting at 0. the last tiles extend 
+              beyond the boundary (read with boundless reads/padding)
     """
     def __init__(
             self,
@@ -570,17 +1167,34 @@ class Tiller(object):
             boundary_height=None,
             boundary_shape=None,
             size=DEFAULT_SIZE,
-            overlap=DEFAULT_OVERLAP):
+            overlap=DEFAULT_OVERLAP,
+            edge=None):
         if not overlap:
             overlap=0
-        self.size=size
-        self.inner_size=self.size-2*overlap
+        if edge not in EDGE_MODES:
+            raise ValueError(EDGE_MODE_ERROR)
+        if isinstance(size,(tuple,list)):
+            self.tile_width,self.tile_height=size
+        else:
+            self.tile_width=self.tile_height=size
+        if self.tile_width==self.tile_height:
+            self.size=self.tile_width
+        else:
+            self.size=(self.tile_width,self.tile_height)
+        self.edge=edge
+        self.inner_width=self.tile_width-2*overlap
+        self.inner_height=self.tile_height-2*overlap
+        if self.inner_width==self.inner_height:
+            self.inner_size=self.inner_width
+        else:
+            self.inner_size=(self.inner_width,self.inner_height)
         self._set_shape_attributes(
             boundary_width,
             boundary_height,
             boundary_shape,
             overlap)
         self.length=self.cols*self.rows
+        self._windows=None
             
             
     def column_row(self,index):
@@ -591,11 +1205,33 @@ class Tiller(object):
 
     def window(self,index=None,col=None,row=None):
         if index is not None:
-            col,row=self.column_row(index)
-        self.col,self.row=col,row  
-        col_off=self.col_offset+col*self.size
-        row_off=self.row_offset+row*self.size
-        return (col_off,row_off,self.size,self.size)
+            col,row=self.column_row(self._index(index))
+        return (
+            int(self.col_offsets[col]),
+            int(self.row_offsets[row]),
+            self.tile_width,
+            self.tile_height)
+
+
+    @property
+    def windows(self):
+        """ (N,4) int array of all windows (col_off, row_off, width, height) """
+        if self._windows is None:
+            windows=np.empty((self.length,4),dtype=np.int64)
+            windows[:,0]=np.repeat(self.col_offsets,self.rows)
+            windows[:,1]=np.tile(self.row_offsets,self.cols)
+            windows[:,2]=self.tile_width
+            windows[:,3]=self.tile_height
+            windows.flags.writeable=False
+            self._windows=windows
+        return self._windows
+
+
+    def indices(self,cols=None,rows=None):
+        """ window indices for columns/rows (all if None) """
+        cols=np.arange(self.cols) if cols is None else np.asarray(cols)
+        rows=np.arange(self.rows) if rows is None else np.asarray(rows)
+        return (cols[:,None]*self.rows+rows[None,:]).ravel()
     
 
     def __len__(self):
@@ -603,15 +1239,38 @@ class Tiller(object):
             
 
     def __getitem__(self, index):
-        if (index>=self.length):
-            raise IndexError
-        self.index=index
-        return self.window(index=self.index)
+        if isinstance(index,(int,np.integer)) and not isinstance(index,bool):
+            return self.window(index=index)
+        else:
+            return self.windows[index]
+
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self.window(index=index)
+
+
+    @property
+    def boundless(self):
+        """ True if windows may extend beyond the boundary """
+        if self.edge==SHIFT:
+            return (
+                (self.boundary_width<self.tile_width) or
+                (self.boundary_height<self.tile_height))
+        return self.edge==PAD
             
             
     #
     # INTERNEL
     #
+    def _index(self,index):
+        if index<0:
+            index+=self.length
+        if not (0<=index<self.length):
+            raise IndexError
+        return index
+
+
     def _set_shape_attributes(
             self,
             boundary_width,
@@ -620,11 +1279,291 @@ class Tiller(object):
             overlap):
         if boundary_shape:
             boundary_height,boundary_width=boundary_shape
-        self.cols=math.floor((boundary_width-2*overlap)/self.inner_size)
-        self.rows=math.floor((boundary_height-2*overlap)/self.inner_size)
-        self.width=2*overlap+self.cols*self.inner_size
-        self.height=2*overlap+self.rows*self.inner_size
-        self.col_offset=math.floor((boundary_width-self.width)/2)
-        self.row_offset=math.floor((boundary_height-self.height)/2)
+        self.boundary_width=boundary_width
+        self.boundary_height=boundary_height
         self.overlap=overlap
+        self.cols,self.col_offset,self.width,self.col_offsets=self._axis(
+            boundary_width,
+            self.tile_width,
+            self.inner_width,
+            overlap)
+        self.rows,self.row_offset,self.height,self.row_offsets=self._axis(
+            boundary_height,
+            self.tile_height,
+            self.inner_height,
+            overlap)
+
+
+    def _axis(self,boundary,tile,inner,overlap):
+        """ number of tiles, offset, covered extent and tile offsets along an axis """
+        if self.edge is None:
+            count=max(math.floor((boundary-2*overlap)/inner),0)
+            extent=2*overlap+count*inner
+            offset=math.floor((boundary-extent)/2)
+            offsets=offset+inner*np.arange(count)
+        else:
+            count=max(math.ceil((boundary-2*overlap)/inner),1)
+            offset=0
+            offsets=inner*np.arange(count)
+            if (self.edge==SHIFT) and (boundary>=tile):
+                offsets=np.minimum(offsets,boundary-tile)
+                extent=boundary
+            else:
+                extent=2*overlap+count*inner
+        return count, offset, extent, offsets
+
+
+
+class MultiTiller(object):
+    """ MultiTiller
+
+    Dataset-level tiller: a single global window-index over the tiles of 
+    many rasters.
+
+    Each file has its own Tiller. A global index is mapped to 
+    (file-index, window-index) with a binary search over the prefix sums of
+    the per-file tile counts, so lookups are O(log nb_files) and no per-tile
+    python objects are created.
+
+    Since `tiller[index]` returns the window for a global index, a 
+    MultiTiller can be passed as the `tiller` of an InputTargetHandler. Use 
+    `specs` (or `sample`) to get batch-specs with the matching paths.
+
+    Usage:
+        tiller=hand.MultiTiller(
+            [(input_path_1,target_path_1),(input_path_2,target_path_2)],
+            size=256,
+            overlap=16,
+            catalog=catalog)
+        handler=hand.InputTargetHandler(tiller=tiller,size=256,...)
+        inputs,targets,params=handler.batch(tiller.sample(32,seed=1))
+
+    Args:
+        paths<list>: 
+            - list of input paths or (input_path, target_path) tuples
+            - windows are computed from the (first) path's shape
+        shapes<list|None>: 
+            - (height, width) for each path
+            - if None the shapes are read from the catalog (or file headers)
+        tillers<list|None>: prebuilt Tillers (overrides shapes and tiller configs)
+        size,overlap,edge: default tiller config (see Tiller)
+        configs<list|None>: per-file tiller configs (dicts) updating the default config
+        weights<str|list|np.array|None>:
+            - None or 'tiles': every tile is equally likely
+            - 'files': every file is equally likely
+            - list|np.array: per-file weights (the file's tiles share its weight)
+        catalog<catalog.Catalog|None>: catalog used for raster shapes
+    """
+    def __init__(
+            self,
+            paths,
+            shapes=None,
+            tillers=None,
+            size=DEFAULT_SIZE,
+            overlap=DEFAULT_OVERLAP,
+            edge=None,
+            configs=None,
+            weights=None,
+            catalog=None):
+        self.input_paths,self.target_paths=self._split_paths(paths)
+        self.nb_files=len(self.input_paths)
+        if tillers is None:
+            tillers=self._tillers(shapes,size,overlap,edge,configs,catalog)
+        self.tillers=list(tillers)
+        counts=np.array([len(t) for t in self.tillers],dtype=np.int64)
+        self.offsets=np.zeros(self.nb_files+1,dtype=np.int64)
+        np.cumsum(counts,out=self.offsets[1:])
+        self.counts=counts
+        self.length=int(self.offsets[-1])
+        self.file_weights=self._file_weights(weights)
+        self._windows=None
+        self._file_indices=None
+
+
+    def locate(self,index):
+        """ global index (int or array) => (file-index, window-index) """
+        if isinstance(index,(int,np.integer)) and not isinstance(index,bool):
+            index=self._index(index)
+            file_index=int(np.searchsorted(self.offsets,index,side='right'))-1
+            return file_index, int(index-self.offsets[file_index])
+        else:
+            index=self._indices(index)
+            file_index=np.searchsorted(self.offsets,index,side='right')-1
+            return file_index, index-self.offsets[file_index]
+
+
+    def index(self,file_index,window_index):
+        """ (file-index, window-index) => global index """
+        return self.offsets[file_index]+window_index
+
+
+    def window(self,index):
+        file_index,window_index=self.locate(index)
+        return self.tillers[file_index].window(window_index)
+
+
+    def path(self,index):
+        """ input path for global index """
+        return self.input_paths[self.locate(index)[0]]
+
+
+    def spec(self,index,seed=None):
+        """ batch-spec (input_path, target_path, index[, seed]) """
+        index=self._index(index)
+        file_index,_=self.locate(index)
+        spec=(self.input_paths[file_index],self.target_paths[file_index],int(index))
+        if seed is not None:
+            spec+=(seed,)
+        return spec
+
 
+    def specs(self,indices=None,seeds=None):
+        """ batch-specs for global indices (all if None) """
+        if indices is None:
+            indices=np.arange(self.length)
+        indices=self._indices(indices)
+        file_indices,_=self.locate(indices)
+        specs=[]
+        for i,(index,file_index) in enumerate(zip(indices.tolist(),file_indices.tolist())):
+            spec=(self.input_paths[file_index],self.target_paths[file_index],index)
+            if seeds is not None:
+                spec+=(seeds[i],)
+            specs.append(spec)
+        return specs
+
+
+    def sample_indices(self,size,seed=None):
+        """ weighted random global indices 
+
+        Files are drawn with the file-weights and windows uniformly within
+        the file, so sampling does not depend on the total number of tiles.
+        """
+        rng=np.random.default_rng(seed)
+        file_indices=rng.choice(self.nb_files,size=size,p=self.file_weights)
+        window_indices=np.floor(
+            rng.random(size)*self.counts[file_indices]).astype(np.int64)
+        return self.offsets[file_indices]+window_indices
+
+
+    def sample(self,size,seed=None):
+        """ batch-specs for weighted random global indices (see sample_indices) """
+        return self.specs(self.sample_indices(size,seed))
+
+
+    @property
+    def windows(self):
+        """ (N,4) int array of all windows """
+        if self._windows is None:
+            if self.length:
+                windows=np.concatenate([t.windows for t in self.tillers])
+            else:
+                windows=np.empty((0,4),dtype=np.int64)
+            windows.flags.writeable=False
+            self._windows=windows
+        return self._windows
+
+
+    @property
+    def file_indices(self):
+        """ (N,) file-index for each window """
+        if self._file_indices is None:
+            self._file_indices=np.repeat(np.arange(self.nb_files),self.counts)
+        return self._file_indices
+
+
+    @property
+    def boundless(self):
+        """ True if any windows may extend beyond their boundary """
+        return any(getattr(t,'boundless',False) for t in self.tillers)
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __getitem__(self, index):
+        if isinstance(index,(int,np.integer)) and not isinstance(index,bool):
+            return self.window(index)
+        else:
+            file_indices,window_indices=self.locate(index)
+            windows=np.empty((len(file_indices),4),dtype=np.int64)
+            for file_index in np.unique(file_indices):
+                sel=file_indices==file_index
+                windows[sel]=self.tillers[file_index][window_indices[sel]]
+            return windows
+
+
+    #
+    # INTERNEL
+    #
+    def _index(self,index):
+        if index<0:
+            index+=self.length
+        if not (0<=index<self.length):
+            raise IndexError
+        return index
+
+
+    def _indices(self,index):
+        """ slice, boolean mask or index array => int array of global indices """
+        if isinstance(index,slice):
+            return np.arange(*index.indices(self.length))
+        index=np.asarray(index)
+        if index.dtype==bool:
+            if len(index)!=self.length:
+                raise IndexError
+            return np.flatnonzero(index)
+        index=index.astype(np.int64)
+        index=np.where(index<0,index+self.length,index)
+        if index.size and ((index.min()<0) or (index.max()>=self.length)):
+            raise IndexError
+        return index
+
+
+    def _split_paths(self,paths):
+        input_paths,target_paths=[],[]
+        for path in paths:
+            if isinstance(path,(tuple,list)):
+                input_path,target_path=path
+            else:
+                input_path,target_path=path,None
+            input_paths.append(input_path)
+            target_paths.append(target_path)
+        return input_paths, target_paths
+
+
+    def _tillers(self,shapes,size,overlap,edge,configs,catalog):
+        tillers=[]
+        for i,input_path in enumerate(self.input_paths):
+            path=input_path or self.target_paths[i]
+            config={ 'size': size, 'overlap': overlap, 'edge': edge }
+            if configs:
+                config.update(configs[i] or {})
+            if shapes:
+                tillers.append(Tiller(boundary_shape=tuple(shapes[i])[:2],**config))
+            elif catalog:
+                tillers.append(catalog.tiller(path,**config))
+            else:
+                meta=io.info(path)
+                tillers.append(Tiller(
+                    boundary_shape=(meta['height'],meta['width']),
+                    **config))
+        return tillers
+
+
+    def _file_weights(self,weights):
+        if weights is None:
+            weights='tiles'
+        if isinstance(weights,str):
+            if weights=='tiles':
+                weights=self.counts.astype(np.float64)
+            elif weights=='files':
+                weights=(self.counts>0).astype(np.float64)
+            else:
+                raise ValueError(f'{WEIGHTS_ERROR}: {weights}')
+        else:
+            weights=np.asarray(weights,dtype=np.float64)*(self.counts>0)
+        total=weights.sum()
+        if total>0:
+            weights=weights/total
+        return weights
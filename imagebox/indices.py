@@ -1,5 +1,6 @@
 import numpy as np
-from imagebox.config import FIRST, LAST, BAND_ORDERING, BANDS_FIRST
+import imagebox.config as config
+from imagebox.config import FIRST, LAST
 #
 # CONSTANTS
 # 
@@ -157,7 +158,7 @@ def index(im,index_name,indices=None):
             return normalized_difference(im,*args)
 
 
-def normalized_difference(im,band_1,band_2,bands_first=BANDS_FIRST):
+def normalized_difference(im,band_1,band_2,bands_first=None):
     """ Normalize Difference
 
         Args:
@@ -169,7 +170,8 @@ def normalized_difference(im,band_1,band_2,bands_first=BANDS_FIRST):
         Returns:
             <arr>: (b1-b2)/(b1+b2)
     """
-    im=im.astype(np.float)
+    bands_first=config.get('BANDS_FIRST',bands_first)
+    im=_as_float(im)
     if bands_first:
         band_1=im[band_1]
         band_2=im[band_2]
@@ -212,7 +214,7 @@ def ratio_index(
     return np.divide(numerator,denominator+EPS)+constant
 
 
-def linear_combo(im,bands,coefs=None,constant=None,bands_first=BANDS_FIRST):
+def linear_combo(im,bands,coefs=None,constant=None,bands_first=None):
     """ Linear Combination
 
         Args:
@@ -223,7 +225,8 @@ def linear_combo(im,bands,coefs=None,constant=None,bands_first=BANDS_FIRST):
         Returns:
             <np.array>: image_bands dot coefs + constant
     """
-    im=im.astype(np.float)
+    bands_first=config.get('BANDS_FIRST',bands_first)
+    im=_as_float(im)
     if not constant:
         constant=0
     if isinstance(bands,int):
@@ -233,14 +236,14 @@ def linear_combo(im,bands,coefs=None,constant=None,bands_first=BANDS_FIRST):
     if isinstance(coefs,int):
         coefs=[coefs]*len(bands)
     if bands_first:
-        im=coefs[0]*im[bands[0]]
+        combo=coefs[0]*im[bands[0]]
         for c,b in zip(coefs[1:],bands[1:]):
-            im+=c*im[b]
+            combo+=c*im[b]
     else:
-        im=coefs[0]*im[:,:,bands[0]]
+        combo=coefs[0]*im[:,:,bands[0]]
         for c,b in zip(coefs[1:],bands[1:]):
-            im+=c*im[:,:,b]
-    return im+constant
+            combo+=c*im[:,:,b]
+    return combo+constant
 
 
 def shadow_mask(im,band_bounds=[77,77,87],max_diff=25,bands=[0,1,2],blueness=6):
@@ -252,3 +255,13 @@ def shadow_mask(im,band_bounds=[77,77,87],max_diff=25,bands=[0,1,2],blueness=6):
     isgrey=(im[bands[-1]]-im[bands[:-1]].min(axis=0))<=max_diff
     return bbnds.all(axis=0)*isblue*isgrey
 
+
+#
+# INTERNAL
+#
+def _as_float(im):
+    """ float arrays keep their dtype. others are cast to float64 """
+    if np.issubdtype(im.dtype,np.floating):
+        return im
+    else:
+        return im.astype(np.float64)
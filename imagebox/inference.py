@@ -0,0 +1,391 @@
+from collections import deque
+import numpy as np
+import imagebox.io as io
+import imagebox.profiler as profiler
+from imagebox.handler import Tiller, executor, SHIFT, DEFAULT_SIZE
+import imagebox.config as config
+#
+# CONSTANTS
+#
+CROP='crop'
+FEATHER='feather'
+BLENDS=[CROP,FEATHER]
+BATCH_SIZE=8
+PREFETCH=2
+OUTPUT_DTYPE='float32'
+BLEND_ERROR=f'imagebox.inference: blend must be one of {BLENDS}'
+OUTPUT_SIZE_ERROR=(
+    'imagebox.inference: '
+    'predictions can not be larger than the tile' )
+PREDICTIONS_ERROR=(
+    'imagebox.inference: '
+    'predict must return one prediction per input' )
+SCENE_SIZE_ERROR=(
+    'imagebox.inference: '
+    'the scene is smaller than the tile size' )
+EPS=1e-6
+
+
+#
+# Inference
+#
+class Inference(object):
+    """ Inference
+
+    Sliding-window inference over a scene with overlap blending and
+    streamed output.
+
+    The scene is tiled (Tiller with edge='shift', so the scene is fully
+    covered without boundless reads) and tiles are read/preprocessed with
+    `handler.sample` on the shared thread-pool, `prefetch` batches ahead of
+    the model. Predictions are blended into an accumulator that only spans
+    the current band of tile-rows: as soon as every tile touching a band of
+    pixel-rows has been predicted, the rows are written to the output GeoTIFF
+    and dropped. Memory is bounded by a few tile-rows, not the scene.
+
+    Usage:
+        inference=Inference(
+            handler,
+            model.predict,
+            size=256,
+            overlap=32,
+            blend='feather',
+            postprocess=lambda im: im.argmax(axis=0)[None].astype('uint8'))
+        inference.run(input_path,'prediction.tif')
+
+    Args:
+        handler<InputTargetHandler>:
+            handler used to read/preprocess the input tiles. windows are
+            passed directly (no random cropping or augmentation)
+        predict<callable>:
+            - predict(inputs)=>predictions for a batch of preprocessed tiles
+            - predictions are (B,C,h,w) (or (B,h,w,C) if bands-last, or (B,h,w))
+            - h,w may be smaller than the tile (centered in the tile). pixels
+              not covered by any prediction (the scene border) are 0
+        size<int|tuple>: tile size or (width, height)
+        overlap<int>: tile overlap (see Tiller)
+        batch_size<int>: number of tiles per predict call
+        prefetch<int>: number of batches read ahead of the model
+        blend<str>:
+            - 'crop': each pixel comes from the tile whose inner region
+              (the tile without its overlap margins) contains it. the band 
+              shared by a shifted edge tile and its neighbour is split at its 
+              middle
+            - 'feather': weighted average with weights that ramp down linearly
+              across the bands shared with neighbouring tiles
+        output_dtype<str>: dtype of the output GeoTIFF
+        postprocess<callable|None>:
+            applied to each finished block (C,h,W) before writing (e.g. argmax).
+            must return a 2D or bands-first 3D array
+        profile<dict|None>: updates for the output profile (compress, nodata, ...)
+    """
+    def __init__(self,
+            handler,
+            predict,
+            size=DEFAULT_SIZE,
+            overlap=0,
+            batch_size=BATCH_SIZE,
+            prefetch=PREFETCH,
+            blend=CROP,
+            output_dtype=OUTPUT_DTYPE,
+            postprocess=None,
+            profile=None):
+        if blend not in BLENDS:
+            raise ValueError(BLEND_ERROR)
+        self.handler=handler
+        self.predict=predict
+        self.size=size
+        self.overlap=overlap or 0
+        self.batch_size=batch_size
+        self.prefetch=max(1,prefetch)
+        self.blend=blend
+        self.output_dtype=output_dtype
+        self.postprocess=postprocess
+        self.profile=profile or {}
+
+
+    def tiller(self,input_path):
+        """ Tiller for the scene """
+        meta=io.info(input_path,catalog=getattr(self.handler,'catalog',None))
+        tiller=Tiller(
+            boundary_shape=(meta['height'],meta['width']),
+            size=self.size,
+            overlap=self.overlap,
+            edge=SHIFT)
+        if (tiller.width>meta['width']) or (tiller.height>meta['height']):
+            raise ValueError(SCENE_SIZE_ERROR)
+        return tiller
+
+
+    def run(self,input_path,output_path):
+        """ predict the scene at input_path and write the result to output_path
+
+        Returns:
+            <str> output_path
+        """
+        meta=io.info(input_path,catalog=getattr(self.handler,'catalog',None))
+        tiller=self.tiller(input_path)
+        order=_row_major(tiller)
+        batches=[
+            order[i:i+self.batch_size]
+            for i in range(0,len(order),self.batch_size) ]
+        writer=_BandWriter(
+            output_path,
+            self._output_profile(meta),
+            meta['width'],
+            meta['height'],
+            self.output_dtype,
+            self.postprocess)
+        remaining=np.bincount(_tile_rows(tiller,order),minlength=tiller.rows)
+        row_tops=None
+        pending=deque()
+        next_batch=0
+        try:
+            while next_batch<len(batches) and len(pending)<self.prefetch:
+                pending.append(self._submit(input_path,tiller,batches[next_batch]))
+                next_batch+=1
+            for indices in batches:
+                futures=pending.popleft()
+                if next_batch<len(batches):
+                    pending.append(self._submit(input_path,tiller,batches[next_batch]))
+                    next_batch+=1
+                inputs=np.stack([f.result()[0] for f in futures])
+                with profiler.stage('inference.predict') as timer:
+                    predictions=timer.add(self._bands_first(self.predict(inputs)))
+                if len(predictions)!=len(indices):
+                    raise ValueError(f'{PREDICTIONS_ERROR}: {len(predictions)}!={len(indices)}')
+                for index,prediction in zip(indices,predictions):
+                    window=tiller[int(index)]
+                    col,row=tiller.column_row(int(index))
+                    out_window=_output_window(window,prediction.shape[1:])
+                    if row_tops is None:
+                        row_tops=_row_tops(tiller,prediction.shape[1:])
+                    weights=self._weights(tiller,window,out_window,col,row)
+                    writer.add(prediction,weights,out_window)
+                    remaining[row]-=1
+                incomplete=np.flatnonzero(remaining)
+                if incomplete.size:
+                    writer.flush(row_tops[incomplete[0]])
+            writer.flush(meta['height'])
+        finally:
+            for futures in pending:
+                for future in futures:
+                    future.cancel()
+            writer.close()
+        return output_path
+
+
+    #
+    # INTERNAL
+    #
+    def _submit(self,input_path,tiller,indices):
+        pool=executor()
+        return [
+            pool.submit(
+                self.handler.sample,
+                input_path,
+                None,
+                params=_params(tiller[int(index)]))
+            for index in indices ]
+
+
+    def _bands_first(self,predictions):
+        predictions=np.asarray(predictions)
+        if predictions.ndim==3:
+            predictions=predictions[:,None]
+        elif not config.BANDS_FIRST:
+            predictions=np.moveaxis(predictions,-1,1)
+        return predictions
+
+
+    def _weights(self,tiller,window,out_window,col,row):
+        """ (h,w) blending weights for a prediction """
+        x0,y0=out_window[0]-window[0],out_window[1]-window[1]
+        w,h=out_window[2],out_window[3]
+        wx=_weights_1d(
+            tiller.tile_width,
+            *_shared(tiller.col_offsets,col,tiller.tile_width),
+            self.blend)[x0:x0+w]
+        wy=_weights_1d(
+            tiller.tile_height,
+            *_shared(tiller.row_offsets,row,tiller.tile_height),
+            self.blend)[y0:y0+h]
+        return wy[:,None]*wx[None,:]
+
+
+    def _output_profile(self,meta):
+        profile={
+            'driver': 'GTiff',
+            'width': meta['width'],
+            'height': meta['height'],
+            'crs': meta['crs'],
+            'transform': meta['transform'],
+            'tiled': True,
+            'blockxsize': 256,
+            'blockysize': 256,
+            'compress': 'lzw' }
+        if (meta['width']<256) or (meta['height']<256):
+            profile['tiled']=False
+            profile.pop('blockxsize')
+            profile.pop('blockysize')
+        profile.update(self.profile)
+        return profile
+
+
+class _BandWriter(object):
+    """ accumulates weighted predictions for a band of rows and streams finished rows """
+    def __init__(self,path,profile,width,height,dtype,postprocess):
+        self.path=path
+        self.profile=profile
+        self.width=width
+        self.height=height
+        self.dtype=dtype
+        self.postprocess=postprocess
+        self.top=0
+        self.values=None
+        self.weights=np.zeros((0,width),dtype=np.float64)
+        self.dst=None
+
+
+    def add(self,prediction,weights,window):
+        col,row,w,h=window
+        bottom=row+h-self.top
+        if self.values is None:
+            self.values=np.zeros((prediction.shape[0],0,self.width),dtype=np.float64)
+        if bottom>self.weights.shape[0]:
+            self._extend(bottom)
+        r0=row-self.top
+        self.values[:,r0:bottom,col:col+w]+=prediction*weights
+        self.weights[r0:bottom,col:col+w]+=weights
+
+
+    def flush(self,row):
+        """ write rows [top, row) """
+        nb_rows=min(row,self.height)-self.top
+        if (nb_rows<=0) or (self.values is None):
+            return
+        if nb_rows>self.weights.shape[0]:
+            self._extend(nb_rows)
+        with profiler.stage('inference.write') as timer:
+            weights=np.maximum(self.weights[:nb_rows],EPS)
+            block=self.values[:,:nb_rows]/weights
+            if self.postprocess:
+                block=self.postprocess(block)
+            if block.ndim==2:
+                block=block[None]
+            block=timer.add(block.astype(self.dtype,copy=False))
+            if self.dst is None:
+                self.profile.update({'count': block.shape[0], 'dtype': self.dtype})
+                self.dst=io.rio.open(self.path,'w',**self.profile)
+            self.dst.write(
+                block,
+                window=io.Window(0,self.top,self.width,nb_rows))
+        self.values=self.values[:,nb_rows:].copy()
+        self.weights=self.weights[nb_rows:].copy()
+        self.top+=nb_rows
+
+
+    def close(self):
+        if self.dst is not None:
+            self.dst.close()
+            self.dst=None
+
+
+    def _extend(self,nb_rows):
+        extra=nb_rows-self.weights.shape[0]
+        self.values=np.concatenate([
+            self.values,
+            np.zeros((self.values.shape[0],extra,self.width))],axis=1)
+        self.weights=np.concatenate([
+            self.weights,
+            np.zeros((extra,self.width))],axis=0)
+
+
+def _params(window):
+    return {
+        'window_index': None,
+        'input_window': window,
+        'target_window': window,
+        'float_x': None,
+        'float_y': None,
+        'k': False,
+        'flip': False }
+
+
+def _row_major(tiller):
+    """ tiller indices ordered by tile-row then tile-column """
+    return tiller.indices().reshape(tiller.cols,tiller.rows).T.ravel()
+
+
+def _tile_rows(tiller,indices):
+    return indices%tiller.rows
+
+
+def _output_window(window,shape):
+    """ prediction window (centered in the tile window) """
+    h,w=shape
+    if (h>window[3]) or (w>window[2]):
+        raise ValueError(OUTPUT_SIZE_ERROR)
+    return (
+        window[0]+(window[2]-w)//2,
+        window[1]+(window[3]-h)//2,
+        w,
+        h)
+
+
+def _row_tops(tiller,shape):
+    """ first output row of each tile-row """
+    h=shape[0]
+    return tiller.row_offsets+(tiller.tile_height-h)//2
+
+
+def _shared(offsets,index,size):
+    """ pixels a tile shares with the previous and next tile (0 at the scene edges) 
+
+    With edge='shift' the last tile shares more than 2*overlap pixels with 
+    the tile before it.
+    """
+    lead=trail=0
+    if index>0:
+        lead=max(int(offsets[index-1])+size-int(offsets[index]),0)
+    if index<len(offsets)-1:
+        trail=max(int(offsets[index])+size-int(offsets[index+1]),0)
+    return lead, trail
+
+
+def _weights_1d(size,lead,trail,blend):
+    """ blending weights along one tile axis 
+    
+    lead/trail are the pixels shared with the previous/next tile. 'crop' 
+    splits each shared band at its middle, 'feather' ramps across it. 
+    scene edges are not tapered.
+    """
+    weights=np.ones(size,dtype=np.float64)
+    if blend==CROP:
+        if lead:
+            weights[:lead//2]=EPS
+        if trail:
+            weights[size-(trail-trail//2):]=EPS
+    else:
+        if lead:
+            weights[:lead]=np.maximum((np.arange(lead)+0.5)/lead,EPS)
+        if trail:
+            weights[size-trail:]=np.minimum(
+                weights[size-trail:],
+                np.maximum((np.arange(trail)+0.5)/trail,EPS)[::-1])
+    return weights
+    if blend==CROP:
+        if not first:
+            weights[:overlap]=EPS
+        if not last:
+            weights[size-overlap:]=EPS
+    else:
+        ramp=(np.arange(2*overlap)+0.5)/(2*overlap)
+        ramp=np.maximum(ramp,EPS)
+        if not first:
+            weights[:2*overlap]=ramp
+        if not last:
+            weights[size-2*overlap:]=np.minimum(
+                weights[size-2*overlap:],
+                ramp[::-1])
+    return weights
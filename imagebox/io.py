@@ -1,16 +1,21 @@
 import os
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import rasterio as rio
 from rasterio.windows import Window
 from rasterio.enums import Resampling
 from affine import Affine
-from imagebox.config import FIRST, LAST, BAND_ORDERING
+import imagebox.config as config
+from imagebox.config import FIRST, LAST
 from . import utils
+from . import resources
 #
 # CONSTANTS
 #
 RESAMPLING=Resampling.bilinear
+STACK_READS='io.stack_reads'
 
 #
 # READ/WRITE
@@ -26,10 +31,12 @@ def read(
         bands=None,
         resampling=RESAMPLING,
         band_ordering=None,
-        dtype=None):
+        dtype=None,
+        boundless=False,
+        fill_value=None):
     """ read image
     Args: 
-        - path<str>: source path
+        - path<str|VirtualStack>: source path (or virtual stack)
         - window<tuple|Window>: col_off, row_off, width, height
         - window_profile<bool>:
             - if True return profile for the window data
@@ -38,9 +45,28 @@ def read(
         - scale<float>: rescale image res=>res*scale overrides out_shape
         - out_shape<tuple>: (h,w) rescales image. overwritten by res and scale
         - dtype<str>:
+        - boundless<bool>: 
+            if True windows may extend beyond the image. out of bounds 
+            pixels are set to fill_value (or the src nodata value)
+        - fill_value<number|None>: fill value for boundless reads
     Returns:
         <tuple> np.array, image-profile
     """
+    if isinstance(path,VirtualStack):
+        return path.read(
+            window=window,
+            window_profile=window_profile,
+            return_profile=return_profile,
+            res=res,
+            scale=scale,
+            out_shape=out_shape,
+            bands=bands,
+            resampling=resampling,
+            band_ordering=band_ordering,
+            dtype=dtype,
+            boundless=boundless,
+            fill_value=fill_value)
+    resources.configure_gdal()
     with rio.open(path,'r') as src:
         if return_profile:
             profile=src.profile
@@ -63,7 +89,9 @@ def read(
                 indexes=bands,
                 window=window,
                 out_shape=out_shape,
-                resampling=resampling )
+                resampling=resampling,
+                boundless=boundless,
+                fill_value=fill_value )
         if dtype:
             image=image.astype(dtype)
         image=utils.order_bands(image,band_ordering)
@@ -73,6 +101,65 @@ def read(
         return image
 
 
+def read_aligned(
+        path,
+        target_profile,
+        return_profile=True,
+        bands=None,
+        resampling=None,
+        band_ordering=None,
+        dtype=None,
+        fill_value=None,
+        masked=False):
+    """ read image aligned pixel-for-pixel to a target grid
+
+    Only the source data covering the target is read. Matching grids are 
+    read as a (boundless) window, otherwise the source is warped to the 
+    target crs/transform/shape through a WarpedVRT (see utils.read_aligned).
+
+    Args: 
+        - path<str>: source path
+        - target_profile<dict>: profile with crs, transform, width and height
+        - bands<int|list|None>: band index (or indices) to read
+        - resampling<Resampling|None>: 
+            resampling used when warping (if None: nearest for integer sources, bilinear otherwise)
+        - dtype<str>:
+        - fill_value<number|None>: 
+            value for pixels outside of the source (defaults to the src nodata or 0)
+        - masked<bool>: 
+            if True return a masked array (see utils.read_aligned)
+    Returns:
+        <tuple> np.array, image-profile (the target grid with the source bands/dtype)
+    """
+    resources.configure_gdal()
+    with rio.open(path,'r') as src:
+        image=utils.read_aligned(
+            src,
+            target_profile,
+            bands=bands,
+            resampling=resampling,
+            fill_value=fill_value,
+            masked=masked)
+        if return_profile:
+            profile=src.profile
+            profile.update({
+                'crs': target_profile.get('crs') or src.crs,
+                'transform': target_profile['transform'],
+                'width': target_profile['width'],
+                'height': target_profile['height'],
+                'count': image.shape[0] if image.ndim==3 else 1 })
+    if dtype:
+        image=image.astype(dtype)
+        if return_profile:
+            profile['dtype']=dtype
+    if image.ndim==3:
+        image=utils.order_bands(image,band_ordering)
+    if return_profile:
+        return image, profile
+    else:
+        return image
+
+
 def write(im,path,profile,makedirs=True):
     """ write image
     Args: 
@@ -88,41 +175,358 @@ def write(im,path,profile,makedirs=True):
     affine_transform=profile.get('affine')
     if affine_transform:
         profile['transform']=affine_transform
+    resources.configure_gdal()
     with rio.open(path,'w',**profile) as dst:
         dst.write(im)
-        
+
+
+def open_writer(path,profile,makedirs=True):
+    """ open image for (windowed) writing
+
+    Usage:
+        with io.open_writer(path,profile) as dst:
+            dst.write(im,window=Window(col_off,row_off,width,height))
+
+    Args:
+        - path<str>: destination path
+        - profile<dict>: image profile
+        - makedirs<bool>: if True create necessary directories
+    Returns:
+        <rasterio dataset> open in 'w' mode
+    """
+    if makedirs:
+        dirname=os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname,exist_ok=True)
+    profile=dict(profile)
+    affine_transform=profile.pop('affine',None)
+    if affine_transform:
+        profile['transform']=affine_transform
+    resources.configure_gdal()
+    return rio.open(path,'w',**profile)
+
+
+def info(path,catalog=None):
+    """ image metadata without reading the image data
+
+    Args: 
+        - path<str|VirtualStack>: source path (or virtual stack)
+        - catalog<catalog.Catalog|None>: if passed, use the catalog record when available
+    Returns:
+        <dict> path, width, height, count, dtype, block_width, block_height,
+        res, transform, crs, nodata, overviews, mtime, size
+    """
+    if isinstance(path,VirtualStack):
+        return path.info()
+    if catalog is not None:
+        record=catalog.get(path)
+        if record:
+            return record
+    resources.configure_gdal()
+    with rio.open(path,'r') as src:
+        block_height,block_width=src.block_shapes[0]
+        meta={
+            'path': path,
+            'width': src.width,
+            'height': src.height,
+            'count': src.count,
+            'dtype': src.dtypes[0],
+            'block_width': block_width,
+            'block_height': block_height,
+            'res': src.res,
+            'transform': src.transform,
+            'crs': src.crs.to_string() if src.crs else None,
+            'nodata': src.nodata,
+            'overviews': src.overviews(1) }
+    if os.path.exists(path):
+        stat=os.stat(path)
+        meta['mtime'],meta['size']=stat.st_mtime,stat.st_size
+    else:
+        meta['mtime'],meta['size']=None,None
+    return meta
+
 
 def read_stack(paths,res_list=None,stack_res=FIRST,resampling=RESAMPLING):
     """ band-wise read for images
 
-    Args: 
+    Args:
         - paths<list>: list of source paths (per-band/ordered)
-        - res_list<list|None>: 
-            * list of resolutions.  
+        - res_list<list|None>:
+            * list of resolutions.
             * if passed will rescale bands to stack_res
         - stack_res:
             * resolution to rescale all bands to
             * if 'first' use the first resolution in res_list
         - resampling<str>: resampling method
+    Returns:
+        <tuple> np.array, image-profile (see VirtualStack)
+    """
+    stack=VirtualStack(
+        paths,
+        res_list=res_list,
+        stack_res=stack_res,
+        resampling=resampling)
+    return stack.read()
+
+
+#
+# VIRTUAL STACK
+#
+class VirtualStack(object):
+    """ VirtualStack
+
+    Lazy band stack over per-band files (e.g. 10/20/60m Sentinel-2 bands).
+
+    The stack behaves like a single raster: pass it as the path to `read`,
+    `info`, an InputTargetHandler or a MultiTiller. A read only reads the
+    requested window of each band file, resampled to the stack grid (GDAL
+    reads the matching, possibly fractional, source window with an
+    out_shape). Bands are decoded in parallel threads directly into one
+    output buffer.
+
+    The stack grid has the first band's origin and crs with `stack_res`
+    pixels. All bands are assumed to cover the same extent.
+
+    Usage:
+        stack=io.VirtualStack(
+            [b02_path,b03_path,b04_path,b08_path,b11_path,b12_path],
+            res_list=[10,10,10,10,20,20])
+        im,profile=io.read(stack,window=(512,512,256,256))
+        handler=hand.InputTargetHandler(example_path=stack,...)
+        inputs,targets,params=handler.batch([(stack,target_path,window)])
+
+    Args:
+        paths<list>:
+            - per-band (ordered) paths
+            - a (path, band) tuple selects a band of a multi-band file (bands default to 1)
+        res_list<list|number|None>:
+            - resolution of each path
+            - if None the resolutions are read from the files
+        stack_res<number|'first'>: stack resolution ('first' uses the first band's resolution)
+        resampling<Resampling>: default resampling to the stack grid
     """
-    with rio.open(paths[0]) as src:
-        profile = src.profile
-    profile.update(count=len(paths))
-    if res_list:
-        if isinstance(res_list,int):
-            res_list=[res_list]*len(paths)
+    def __init__(self,paths,res_list=None,stack_res=FIRST,resampling=RESAMPLING):
+        self.paths=[]
+        self.bands=[]
+        for path in paths:
+            if isinstance(path,(tuple,list)):
+                path,band=path
+            else:
+                band=1
+            self.paths.append(path)
+            self.bands.append(int(band))
+        metas={ p: info(p) for p in self.paths }
+        self.transforms=[metas[p]['transform'] for p in self.paths]
+        if res_list is None:
+            res_list=[abs(t.a) for t in self.transforms]
+        elif not isinstance(res_list,(tuple,list)):
+            res_list=[res_list]*len(self.paths)
+        self.res_list=list(res_list)
         if stack_res is FIRST:
-            stack_res=res_list[0]
-        scale=(stack_res/res_list[0])
-        if scale!=1.0:
-            profile['width']*=scale
-            profile['height']*=scale
-        ims=[ read(p,scale=r/stack_res,band=1,resampling=resampling) 
-              for p,r in zip(paths,res_list) ]
-    else:
-        ims=[read(p,return_profile=False) for p in paths]
+            stack_res=self.res_list[0]
+        self.res=stack_res
+        self.resampling=resampling
+        self.profile=self._profile(metas[self.paths[0]])
+        self.width=self.profile['width']
+        self.height=self.profile['height']
+        self.count=self.profile['count']
+        self.dtype=self.profile['dtype']
+
+
+    def read(
+            self,
+            window=None,
+            window_profile=True,
+            return_profile=True,
+            res=None,
+            scale=None,
+            out_shape=None,
+            bands=None,
+            resampling=None,
+            band_ordering=None,
+            dtype=None,
+            boundless=False,
+            fill_value=None,
+            out=None):
+        """ read stack (see io.read)
+
+        Args:
+            (see io.read. bands are 1-based stack band indices. without 
+            boundless, windows are clipped to the stack)
+            resampling<Resampling|None>: resampling to the stack grid (defaults to the stack's resampling)
+            out<np.array|None>: bands-first buffer to decode into
+        """
+        if resampling is None:
+            resampling=self.resampling
+        if isinstance(window,Window):
+            window=window.flatten()
+        if window:
+            col_off,row_off,w,h=window
+            if not boundless:
+                col_off,row_off,w,h=self._clip(col_off,row_off,w,h)
+        else:
+            col_off,row_off,w,h=0,0,self.width,self.height
+        if res:
+            scale=self.res/res
+        if scale:
+            out_shape=(int(h*scale),int(w*scale))
+        out_shape=tuple(out_shape or (h,w))
+        if isinstance(bands,(int,np.integer)):
+            indexes=[int(bands)]
+        else:
+            indexes=list(bands or range(1,self.count+1))
+        if out is None:
+            out=np.empty((len(indexes),)+out_shape,dtype=self.dtype)
+        if fill_value is None:
+            fill_value=self.profile['nodata']
+        x=self.profile['transform'].c+col_off*self.res
+        y=self.profile['transform'].f-row_off*self.res
+        bounds=(x,y,w*self.res,h*self.res)
+        resources.configure_gdal()
+        reads=[
+            (out[i],index-1,bounds,resampling,boundless,fill_value)
+            for i,index in enumerate(indexes) ]
+        if len(reads)>1:
+            list(_executor().map(lambda args: self._read_band(*args),reads))
+        else:
+            for args in reads:
+                self._read_band(*args)
+        image=out
+        if isinstance(bands,(int,np.integer)):
+            image=image[0]
+        if dtype:
+            image=image.astype(dtype)
+        if image.ndim==3:
+            image=utils.order_bands(image,band_ordering)
+        if not return_profile:
+            return image
+        profile=self.profile.copy()
+        profile['count']=len(indexes)
+        if dtype:
+            profile['dtype']=dtype
+        if window and window_profile:
+            profile['transform']=Affine(self.res,0.0,x,0.0,-self.res,y)
+            profile['width'],profile['height']=w,h
+        if out_shape!=(profile['height'],profile['width']):
+            profile=rescale_profile(profile,out_shape)
+        return image, profile
+
+
+    def info(self):
+        """ metadata (see io.info) """
+        resources.configure_gdal()
+        crs=self.profile['crs']
+        return {
+            'path': None,
+            'width': self.width,
+            'height': self.height,
+            'count': self.count,
+            'dtype': self.dtype,
+            'block_width': self.profile.get('blockxsize'),
+            'block_height': self.profile.get('blockysize'),
+            'res': (self.res,self.res),
+            'transform': self.profile['transform'],
+            'crs': crs.to_string() if crs else None,
+            'nodata': self.profile['nodata'],
+            'overviews': [],
+            'mtime': None,
+            'size': None }
+
+
+    def __eq__(self,other):
+        return isinstance(other,VirtualStack) and (self._key()==other._key())
 
-    return np.concatenate(ims), profile        
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+    def __repr__(self):
+        return f'VirtualStack({self.count} bands, {self.height}x{self.width}, res={self.res})'
+
+
+    #
+    # INTERNAL
+    #
+    def _key(self):
+        return (
+            tuple(self.paths),
+            tuple(self.bands),
+            tuple(self.res_list),
+            self.res,
+            str(self.resampling))
+
+
+    def _clip(self,col_off,row_off,width,height):
+        """ intersection of a window with the stack (as for non-boundless file reads) """
+        x0,y0=max(col_off,0),max(row_off,0)
+        x1=min(col_off+width,self.width)
+        y1=min(row_off+height,self.height)
+        return x0, y0, max(x1-x0,0), max(y1-y0,0)
+
+
+    def _profile(self,meta):
+        """ first band's profile on the stack grid """
+        affine=meta['transform']
+        scale=self.res_list[0]/self.res
+        dtypes={}
+        for path in dict.fromkeys(self.paths):
+            with rio.open(path,'r') as src:
+                if path==self.paths[0]:
+                    profile=src.profile
+                dtypes[path]=src.dtypes
+        profile.update({
+            'count': len(self.paths),
+            'dtype': str(np.result_type(*[
+                dtypes[p][b-1] for p,b in zip(self.paths,self.bands) ])),
+            'width': int(round(meta['width']*scale)),
+            'height': int(round(meta['height']*scale)),
+            'transform': Affine(self.res,0.0,affine.c,0.0,-self.res,affine.f) })
+        return profile
+
+
+    def _read_band(self,out,i,bounds,resampling,boundless,fill_value):
+        """ read bounds (x, y, width, height in crs units) of band i into out """
+        x,y,width,height=bounds
+        affine=self.transforms[i]
+        window=Window(
+            (x-affine.c)/affine.a,
+            (y-affine.f)/affine.e,
+            width/abs(affine.a),
+            height/abs(affine.e))
+        with rio.open(self.paths[i],'r') as src:
+            kwargs={
+                'window': window,
+                'resampling': resampling,
+                'boundless': boundless,
+                'fill_value': fill_value }
+            if src.dtypes[self.bands[i]-1]==str(out.dtype):
+                src.read(self.bands[i],out=out,**kwargs)
+            else:
+                out[:]=src.read(self.bands[i],out_shape=out.shape,**kwargs)
+
+
+_EXECUTOR=None
+_EXECUTOR_LOCK=threading.Lock()
+
+
+def _executor():
+    """ thread-pool used to decode stack bands in parallel """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR=ThreadPoolExecutor(
+                max_workers=resources.governor().workers(STACK_READS,config.MAX_WORKERS),
+                thread_name_prefix='imagebox.stack')
+    return _EXECUTOR
+
+
+def _reset_executor():
+    global _EXECUTOR
+    _EXECUTOR=None
+
+
+os.register_at_fork(after_in_child=_reset_executor)
 
 
 #
@@ -137,10 +541,3 @@ def rescale_profile(profile,out_shape):
     profile['transform']=Affine(res_x, 0.0, affine.c,0.0, res_y, affine.f)
     profile['height'],profile['width']=h_out,w_out
     return profile
-
-
-
-
-
-
-
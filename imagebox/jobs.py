@@ -0,0 +1,399 @@
+import os
+import json
+import glob
+import socket
+import traceback
+import numpy as np
+import imagebox.cli as cli
+from imagebox.handler import MultiTiller, DEFAULT_SIZE, DEFAULT_OVERLAP
+#
+# CONSTANTS
+#
+MANIFEST='manifest.json'
+JOURNALS='journals'
+CLAIMS='claims'
+VERSION=1
+MAX_ATTEMPTS=2
+DONE='done'
+FAILED='failed'
+NO_MANIFEST_ERROR='imagebox.jobs: no manifest found. pass paths to create the job'
+MANIFEST_ERROR='imagebox.jobs: job exists with a different manifest'
+SHARD_ERROR='imagebox.jobs: shard must be in [0, shards)'
+
+
+#
+# Job
+#
+class Job(object):
+    """ Job
+
+    Resumable, shardable job over the (file, window) units of a dataset.
+
+    A dataset (paths) and a tiller config are expanded into work units: the
+    global indices of a MultiTiller. The manifest (`root/manifest.json`)
+    stores the paths, raster shapes and tiller config, so every node expands
+    the same units without reading the rasters. Units are split into
+    `shards` contiguous ranges (one per node).
+
+    Completed and failed units are appended to a journal (one per shard,
+    `root/journals/`). Each record is a single json line written with one
+    append (and fsync), so a record is either fully written or, if a node
+    dies mid-write, an incomplete final line that is ignored. On restart
+    finished units are skipped and units that have failed `max_attempts`
+    times are quarantined (skipped and reported in `status`).
+
+    Nodes coordinate only through the shared filesystem: the manifest is
+    created atomically (the first node creates it, the others check theirs
+    matches) and nodes without an assigned shard can `claim` one.
+
+    Usage:
+        job=Job('runs/chips',paths,shards=8,size=256,overlap=16)
+        job.run(worker,shard=3,args=(output_dir,))
+        job.status()
+
+        # any node (after the job has been created)
+        job=Job('runs/chips')
+        shard=job.claim()
+        job.run(worker,shard=shard)
+
+    Args:
+        root<str>: job directory (on a filesystem shared by the nodes)
+        paths<list|None>:
+            - input paths or (input_path, target_path) tuples
+            - required to create the job (optional if the manifest exists)
+        shards<int>: number of shards
+        size,overlap,edge,configs: tiller config (see MultiTiller)
+        catalog<catalog.Catalog|None>: catalog used for raster shapes
+        max_attempts<int>: failures before a unit is quarantined
+        fsync<bool>: fsync each journal record
+    """
+    def __init__(
+            self,
+            root,
+            paths=None,
+            shards=1,
+            size=DEFAULT_SIZE,
+            overlap=DEFAULT_OVERLAP,
+            edge=None,
+            configs=None,
+            catalog=None,
+            max_attempts=MAX_ATTEMPTS,
+            fsync=True):
+        self.root=root
+        self.max_attempts=max_attempts
+        self.fsync=fsync
+        os.makedirs(os.path.join(root,JOURNALS),exist_ok=True)
+        os.makedirs(os.path.join(root,CLAIMS),exist_ok=True)
+        if paths is None:
+            self.manifest=self._read_manifest()
+        else:
+            tiller=MultiTiller(
+                paths,
+                size=size,
+                overlap=overlap,
+                edge=edge,
+                configs=configs,
+                catalog=catalog)
+            self.manifest=self._create_manifest(tiller,paths,shards,size,overlap,edge,configs)
+        self.shards=self.manifest['shards']
+        self.tiller=MultiTiller(
+            [tuple(p) if isinstance(p,list) else p for p in self.manifest['paths']],
+            shapes=self.manifest['shapes'],
+            **self.manifest['tiller'])
+        self.nb_units=len(self.tiller)
+
+
+    def shard_units(self,shard):
+        """ unit indices of a shard """
+        if not (0<=shard<self.shards):
+            raise ValueError(SHARD_ERROR)
+        return np.arange(
+            shard*self.nb_units//self.shards,
+            (shard+1)*self.nb_units//self.shards)
+
+
+    def unit(self,index):
+        """ (path, window) for a unit index """
+        return self.tiller.path(index), self.tiller.window(index)
+
+
+    def records(self):
+        """ journal records (all shards) """
+        records=[]
+        for path in sorted(glob.glob(os.path.join(self.root,JOURNALS,'*.log'))):
+            records+=Journal(path).read()
+        return records
+
+
+    def done(self):
+        """ sorted array of finished unit indices """
+        return np.unique(np.array(
+            [r['unit'] for r in self.records() if r['status']==DONE],
+            dtype=np.int64))
+
+
+    def failures(self):
+        """ { unit index: [error, ...] } for units that failed (and have not finished) """
+        done=set(self.done().tolist())
+        failures={}
+        for r in self.records():
+            if (r['status']==FAILED) and (r['unit'] not in done):
+                failures.setdefault(r['unit'],[]).append(r.get('error'))
+        return failures
+
+
+    def quarantined(self):
+        """ sorted array of units that failed max_attempts times """
+        return np.array(sorted(
+            u for u,errors in self.failures().items()
+            if len(errors)>=self.max_attempts),dtype=np.int64)
+
+
+    def pending(self,shard=None,retry=False):
+        """ unit indices to run
+
+        Args:
+            shard<int|None>: shard (all units if None)
+            retry<bool>: if True include quarantined units
+        """
+        if shard is None:
+            units=np.arange(self.nb_units)
+        else:
+            units=self.shard_units(shard)
+        skip=self.done()
+        if not retry:
+            skip=np.union1d(skip,self.quarantined())
+        return units[~np.isin(units,skip)]
+
+
+    def status(self):
+        """ unit counts (total, done, failed, quarantined, pending) for the job and each shard """
+        done=self.done()
+        failed=np.array(sorted(self.failures()),dtype=np.int64)
+        quarantined=self.quarantined()
+        def _counts(units):
+            return {
+                'total': len(units),
+                'done': int(np.isin(units,done).sum()),
+                'failed': int(np.isin(units,failed).sum()),
+                'quarantined': int(np.isin(units,quarantined).sum()),
+                'pending': int((~np.isin(units,np.union1d(done,quarantined))).sum()) }
+        status=_counts(np.arange(self.nb_units))
+        status['shards']=[_counts(self.shard_units(s)) for s in range(self.shards)]
+        return status
+
+
+    def claim(self):
+        """ claim the first unclaimed shard with pending units (None if there are none)
+
+        Claims are files created with O_EXCL in `root/claims/`. They are
+        removed by `release` (or at the end of `run`). A node that dies
+        keeps its claim: restart its shard explicitly or `release` it.
+        """
+        for shard in range(self.shards):
+            if not len(self.pending(shard)):
+                continue
+            try:
+                fd=os.open(self._claim_path(shard),os.O_CREAT|os.O_EXCL|os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd,'w') as file:
+                json.dump({ 'host': socket.gethostname(), 'pid': os.getpid() },file)
+            return shard
+
+
+    def release(self,shard):
+        """ remove the claim on a shard """
+        try:
+            os.remove(self._claim_path(shard))
+        except FileNotFoundError:
+            pass
+
+
+    def run(
+            self,
+            worker,
+            shard=None,
+            args=(),
+            workers=None,
+            unit_bytes=None,
+            on_result=None,
+            retry=False,
+            progress=True):
+        """ run the pending units of a shard (see cli.run)
+
+        Exceptions raised by the worker are recorded in the journal (and
+        the unit counted as failed) instead of stopping the run.
+
+        Args:
+            worker<func>: picklable worker(path,window,*args) returning (result, bytes_read)
+            shard<int|None>: shard (all units if None)
+            args,workers,unit_bytes,progress: see cli.run
+            on_result<func|None>: on_result(index,result) called for finished units
+            retry<bool>: if True also run quarantined units
+        Returns:
+            <dict> status
+        """
+        units=[
+            self.unit(index)+(int(index),)
+            for index in self.pending(shard,retry=retry) ]
+        journal=Journal(self._journal_path(shard),fsync=self.fsync)
+        def _record(unit,result):
+            index=unit[2]
+            if isinstance(result,Failure):
+                journal.append(index,FAILED,result.error)
+            else:
+                journal.append(index,DONE)
+                if on_result:
+                    on_result(index,result)
+        try:
+            cli.run(
+                _job_unit,
+                units,
+                args=(worker,)+tuple(args),
+                workers=workers,
+                unit_bytes=unit_bytes,
+                on_result=_record,
+                progress=progress)
+        finally:
+            journal.close()
+            if shard is not None:
+                self.release(shard)
+        return self.status()
+
+
+    #
+    # INTERNAL
+    #
+    def _manifest_path(self):
+        return os.path.join(self.root,MANIFEST)
+
+
+    def _journal_path(self,shard):
+        if shard is None:
+            name='all'
+        else:
+            name=f'shard-{shard:05d}'
+        return os.path.join(self.root,JOURNALS,f'{name}.log')
+
+
+    def _claim_path(self,shard):
+        return os.path.join(self.root,CLAIMS,f'shard-{shard:05d}')
+
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path(),'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            raise ValueError(NO_MANIFEST_ERROR)
+
+
+    def _create_manifest(self,tiller,paths,shards,size,overlap,edge,configs):
+        """ write the manifest atomically (or check it matches an existing manifest) """
+        manifest={
+            'version': VERSION,
+            'paths': [list(p) if isinstance(p,(tuple,list)) else p for p in paths],
+            'shapes': [[t.boundary_height,t.boundary_width] for t in tiller.tillers],
+            'tiller': {
+                'size': list(size) if isinstance(size,(tuple,list)) else size,
+                'overlap': overlap,
+                'edge': edge,
+                'configs': configs },
+            'shards': shards,
+            'nb_units': len(tiller) }
+        manifest=json.loads(json.dumps(manifest))
+        tmp_path=f'{self._manifest_path()}.{socket.gethostname()}.{os.getpid()}.tmp'
+        with open(tmp_path,'w') as file:
+            json.dump(manifest,file,indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        try:
+            os.link(tmp_path,self._manifest_path())
+        except FileExistsError:
+            if self._read_manifest()!=manifest:
+                raise ValueError(MANIFEST_ERROR)
+        finally:
+            os.remove(tmp_path)
+        return manifest
+
+
+
+
+class Journal(object):
+    """ Journal
+
+    Append-only journal of unit records (one json line per record).
+
+    Each record is written with a single `os.write` to a file opened with
+    O_APPEND (and optionally fsync'd), so records are never interleaved and
+    an interrupted write leaves at most an incomplete final line, which
+    `read` ignores.
+
+    Args:
+        path<str>: journal path
+        fsync<bool>: fsync after each record
+    """
+    def __init__(self,path,fsync=True):
+        self.path=path
+        self.fsync=fsync
+        self._fd=None
+
+
+    def append(self,unit,status,error=None):
+        if self._fd is None:
+            self._open()
+        record={ 'unit': int(unit), 'status': status }
+        if error is not None:
+            record['error']=error
+        os.write(self._fd,(json.dumps(record)+'\n').encode())
+        if self.fsync:
+            os.fsync(self._fd)
+
+
+    def read(self):
+        """ complete records """
+        if not os.path.exists(self.path):
+            return []
+        records=[]
+        with open(self.path,'r') as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd=None
+
+
+    def _open(self):
+        """ open for appending (terminating an incomplete final line) """
+        self._fd=os.open(self.path,os.O_CREAT|os.O_RDWR|os.O_APPEND,0o644)
+        size=os.fstat(self._fd).st_size
+        if size and (os.pread(self._fd,1,size-1)!=b'\n'):
+            os.write(self._fd,b'\n')
+
+
+
+
+class Failure(object):
+    """ worker exception (returned in place of a result) """
+    def __init__(self,error):
+        self.error=error
+
+
+#
+# INTERNAL
+#
+def _job_unit(path,window,index,worker,*args):
+    try:
+        return worker(path,window,*args)
+    except Exception:
+        return Failure(traceback.format_exc()), 0
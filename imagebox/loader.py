@@ -0,0 +1,320 @@
+import os
+import random
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import imagebox.profiler as profiler
+import imagebox.config as config
+import imagebox.resources as resources
+#
+# CONSTANTS
+#
+PREFETCH=2
+BATCH_SIZE=8
+WORKERS='loader.workers'
+BUFFERS='loader.buffers'
+CLOSED_ERROR='imagebox.loader: loader has been closed'
+
+
+#
+# Loader
+#
+class Loader(object):
+    """ Loader
+
+    Framework agnostic prefetching loader for an InputTargetHandler.
+
+    Batches are built by `handler.batch` in a process-pool. Each worker 
+    writes its batch directly into a ring of shared-memory buffers so 
+    arrays are never pickled between processes. Only the batch specs and
+    per-sample params are sent through the pool.
+
+    Usage:
+        loader=Loader(handler,specs,batch_size=16,workers=4,seed=123)
+        for epoch in range(nb_epochs):
+            for inputs,targets,params in loader:
+                ...
+        loader.close()
+
+    Args:
+        handler<InputTargetHandler>: handler used to read/process samples
+        specs<list>: list of (input_path, target_path, window) specs (see handler.batch)
+        batch_size<int>: batch size
+        workers<int|None>: number of worker processes (defaults to config.MAX_WORKERS)
+        prefetch<int>: 
+            - number of batches in flight 
+            - number of shared-memory buffers in the ring
+        shuffle<bool|None>: 
+            - shuffle specs each epoch
+            - if None shuffle unless a sampler is passed (which sets the order)
+        drop_last<bool>: drop final partial batch
+        sampler<sampler.LocalitySampler|None>:
+            - if passed, specs are the (input_path, target_path) pairs of the 
+              sampler's files and each epoch's specs are `sampler.specs(specs,epoch)`
+        seed<int|None>: 
+            - if int, shuffling, augmentation and float-cropping are seeded 
+              per (seed, epoch, sample) so results do not depend on which 
+              worker builds a batch
+            - if None each worker is seeded randomly
+        copy<bool>: 
+            - if True yield copies of the batch arrays
+            - if False yield views into the shared-memory ring. views are 
+              only valid until the next batch is requested
+        context<str|None>: multiprocessing start method ('fork','spawn',...)
+        priority<int>: memory priority of the shared-memory ring (see imagebox.resources)
+
+    Workers and memory are drawn from the resource governor (imagebox.resources): 
+    the number of worker processes is capped by the worker budget and the 
+    shared-memory ring is reserved in the memory budget (evicting lower priority
+    consumers such as read caches). If the ring does not fit, prefetch is 
+    reduced (to a minimum of 1). Each worker process gets an equal share of 
+    the remaining worker and memory budgets.
+
+    If the profiler (imagebox.profiler) is enabled, worker stage timings are 
+    merged into the parent process' profiler as batches arrive.
+    """
+    def __init__(self,
+            handler,
+            specs,
+            batch_size=BATCH_SIZE,
+            workers=None,
+            prefetch=PREFETCH,
+            shuffle=None,
+            drop_last=False,
+            sampler=None,
+            seed=None,
+            copy=True,
+            context=None,
+            priority=resources.LOADER_PRIORITY):
+        self.handler=handler
+        self.sampler=sampler
+        if sampler is None:
+            self.specs=list(specs)
+        else:
+            self.pairs=list(specs)
+            self.specs=sampler.specs(self.pairs,epoch=0)
+        self.batch_size=batch_size
+        self.priority=priority
+        self._governor=resources.governor()
+        self.workers=self._governor.workers(
+            f'{WORKERS}.{id(self)}',
+            workers or config.MAX_WORKERS)
+        self.prefetch=max(1,prefetch)
+        if shuffle is None:
+            shuffle=sampler is None
+        self.shuffle=shuffle
+        self.drop_last=drop_last
+        self.seed=seed
+        self.copy=copy
+        self.epoch=0
+        self.closed=False
+        self._set_buffers()
+        self._pool=ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context(context),
+            initializer=_init_worker,
+            initargs=(
+                handler,
+                self._buffer_specs(),
+                profiler.enabled(),
+                self._worker_budgets()))
+
+
+    def order(self,epoch=None):
+        """ spec order for epoch """
+        if epoch is None:
+            epoch=self.epoch
+        order=np.arange(len(self.specs))
+        if self.shuffle:
+            if self.seed is None:
+                rng=np.random.default_rng()
+            else:
+                rng=np.random.default_rng((self.seed,epoch))
+            rng.shuffle(order)
+        return order
+
+
+    def close(self):
+        """ shutdown workers and release shared-memory """
+        if self.closed:
+            return
+        self.closed=True
+        self._pool.shutdown(wait=True,cancel_futures=True)
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self._shms=[]
+        self._reservation.release()
+        self._governor.release_workers(f'{WORKERS}.{id(self)}')
+
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.specs)//self.batch_size
+        else:
+            return -(-len(self.specs)//self.batch_size)
+
+
+    def __iter__(self):
+        if self.closed:
+            raise ValueError(CLOSED_ERROR)
+        epoch=self.epoch
+        self.epoch+=1
+        if self.sampler is not None:
+            self.specs=self.sampler.specs(self.pairs,epoch=epoch)
+        order=self.order(epoch)
+        batches=[
+            order[i:i+self.batch_size] 
+            for i in range(0,len(self)*self.batch_size,self.batch_size) ]
+        free=list(range(self.prefetch))
+        pending={}
+        nxt=0
+        try:
+            for index in range(len(batches)):
+                while free and (nxt<len(batches)):
+                    slot=free.pop(0)
+                    pending[nxt]=(self._submit(epoch,nxt,slot,batches[nxt]),slot)
+                    nxt+=1
+                future,slot=pending.pop(index)
+                size,params,snapshot=future.result()
+                if snapshot:
+                    profiler.merge(snapshot)
+                inputs,targets=self._arrays[slot]
+                inputs,targets=inputs[:size],targets[:size]
+                if self.copy:
+                    inputs,targets=inputs.copy(),targets.copy()
+                yield inputs, targets, params
+                free.append(slot)
+        finally:
+            for future,_ in pending.values():
+                future.cancel()
+            for future,_ in pending.values():
+                if not future.cancelled():
+                    future.exception()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self,*args):
+        self.close()
+
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+    #
+    # INTERNAL
+    #
+    def _set_buffers(self):
+        inputs,targets,_=self.handler.batch(self.specs[:1])
+        self._shapes=[inputs.shape[1:],targets.shape[1:]]
+        self._dtypes=[inputs.dtype,targets.dtype]
+        self._reserve((inputs.nbytes+targets.nbytes)*self.batch_size)
+        self._shms=[]
+        self._arrays=[]
+        for _ in range(self.prefetch):
+            arrays=[]
+            for shape,dtype in zip(self._shapes,self._dtypes):
+                nbytes=int(np.prod((self.batch_size,)+shape))*dtype.itemsize
+                shm=shared_memory.SharedMemory(create=True,size=max(nbytes,1))
+                self._shms.append(shm)
+                arrays.append(_as_array(shm,self.batch_size,shape,dtype))
+            self._arrays.append(arrays)
+
+
+    def _reserve(self,slot_bytes):
+        """ reserve the ring in the memory budget (reducing prefetch to fit) """
+        while self.prefetch>1:
+            try:
+                self._reservation=self._governor.reserve(
+                    BUFFERS,
+                    self.prefetch*slot_bytes,
+                    priority=self.priority)
+                return
+            except MemoryError:
+                self.prefetch-=1
+        self._reservation=self._governor.reserve(
+            BUFFERS,
+            slot_bytes,
+            priority=self.priority,
+            strict=False)
+
+
+    def _worker_budgets(self):
+        """ (memory, workers) budget for each worker process """
+        memory=self._governor.available()
+        if memory is not None:
+            memory=memory//self.workers
+        workers=max(1,self._governor.worker_budget//self.workers)
+        return memory, workers
+
+
+    def _buffer_specs(self):
+        names=[shm.name for shm in self._shms]
+        return [
+            (names[2*i],names[2*i+1],self.batch_size,self._shapes,self._dtypes) 
+            for i in range(self.prefetch) ]
+
+
+    def _submit(self,epoch,index,slot,order):
+        specs=[self.specs[i] for i in order]
+        if self.seed is not None:
+            specs=[
+                tuple(spec[:2])+(spec[2] if len(spec)>2 else None,hash((self.seed,epoch,i)))
+                for spec,i in zip(specs,order) ]
+        return self._pool.submit(_load_batch,slot,specs)
+
+
+#
+# WORKER
+#
+_WORKER={}
+
+
+def _init_worker(handler,buffer_specs,profile,budgets):
+    random.seed()
+    np.random.seed()
+    memory_budget,worker_budget=budgets
+    resources.configure(memory_budget=memory_budget,worker_budget=worker_budget)
+    shms=[]
+    arrays=[]
+    for inputs_name,targets_name,batch_size,shapes,dtypes in buffer_specs:
+        slot=[]
+        for name,shape,dtype in zip((inputs_name,targets_name),shapes,dtypes):
+            shm=shared_memory.SharedMemory(name=name)
+            shms.append(shm)
+            slot.append(_as_array(shm,batch_size,shape,dtype))
+        arrays.append(slot)
+    profiler.reset()
+    if profile:
+        profiler.enable()
+    else:
+        profiler.disable()
+    _WORKER['handler']=handler
+    _WORKER['shms']=shms
+    _WORKER['arrays']=arrays
+
+
+def _load_batch(slot,specs):
+    inputs,targets=_WORKER['arrays'][slot]
+    size=len(specs)
+    _,_,params=_WORKER['handler'].batch(
+        specs,
+        inputs=inputs[:size],
+        targets=targets[:size])
+    if profiler.enabled():
+        snapshot=profiler.snapshot(reset=True)
+    else:
+        snapshot=None
+    return size, params, snapshot
+
+
+def _as_array(shm,batch_size,shape,dtype):
+    return np.ndarray((batch_size,)+tuple(shape),dtype=dtype,buffer=shm.buf)
@@ -0,0 +1,333 @@
+import math
+import numpy as np
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.warp import transform_bounds
+import imagebox.io as io
+import imagebox.utils as utils
+import imagebox.cli as cli
+from imagebox.handler import Tiller, PAD
+from imagebox.config import FIRST
+#
+# CONSTANTS
+#
+LAST='last'
+MIN='min'
+MAX='max'
+MEAN='mean'
+PRIORITY='priority'
+RULES=[FIRST,LAST,MIN,MAX,MEAN,PRIORITY]
+BLOCK_SIZE=512
+RESAMPLING=Resampling.nearest
+EPS=1e-9
+RULE_ERROR=f'imagebox.mosaic: rule must be one of {RULES}'
+PRIORITIES_ERROR='imagebox.mosaic: priority rule requires a priority for each path'
+BLOCK_SIZE_ERROR='imagebox.mosaic: block_size must be a multiple of 16'
+NO_PATHS_ERROR='imagebox.mosaic: no input rasters'
+
+
+#
+# Mosaic
+#
+class Mosaic(object):
+    """ Mosaic
+
+    Streaming mosaic of many (overlapping) rasters.
+
+    The output grid is the union of the input bounds (utils.bounds_from_profile),
+    snapped to the first raster's pixel grid. The output is processed in
+    block-aligned windows (the output GeoTIFF is tiled with
+    block_size x block_size blocks). For each window only the sources that
+    intersect it are read, and each source is read only over its
+    intersection with the window (io.read_aligned: a window read for
+    aligned grids, a warp otherwise). Sources are merged one at a time into
+    the block, so memory is bounded by a few blocks per worker.
+
+    Merge rules ignore nodata pixels (the source nodata, NaN for float 
+    sources, or for warped sources without nodata the pixels outside the
+    source, masked with the warp's alpha band):
+        - 'first': the first source (in path order) with data
+        - 'last': the last source with data
+        - 'min'/'max': band-wise min/max
+        - 'mean': band-wise mean
+        - 'priority': the source with the highest priority that has data
+          (lower priority sources fill the nodata gaps)
+
+    Usage:
+        mosaic=Mosaic(paths,rule='priority',priorities=cloud_free_scores)
+        mosaic.profile                  # output profile
+        block=mosaic.read(mosaic.windows[0])
+        mosaic.run('mosaic.tif',workers=8)
+
+    Args:
+        paths<list>: raster paths (with the same band count)
+        rule<str>: merge rule (see above)
+        priorities<list|None>: priority for each path (required for rule='priority')
+        res<float|None>: output resolution (defaults to the first raster's resolution)
+        crs<str|None>: output crs (defaults to the first raster's crs)
+        bounds<tuple|None>: output bounds (minx, miny, maxx, maxy) (defaults to the union)
+        bands<list|None>: band indices to read (defaults to all)
+        nodata<number|None>: output nodata (defaults to the first raster's nodata or 0)
+        dtype<str|None>: output dtype (defaults to the first raster's dtype)
+        block_size<int>: output block size (multiple of 16)
+        resampling<Resampling>: resampling for sources that are not on the output grid
+        catalog<catalog.Catalog|None>: catalog used for raster metadata
+    """
+    def __init__(
+            self,
+            paths,
+            rule=FIRST,
+            priorities=None,
+            res=None,
+            crs=None,
+            bounds=None,
+            bands=None,
+            nodata=None,
+            dtype=None,
+            block_size=BLOCK_SIZE,
+            resampling=RESAMPLING,
+            catalog=None):
+        if rule not in RULES:
+            raise ValueError(RULE_ERROR)
+        if (rule==PRIORITY) and ((priorities is None) or (len(priorities)!=len(paths))):
+            raise ValueError(PRIORITIES_ERROR)
+        if block_size%16:
+            raise ValueError(BLOCK_SIZE_ERROR)
+        if not paths:
+            raise ValueError(NO_PATHS_ERROR)
+        self.paths=list(paths)
+        self.rule=rule
+        self.bands=bands
+        self.block_size=block_size
+        self.resampling=resampling
+        self.infos=cli._infos(self.paths,catalog)
+        first=self.infos[0]
+        self.crs=CRS.from_user_input(crs or first['crs'])
+        self.res=res or abs(first['transform'].a)
+        self.nodata=first['nodata'] if nodata is None else nodata
+        if self.nodata is None:
+            self.nodata=0
+        self.dtype=dtype or first['dtype']
+        self.source_bounds=self._source_bounds()
+        self.profile=self._profile(bounds)
+        self.source_windows=utils.bounds_to_windows(
+            self.profile['transform'],
+            self.source_bounds)
+        self.order=self._order(priorities)
+        self._mask_values=[self._mask_value(info) for info in self.infos]
+        tiller=Tiller(
+            boundary_shape=(self.profile['height'],self.profile['width']),
+            size=block_size,
+            edge=PAD)
+        windows=tiller.windows.copy()
+        windows[:,2]=np.minimum(windows[:,2],self.profile['width']-windows[:,0])
+        windows[:,3]=np.minimum(windows[:,3],self.profile['height']-windows[:,1])
+        windows.flags.writeable=False
+        self.windows=windows
+
+
+    def sources(self,window):
+        """ [(path, intersection-window, mask-value, masked), ...] for the sources intersecting window
+
+        Sources are in merge order. Intersection windows are in output pixels.
+        `masked` sources are read with a validity mask (see _mask_value).
+        """
+        col_off,row_off,width,height=window
+        sw=self.source_windows[self.order]
+        x0=np.maximum(sw[:,0],col_off)
+        y0=np.maximum(sw[:,1],row_off)
+        x1=np.minimum(sw[:,0]+sw[:,2],col_off+width)
+        y1=np.minimum(sw[:,1]+sw[:,3],row_off+height)
+        hits=np.flatnonzero((x1>x0)&(y1>y0))
+        return [
+            (
+                self.paths[self.order[i]],
+                (int(x0[i]),int(y0[i]),int(x1[i]-x0[i]),int(y1[i]-y0[i])))+
+                self._mask_values[self.order[i]]
+            for i in hits ]
+
+
+    def read(self,window):
+        """ merged (bands, height, width) array for an output window """
+        return _merge_block(tuple(int(v) for v in window),self.sources(window),*self._args())[0]
+
+
+    def run(self,path,workers=None,progress=True):
+        """ build the mosaic and write it to path (see cli.run for workers)
+
+        Blocks are merged in a process pool and written (in block-aligned
+        windows) by the parent process as they complete.
+        """
+        units=[(tuple(int(v) for v in w),self.sources(w)) for w in self.windows]
+        unit_bytes=self.block_size**2*self.profile['count']*np.dtype(np.float64).itemsize*3
+        with io.open_writer(path,self.profile) as dst:
+            cli.run(
+                _merge_block,
+                units,
+                args=self._args(),
+                workers=workers,
+                unit_bytes=unit_bytes,
+                on_result=lambda unit,im: dst.write(im,window=Window(*unit[0])),
+                progress=progress and 'mosaic')
+        return path
+
+
+    #
+    # INTERNAL
+    #
+    def _args(self):
+        return (
+            self.profile['crs'],
+            self.profile['transform'],
+            self.profile['count'],
+            self.dtype,
+            self.nodata,
+            self.rule,
+            self.bands,
+            self.resampling)
+
+
+    def _source_bounds(self):
+        bounds=[]
+        for info in self.infos:
+            b=utils.bounds_from_profile(info)
+            if info['crs'] and (CRS.from_user_input(info['crs'])!=self.crs):
+                b=transform_bounds(CRS.from_user_input(info['crs']),self.crs,*b)
+            bounds.append(b)
+        return np.array(bounds,dtype=np.float64)
+
+
+    def _profile(self,bounds):
+        """ union grid snapped to the first raster's pixel grid """
+        if bounds is None:
+            bounds=(
+                self.source_bounds[:,0].min(),
+                self.source_bounds[:,1].min(),
+                self.source_bounds[:,2].max(),
+                self.source_bounds[:,3].max())
+        minx,miny,maxx,maxy=bounds
+        ref=self.infos[0]['transform']
+        if CRS.from_user_input(self.infos[0]['crs'] or self.crs)==self.crs:
+            x0,y0=ref.c,ref.f
+        else:
+            x0,y0=minx,maxy
+        res=self.res
+        minx=x0+math.floor((minx-x0)/res+EPS)*res
+        maxy=y0-math.floor((y0-maxy)/res+EPS)*res
+        width=math.ceil((maxx-minx)/res-EPS)
+        height=math.ceil((maxy-miny)/res-EPS)
+        count=len(self.bands) if self.bands else self.infos[0]['count']
+        return {
+            'driver': 'GTiff',
+            'crs': self.crs,
+            'transform': Affine(res,0.0,minx,0.0,-res,maxy),
+            'width': width,
+            'height': height,
+            'count': count,
+            'dtype': self.dtype,
+            'nodata': self.nodata,
+            'tiled': True,
+            'blockxsize': self.block_size,
+            'blockysize': self.block_size,
+            'compress': 'lzw',
+            'interleave': 'pixel',
+            'BIGTIFF': 'IF_SAFER' }
+
+
+    def _order(self,priorities):
+        if self.rule==PRIORITY:
+            return np.argsort(-np.asarray(priorities,dtype=np.float64),kind='stable')
+        else:
+            return np.arange(len(self.paths))
+
+
+    def _mask_value(self,info):
+        """ (mask-value, masked) for a source
+
+        mask-value marks pixels without data (None if every read pixel is 
+        data). NaN pixels of float sources are never data (see _valid). 
+        Warped sources without nodata are read masked (the pixels outside the
+        source are masked) so no data value is reserved.
+        """
+        if info['nodata'] is not None:
+            return info['nodata'], False
+        if utils.grids_aligned(info,self.profile):
+            if np.issubdtype(np.dtype(info['dtype']),np.floating):
+                return np.nan, False
+            return None, False
+        return None, True
+
+
+#
+# WORKER
+#
+def _merge_block(window,sources,crs,transform,count,dtype,nodata,rule,bands,resampling):
+    """ merge the sources of an output window. returns (block, bytes_read) """
+    col_off,row_off,width,height=window
+    if rule==MEAN:
+        out=np.zeros((count,height,width),dtype=np.float64)
+        counts=np.zeros((height,width),dtype=np.int64)
+    else:
+        out=np.full((count,height,width),nodata,dtype=dtype)
+    have=np.zeros((height,width),dtype=bool)
+    nbytes=0
+    for path,(x,y,w,h),mask_value,masked in sources:
+        rows,cols=slice(y-row_off,y-row_off+h),slice(x-col_off,x-col_off+w)
+        if (rule in [FIRST,PRIORITY]) and have[rows,cols].all():
+            continue
+        im=io.read_aligned(
+            path,
+            {
+                'crs': crs,
+                'transform': transform*Affine.translation(x,y),
+                'width': w,
+                'height': h },
+            return_profile=False,
+            bands=bands,
+            resampling=resampling,
+            band_ordering=FIRST,
+            fill_value=mask_value,
+            masked=masked)
+        nbytes+=im.nbytes
+        if im.ndim==2:
+            im=im[None]
+        valid=_valid(im,mask_value)
+        im=np.ma.getdata(im)
+        block,seen=out[:,rows,cols],have[rows,cols]
+        if rule in [FIRST,PRIORITY]:
+            sel=valid&~seen
+            block[:,sel]=im[:,sel]
+        elif rule==LAST:
+            sel=valid
+            block[:,sel]=im[:,sel]
+        elif rule in [MIN,MAX]:
+            func=np.minimum if rule==MIN else np.maximum
+            both=valid&seen
+            new=valid&~seen
+            block[:,both]=func(block[:,both],im[:,both])
+            block[:,new]=im[:,new]
+        else:
+            block+=np.where(valid,im,0)
+            counts[rows,cols]+=valid
+        seen|=valid
+    if rule==MEAN:
+        out=out/np.maximum(counts,1)
+        if np.issubdtype(np.dtype(dtype),np.integer):
+            out=np.round(out)
+        out[:,~have]=nodata
+        out=out.astype(dtype)
+    return out, nbytes
+
+
+def _valid(im,mask_value):
+    """ (h,w) mask of pixels with data in any band (masked and NaN pixels are never data) """
+    invalid=np.ma.getmaskarray(im)
+    im=np.ma.getdata(im)
+    floating=np.issubdtype(im.dtype,np.floating)
+    if (mask_value is not None) and not (floating and np.isnan(mask_value)):
+        invalid=invalid|(im==mask_value)
+    if floating:
+        invalid=invalid|np.isnan(im)
+    return ~invalid.all(axis=0)
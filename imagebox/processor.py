@@ -1,7 +1,8 @@
 import random
 import numpy as np
-from scipy.signal import convolve2d
-from imagebox.config import FIRST, LAST, BAND_ORDERING, BANDS_FIRST
+from numpy.lib.stride_tricks import as_strided
+import imagebox.config as config
+from imagebox.config import FIRST, LAST
 #
 # CONSTANTS
 #
@@ -9,16 +10,34 @@ IMAGE='image'
 DEFAULT_VMAP_VALUE=IMAGE
 BANDS_FIRST_AXES=(1,2)
 BANDS_LAST_AXES=(0,1)
+MODE='mode'
+MEAN='mean'
+NEAREST='nearest'
+RESCALE_METHODS=[MODE,MEAN,NEAREST]
+MODE_BINCOUNT_RATIO=4
+SHIFT='shift'
+PAD='pad'
 DENORM_ERROR='imagebox.processor.denormalize: bands last not yet implemented'
 SWAP_BANDS_ERROR='imagebox.processor._swap_bands_axes: im.ndim must be 3 or 4'
 SMOOTHING_KERNEL=np.ones((3,3))
+RESCALE_METHOD_ERROR=f'imagebox.processor: method must be one of {RESCALE_METHODS}'
+CROP='crop'
+UNTILE_METHODS=[CROP,MEAN]
+UNTILE_METHOD_ERROR=f'imagebox.processor.untile: method must be one of {UNTILE_METHODS}'
+TILE_EDGE_ERROR="imagebox.processor: tiles views do not support tiller edge='shift'"
+TILE_SHAPE_ERROR='imagebox.processor: image is smaller than the tiller boundary'
+TILES_SHAPE_ERROR='imagebox.processor.untile: tiles do not match the tiller'
+RESCALE_FACTOR_ERROR='imagebox.processor.rescale: scale must be an integer or 1/integer'
 
 
 #
 # METHODS
 #
-def center(im,means=None,to_int=False,bands_first=BANDS_FIRST):
+def center(im,means=None,to_int=False,bands_first=None):
     """ center image array
+
+    If im is a float array the result keeps im's dtype (no float64 intermediates).
+
     Args:
         im<np.array>: image array
         means<np.array|list>: 
@@ -27,8 +46,10 @@ def center(im,means=None,to_int=False,bands_first=BANDS_FIRST):
         to_int<bool>: if true convert to uint8 after centering
         bands_first<bool>: true if array is bands first
     """
+    bands_first=config.get('BANDS_FIRST',bands_first)
     if means is None:
         means=np.mean(im,axis=_axes(im.ndim,bands_first))
+    means=_as_float(means,im)
     if bands_first:
         means=_to_vector(means)
     im=(im-means)
@@ -37,7 +58,7 @@ def center(im,means=None,to_int=False,bands_first=BANDS_FIRST):
     return im
 
 
-def normalize(im,means=None,stdevs=None,bands_first=BANDS_FIRST):
+def normalize(im,means=None,stdevs=None,bands_first=None):
     """ normalize image array
     Args:
         im<np.array>: image array
@@ -49,15 +70,17 @@ def normalize(im,means=None,stdevs=None,bands_first=BANDS_FIRST):
             - if none use the band-wise standard deviations of the image itself
         bands_first<bool>: true if array is bands first
     """
+    bands_first=config.get('BANDS_FIRST',bands_first)
     if stdevs is None:
         stdevs=np.std(im,axis=_axes(im.ndim,bands_first))   
     im=center(im,means=means,to_int=False,bands_first=bands_first)
+    stdevs=_as_float(stdevs,im)
     if bands_first:
         stdevs=_to_vector(stdevs)
     return im/stdevs
 
 
-def denormalize(im,means,stdevs,bands=[0,1,2],bands_first=BANDS_FIRST,dtype=np.uint8):
+def denormalize(im,means,stdevs,bands=[0,1,2],bands_first=None,dtype=np.uint8):
     """ denormalize image array
     Args:
         im<np.array>: image array
@@ -65,6 +88,7 @@ def denormalize(im,means,stdevs,bands=[0,1,2],bands_first=BANDS_FIRST,dtype=np.u
         stdevs<np.array|list>: stdevs
         bands_first<bool>: true if array is bands first
     """ 
+    bands_first=config.get('BANDS_FIRST',bands_first)
     if not bands_first:
         im=im[:,:,bands]
         im=im.transpose(2,0,1)
@@ -102,25 +126,34 @@ def map_values(im,value_map,default_value=DEFAULT_VMAP_VALUE):
     return mapped_im
 
 
-def to_categorical(im,nb_categories):
+def to_categorical(im,nb_categories,dtype=None):
     """ to categorical
     map single band int valued images to multi-band binary value image
+
+    Args:
+        im<np.array>: single band int valued image
+        nb_categories<int>: number of categories
+        dtype<str|None>: output dtype (defaults to float64)
     """
-    return np.eye(nb_categories)[:,im]
+    return np.eye(nb_categories,dtype=dtype)[:,im]
 
 
 
 def categorical_smoothing(im,nb_categories,kernel=SMOOTHING_KERNEL):
     """ smooth categorical inputs
+
+    Requires scipy (imported on first use).
     """
+    from scipy.signal import convolve2d
     im=to_categorical(im,nb_categories)
     for i in range(nb_categories):
         im[i]=convolve2d(im[i],kernel,mode='same')
     return im.argmax(axis=0)
 
 
-def crop(im,cropping,bands_first=BANDS_FIRST):
+def crop(im,cropping,bands_first=None):
     """ crop image """
+    bands_first=config.get('BANDS_FIRST',bands_first)
     if bands_first:
         if im.ndim==4:
             return im[:,:,cropping:-cropping,cropping:-cropping]
@@ -138,6 +171,193 @@ def crop(im,cropping,bands_first=BANDS_FIRST):
 
 
 
+def downsample(im,factor,method=MODE,bands_first=None):
+    """ downsample image by an integer factor
+
+    Vectorized block downsampling. The image is reshaped into 
+    (factor x factor) blocks, trailing rows/cols that do not fill a 
+    block are dropped.
+
+    Args:
+        im<np.array>: image array (2D, bands-first or bands-last)
+        factor<int>: downsampling factor
+        method<str>: 
+            - 'mode': most common value in each block (categorical images)
+            - 'mean': mean of each block
+            - 'nearest': center pixel of each block
+        bands_first<bool>: true if array is bands first
+    """
+    bands_first=config.get('BANDS_FIRST',bands_first)
+    factor=int(factor)
+    if factor==1:
+        return im
+    if method not in RESCALE_METHODS:
+        raise ValueError(RESCALE_METHOD_ERROR)
+    ndim=im.ndim
+    im=_to_bands_first_3d(im,bands_first)
+    nb_bands,height,width=im.shape
+    height,width=height//factor,width//factor
+    if method==NEAREST:
+        offset=factor//2
+        out=im[:,offset::factor,offset::factor][:,:height,:width]
+    else:
+        blocks=im[:,:height*factor,:width*factor].reshape(
+            nb_bands,height,factor,width,factor)
+        if method==MEAN:
+            out=blocks.mean(axis=(2,4),dtype=_mean_dtype(im))
+        else:
+            blocks=blocks.transpose(0,1,3,2,4).reshape(-1,factor*factor)
+            out=_block_mode(blocks).reshape(nb_bands,height,width)
+    return _from_bands_first_3d(out,ndim,bands_first)
+
+
+def upsample(im,factor,bands_first=None):
+    """ upsample image by an integer factor (nearest neighbor)
+
+    Args:
+        im<np.array>: image array (2D, bands-first or bands-last)
+        factor<int>: upsampling factor
+        bands_first<bool>: true if array is bands first
+    """
+    bands_first=config.get('BANDS_FIRST',bands_first)
+    factor=int(factor)
+    if factor==1:
+        return im
+    ndim=im.ndim
+    im=_to_bands_first_3d(im,bands_first)
+    nb_bands,height,width=im.shape
+    out=np.broadcast_to(
+        im[:,:,None,:,None],
+        (nb_bands,height,factor,width,factor)).reshape(
+            nb_bands,height*factor,width*factor)
+    return _from_bands_first_3d(out,ndim,bands_first)
+
+
+def rescale(im,scale,method=MODE,bands_first=None):
+    """ rescale image by an integer factor or 1/integer factor
+
+    Args:
+        im<np.array>: image array
+        scale<float>: 
+            - output size is input size * scale
+            - scale or 1/scale must be an integer
+        method<str>: downsampling method (see downsample). upsampling is nearest.
+        bands_first<bool>: true if array is bands first
+    """
+    bands_first=config.get('BANDS_FIRST',bands_first)
+    factor=integer_factor(scale)
+    if factor is None:
+        raise ValueError(RESCALE_FACTOR_ERROR)
+    if scale<1:
+        return downsample(im,factor,method=method,bands_first=bands_first)
+    else:
+        return upsample(im,factor,bands_first=bands_first)
+
+
+def integer_factor(scale,tolerance=1e-6):
+    """ integer factor for scale or 1/scale (None if neither is an integer) """
+    if scale<=0:
+        return None
+    factor=scale if scale>=1 else 1/scale
+    if abs(factor-round(factor))<=tolerance*factor:
+        return int(round(factor))
+
+
+def tile(im,tiller=None,size=None,overlap=0,bands_first=None,fill_value=0):
+    """ all tiller windows as a single (read-only) strided view
+
+    The tiles are a view into `im` (no copies) with shape:
+        - (rows, cols, C, h, w) for bands-first images
+        - (rows, cols, h, w, C) for bands-last images
+        - (rows, cols, h, w) for 2D images
+    tiles[row,col] is the window tiller[col*tiller.rows+row].
+
+    Args:
+        im<np.array>: image array
+        tiller<Tiller|None>: 
+            - tiller for the image shape (edge must be None or 'pad')
+            - for edge='pad' the image is padded with fill_value (one copy)
+            - if None: Tiller(boundary_shape=(h,w),size=size,overlap=overlap)
+        size,overlap: tile size and overlap (used if tiller is None)
+        bands_first<bool>: true if array is bands first
+        fill_value<number>: padding value for edge='pad'
+    """
+    bands_first=config.get('BANDS_FIRST',bands_first)
+    ndim=im.ndim
+    im=_to_bands_first_3d(im,bands_first)
+    if tiller is None:
+        tiller=_tiller(im.shape[1:],size,overlap)
+    _check_tiller_edge(tiller)
+    if tiller.edge==PAD:
+        im=_pad_to(im,tiller.height,tiller.width,fill_value)
+    elif (im.shape[1]<tiller.row_offset+tiller.height) or (im.shape[2]<tiller.col_offset+tiller.width):
+        raise ValueError(TILE_SHAPE_ERROR)
+    tiles=_grid_view(
+        im,
+        tiller.row_offset,
+        tiller.col_offset,
+        tiller.rows,
+        tiller.cols,
+        tiller.tile_height,
+        tiller.tile_width,
+        tiller.inner_height,
+        tiller.inner_width,
+        writeable=False)
+    return _from_bands_first_tiles(tiles,ndim,bands_first)
+
+
+def untile(tiles,tiller,method=CROP,out=None,bands_first=None):
+    """ inverse of tile: write tiles back into a full image
+
+    Overlapping tiles are merged in a fixed number of vectorized passes
+    (tiles in each pass do not overlap), without per-tile python loops.
+
+    Args:
+        tiles<np.array>: 
+            - tile grid (rows, cols, ...) as returned by tile
+            - or a batch (N, ...) of all tiles in tiller-index order
+        tiller<Tiller>: tiller the tiles come from (edge must be None or 'pad')
+        method<str>:
+            - 'crop': each pixel comes from the tile whose inner region (the 
+              tile without its overlap margins) contains it. tiles at the edge 
+              of the grid keep their outer margins. values are copied exactly.
+            - 'mean': average over all tiles containing the pixel
+        out<np.array|None>: 
+            - image (boundary shape) to write into
+            - if None a zero-image is created
+            - pixels outside of the tiled region are not changed
+        bands_first<bool>: true if tiles/out are bands first
+    Returns:
+        <np.array> image with the tiller's boundary shape
+    """
+    bands_first=config.get('BANDS_FIRST',bands_first)
+    if method not in UNTILE_METHODS:
+        raise ValueError(UNTILE_METHOD_ERROR)
+    _check_tiller_edge(tiller)
+    tiles,ndim=_to_bands_first_tiles(tiles,tiller,bands_first)
+    nb_bands=tiles.shape[2]
+    if out is None:
+        dtype=tiles.dtype if method==CROP else _mean_dtype(tiles)
+        out=np.zeros(
+            _image_shape(nb_bands,tiller.boundary_height,tiller.boundary_width,ndim,bands_first),
+            dtype=dtype)
+    canvas=_to_bands_first_3d(out,bands_first)
+    if tiller.edge==PAD:
+        target=np.zeros((nb_bands,tiller.height,tiller.width),dtype=canvas.dtype)
+    else:
+        target=canvas[
+            :,
+            tiller.row_offset:tiller.row_offset+tiller.height,
+            tiller.col_offset:tiller.col_offset+tiller.width]
+    if method==CROP:
+        _untile_crop(tiles,tiller,target)
+    else:
+        _untile_mean(tiles,tiller,target)
+    if tiller.edge==PAD:
+        canvas[:]=target[:,:canvas.shape[1],:canvas.shape[2]]
+    return out
+
+
 def pad(im,padding=1,axes=None,value=0):
     """ pad image along axes
     * im<np.array>: image to pad
@@ -174,7 +394,7 @@ def pad(im,padding=1,axes=None,value=0):
         constant_values=value)
 
 
-def augmentation(k=None,flip=None):
+def augmentation(k=None,flip=None,rng=None):
     """ get k(rotation), flip values for image augmentation
 
     For both k and flip passing None will randomly select a value
@@ -183,15 +403,18 @@ def augmentation(k=None,flip=None):
     Args:
         k<int|None|False>: number of 90 degree rotations
         flip<bool|None>: true/false to flip or not flip
+        rng<random.Random|None>: random generator (defaults to the random module)
     """
+    if rng is None:
+        rng=random
     if k is not False: 
-        if not k: k=random.randint(0,3)
+        if not k: k=rng.randint(0,3)
     if flip is not False:
-        if not flip: flip=random.choice([True,False])
+        if not flip: flip=rng.choice([True,False])
     return k,flip
 
 
-def augment(im,k=False,flip=False,bands_first=BANDS_FIRST,random=False):
+def augment(im,k=False,flip=False,bands_first=None,random=False):
     """ augment (rotate/flip) image
 
     Args:
@@ -200,6 +423,7 @@ def augment(im,k=False,flip=False,bands_first=BANDS_FIRST,random=False):
         flip<bool>: flip or don't flip
         random<bool>: if true get augmentation first
     """
+    bands_first=config.get('BANDS_FIRST',bands_first)
     if random:
         k, flip=augmentation()
     if k is not False:
@@ -209,7 +433,7 @@ def augment(im,k=False,flip=False,bands_first=BANDS_FIRST,random=False):
     return im
 
 
-def rotate(im,k,bands_first=BANDS_FIRST):
+def rotate(im,k,bands_first=None):
     """ rotate image
     Args:
         im<np.array>: image array
@@ -220,12 +444,13 @@ def rotate(im,k,bands_first=BANDS_FIRST):
     * - negative stride issue 
     * - https://discuss.pytorch.org/t/torch-from-numpy-not-support-negative-strides/3663/7
     """
+    bands_first=config.get('BANDS_FIRST',bands_first)
     im=np.rot90(im,k,axes=_axes(im.ndim,bands_first))
     im=im+0
     return im
 
 
-def flip_image(im,bands_first=BANDS_FIRST,axis=None):
+def flip_image(im,bands_first=None,axis=None):
     """ flip image
     Args:
         im<np.array>: image array
@@ -235,6 +460,7 @@ def flip_image(im,bands_first=BANDS_FIRST,axis=None):
     * - negative stride issue 
     * - https://discuss.pytorch.org/t/torch-from-numpy-not-support-negative-strides/3663/7
     """
+    bands_first=config.get('BANDS_FIRST',bands_first)
     if axis is None:
         if (im.ndim==2) or (not bands_first):
             axis=0
@@ -254,7 +480,8 @@ def rgb_rescale(
         rgb_max=255,
         im_max=2500,
         dtype=np.uint8,
-        bands_first=BANDS_FIRST):
+        bands_first=None):
+    bands_first=config.get('BANDS_FIRST',bands_first)
     if bands_first:
         if bands:
             im=im[bands]
@@ -272,7 +499,7 @@ def rgb_rescale(
             else:
                 im=im[:,:,:3]
     if im_max:
-        im=im.astype(np.float)*rgb_max/im_max
+        im=im.astype(np.float64)*rgb_max/im_max
     im=im.clip(0,rgb_max)
     if dtype:
         im=im.astype(dtype)
@@ -332,6 +559,187 @@ def _swap_bands_axes(im):
     return im
 
 
+def _to_bands_first_3d(im,bands_first):
+    if im.ndim==2:
+        return im[None]
+    elif bands_first:
+        return im
+    else:
+        return im.transpose(2,0,1)
+
+
+def _from_bands_first_3d(im,ndim,bands_first):
+    if ndim==2:
+        return im[0]
+    elif bands_first:
+        return im
+    else:
+        return im.transpose(1,2,0)
+
+
+def _mean_dtype(im):
+    if np.issubdtype(im.dtype,np.floating):
+        return im.dtype
+    else:
+        return np.float64
+
+
+def _block_mode(blocks):
+    """ row-wise mode (smallest value on ties) of a 2D array 
+
+    Integer arrays with a small value range are counted with bincount, 
+    other arrays (float or a wide value range) are sorted.
+    """
+    if np.issubdtype(blocks.dtype,np.integer) or (blocks.dtype==bool):
+        offset=int(blocks.min())
+        nb_values=int(blocks.max())-offset+1
+        if nb_values<=MODE_BINCOUNT_RATIO*blocks.shape[1]:
+            values=blocks.astype(np.int64)-offset
+            nb_blocks=values.shape[0]
+            counts=np.bincount(
+                (np.arange(nb_blocks)[:,None]*nb_values+values).ravel(),
+                minlength=nb_blocks*nb_values).reshape(nb_blocks,nb_values)
+            return (counts.argmax(axis=1)+offset).astype(blocks.dtype)
+    return _sorted_block_mode(blocks)
+
+
+def _sorted_block_mode(blocks):
+    """ row-wise mode (smallest value on ties) of a 2D array by sorting """
+    values=np.sort(blocks,axis=1)
+    index=np.arange(values.shape[1])
+    starts=np.ones(values.shape,dtype=bool)
+    starts[:,1:]=values[:,1:]!=values[:,:-1]
+    run_starts=np.maximum.accumulate(np.where(starts,index,0),axis=1)
+    # the first position reaching the longest run is the end of the smallest modal value
+    ends=(index-run_starts).argmax(axis=1)
+    return values[np.arange(values.shape[0]),ends]
+
+
 def _to_vector(arr):
-    return np.array(arr).reshape(-1,1,1)
+    return np.asarray(arr).reshape(-1,1,1)
+
 
+def _as_float(arr,im):
+    """ cast arr to im.dtype if im is a float array """
+    if np.issubdtype(im.dtype,np.floating):
+        return np.asarray(arr,dtype=im.dtype)
+    else:
+        return np.asarray(arr)
+
+
+
+def _tiller(shape,size,overlap):
+    from imagebox.handler import Tiller
+    return Tiller(boundary_shape=shape,size=size,overlap=overlap)
+
+
+def _check_tiller_edge(tiller):
+    if tiller.edge==SHIFT:
+        raise ValueError(TILE_EDGE_ERROR)
+
+
+def _pad_to(im,height,width,value):
+    nb_bands,h,w=im.shape
+    if (h>=height) and (w>=width):
+        return im
+    return np.pad(
+        im,
+        ((0,0),(0,max(height-h,0)),(0,max(width-w,0))),
+        mode='constant',
+        constant_values=value)
+
+
+def _grid_view(im,y0,x0,nb_rows,nb_cols,height,width,step_y,step_x,writeable=True):
+    """ (nb_rows,nb_cols,C,height,width) strided view of a bands-first 3D array """
+    c_stride,y_stride,x_stride=im.strides
+    return as_strided(
+        im[:,y0:,x0:],
+        shape=(nb_rows,nb_cols,im.shape[0],height,width),
+        strides=(y_stride*step_y,x_stride*step_x,c_stride,y_stride,x_stride),
+        writeable=writeable)
+
+
+def _from_bands_first_tiles(tiles,ndim,bands_first):
+    if ndim==2:
+        return tiles[:,:,0]
+    elif bands_first:
+        return tiles
+    else:
+        return tiles.transpose(0,1,3,4,2)
+
+
+def _to_bands_first_tiles(tiles,tiller,bands_first):
+    """ (rows,cols,C,h,w) tiles and the image ndim """
+    if tiles.shape[:2]!=(tiller.rows,tiller.cols):
+        if tiles.shape[0]!=len(tiller):
+            raise ValueError(TILES_SHAPE_ERROR)
+        tiles=tiles.reshape((tiller.cols,tiller.rows)+tiles.shape[1:]).swapaxes(0,1)
+    if tiles.ndim==4:
+        return tiles[:,:,None], 2
+    elif bands_first:
+        return tiles, 3
+    else:
+        return tiles.transpose(0,1,4,2,3), 3
+
+
+def _image_shape(nb_bands,height,width,ndim,bands_first):
+    if ndim==2:
+        return (height,width)
+    elif bands_first:
+        return (nb_bands,height,width)
+    else:
+        return (height,width,nb_bands)
+
+
+def _untile_crop(tiles,tiller,canvas):
+    """ copy the inner regions (and the outer margins of the edge tiles) """
+    ys=_crop_segments(tiller.rows,tiller.tile_height,tiller.inner_height,tiller.overlap)
+    xs=_crop_segments(tiller.cols,tiller.tile_width,tiller.inner_width,tiller.overlap)
+    for rows,y_slice,y0 in ys:
+        for cols,x_slice,x0 in xs:
+            view=_grid_view(
+                canvas,
+                y0,
+                x0,
+                rows.stop-rows.start,
+                cols.stop-cols.start,
+                y_slice.stop-y_slice.start,
+                x_slice.stop-x_slice.start,
+                tiller.inner_height,
+                tiller.inner_width)
+            view[:]=tiles[rows,cols,:,y_slice,x_slice]
+
+
+def _crop_segments(nb_tiles,size,inner,overlap):
+    """ (tile-selection, tile-slice, canvas-offset) for the margins/inner region along an axis """
+    segments=[(slice(0,nb_tiles),slice(overlap,size-overlap),overlap)]
+    if overlap:
+        segments+=[
+            (slice(0,1),slice(0,overlap),0),
+            (slice(nb_tiles-1,nb_tiles),slice(size-overlap,size),(nb_tiles-1)*inner+size-overlap)]
+    return segments
+
+
+def _untile_mean(tiles,tiller,canvas):
+    """ sum tiles in non-overlapping passes then divide by the tile counts """
+    height,width=tiller.tile_height,tiller.tile_width
+    inner_height,inner_width=tiller.inner_height,tiller.inner_width
+    steps_y=-(-height//inner_height)
+    steps_x=-(-width//inner_width)
+    values=np.zeros(canvas.shape,dtype=_mean_dtype(tiles))
+    counts=np.zeros((1,)+canvas.shape[1:],dtype=np.int64)
+    for a in range(steps_y):
+        for b in range(steps_x):
+            group=tiles[a::steps_y,b::steps_x]
+            if not group.size:
+                continue
+            args=(
+                a*inner_height,
+                b*inner_width,
+                group.shape[0],
+                group.shape[1])
+            steps=(steps_y*inner_height,steps_x*inner_width)
+            _grid_view(values,*args,height,width,*steps)[:]+=group
+            _grid_view(counts,*args,height,width,*steps)[:]+=1
+    np.divide(values,counts,out=values,where=counts>0)
+    canvas[:]=values
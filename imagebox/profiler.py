@@ -0,0 +1,274 @@
+import time
+import logging
+import threading
+import imagebox.config as config
+#
+# CONSTANTS
+#
+STAGES='stages'
+COUNTERS='counters'
+LOGGER=logging.getLogger('imagebox')
+
+
+#
+# Profiler
+#
+class Profiler(object):
+    """ Profiler
+
+    Low-overhead per-stage timers, counters and output-bytes tracking.
+
+    Stages are aggregated by name (count, total/min/max seconds and bytes). 
+    Snapshots are plain dicts, so snapshots from worker processes can be 
+    merged into a parent profiler. When disabled `stage` returns a shared 
+    no-op context and nothing is recorded.
+
+    Usage:
+        import imagebox.profiler as profiler
+        profiler.enable()
+        ... handler.sample(...) ...
+        profiler.snapshot()
+        profiler.flush()  # send snapshot to sinks (e.g. profiler.logging_sink)
+
+        with profiler.stage('my_stage') as timer:
+            im=...
+            timer.add(im)
+
+    Args:
+        enabled<bool|None>: enable profiling (None: use config.PROFILE)
+        sinks<list>: callables sink(snapshot) called by flush
+        hooks<list>: callables hook(name,seconds,nbytes) called on every record
+    """
+    def __init__(self,enabled=False,sinks=None,hooks=None):
+        self._enabled=enabled
+        self.sinks=list(sinks or [])
+        self.hooks=list(hooks or [])
+        self._lock=threading.Lock()
+        self.reset()
+
+
+    @property
+    def enabled(self):
+        """ enabled flag (None: use config.PROFILE, resolved on first use) """
+        if self._enabled is None:
+            self._enabled=config.PROFILE
+        return self._enabled
+
+
+    @enabled.setter
+    def enabled(self,value):
+        self._enabled=value
+
+
+    def stage(self,name):
+        """ context manager timing stage `name` """
+        if self.enabled:
+            return _Timer(self,name)
+        else:
+            return _NULL_TIMER
+
+
+    def record(self,name,seconds,nbytes=0):
+        """ record a stage measurement """
+        with self._lock:
+            stats=self._stages.get(name)
+            if stats is None:
+                stats=self._stages[name]={
+                    'count': 0,
+                    'seconds': 0.0,
+                    'min': seconds,
+                    'max': seconds,
+                    'bytes': 0 }
+            stats['count']+=1
+            stats['seconds']+=seconds
+            stats['min']=min(stats['min'],seconds)
+            stats['max']=max(stats['max'],seconds)
+            stats['bytes']+=nbytes
+        for hook in self.hooks:
+            hook(name,seconds,nbytes)
+
+
+    def count(self,name,value=1):
+        """ increment counter `name` """
+        if self.enabled:
+            with self._lock:
+                self._counters[name]=self._counters.get(name,0)+value
+
+
+    def snapshot(self,reset=False):
+        """ dict snapshot {'stages': {name: stats}, 'counters': {name: value}} """
+        with self._lock:
+            snapshot={
+                STAGES: {k: v.copy() for k,v in self._stages.items()},
+                COUNTERS: self._counters.copy() }
+            if reset:
+                self._stages={}
+                self._counters={}
+        return snapshot
+
+
+    def merge(self,snapshot):
+        """ merge a snapshot (e.g. from a worker process) into the profiler """
+        with self._lock:
+            for name,other in snapshot.get(STAGES,{}).items():
+                stats=self._stages.get(name)
+                if stats is None:
+                    self._stages[name]=other.copy()
+                else:
+                    stats['count']+=other['count']
+                    stats['seconds']+=other['seconds']
+                    stats['min']=min(stats['min'],other['min'])
+                    stats['max']=max(stats['max'],other['max'])
+                    stats['bytes']+=other['bytes']
+            for name,value in snapshot.get(COUNTERS,{}).items():
+                self._counters[name]=self._counters.get(name,0)+value
+
+
+    def flush(self,reset=True):
+        """ send snapshot to sinks """
+        snapshot=self.snapshot(reset=reset)
+        for sink in self.sinks:
+            sink(snapshot)
+        return snapshot
+
+
+    def reset(self):
+        with self._lock:
+            self._stages={}
+            self._counters={}
+
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        del state['_lock']
+        return state
+
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock=threading.Lock()
+
+
+#
+# SINKS
+#
+def logging_sink(logger=LOGGER,level=logging.INFO):
+    """ sink logging one line per stage/counter """
+    def _sink(snapshot):
+        for name,stats in sorted(snapshot[STAGES].items()):
+            logger.log(
+                level,
+                'imagebox.profiler: %s count=%d seconds=%.6f mean=%.6f max=%.6f bytes=%d',
+                name,
+                stats['count'],
+                stats['seconds'],
+                stats['seconds']/max(stats['count'],1),
+                stats['max'],
+                stats['bytes'])
+        for name,value in sorted(snapshot[COUNTERS].items()):
+            logger.log(level,'imagebox.profiler: %s=%s',name,value)
+    return _sink
+
+
+def callback_sink(callback):
+    """ sink calling callback(snapshot) """
+    def _sink(snapshot):
+        callback(snapshot)
+    return _sink
+
+
+#
+# GLOBAL PROFILER
+#
+PROFILER=Profiler(enabled=None)
+
+
+def enable(sinks=None,hooks=None):
+    """ enable the global profiler (optionally adding sinks/hooks) """
+    PROFILER.sinks+=list(sinks or [])
+    PROFILER.hooks+=list(hooks or [])
+    PROFILER.enabled=True
+
+
+def disable():
+    PROFILER.enabled=False
+
+
+def enabled():
+    return PROFILER.enabled
+
+
+def stage(name):
+    return PROFILER.stage(name)
+
+
+def count(name,value=1):
+    PROFILER.count(name,value)
+
+
+def snapshot(reset=False):
+    return PROFILER.snapshot(reset=reset)
+
+
+def merge(snapshot):
+    PROFILER.merge(snapshot)
+
+
+def flush(reset=True):
+    return PROFILER.flush(reset=reset)
+
+
+def reset():
+    PROFILER.reset()
+
+
+#
+# INTERNAL
+#
+class _Timer(object):
+
+    __slots__=['profiler','name','nbytes','start']
+
+    def __init__(self,profiler,name):
+        self.profiler=profiler
+        self.name=name
+        self.nbytes=0
+
+
+    def add(self,*arrays):
+        """ add output array(s) bytes to the stage """
+        for arr in arrays:
+            if isinstance(arr,(list,tuple)):
+                self.add(*arr)
+            else:
+                self.nbytes+=getattr(arr,'nbytes',0)
+        return arrays[0] if len(arrays)==1 else arrays
+
+
+    def __enter__(self):
+        self.start=time.perf_counter()
+        return self
+
+
+    def __exit__(self,*args):
+        self.profiler.record(self.name,time.perf_counter()-self.start,self.nbytes)
+
+
+
+class _NullTimer(object):
+
+    __slots__=[]
+
+    def add(self,*arrays):
+        return arrays[0] if len(arrays)==1 else arrays
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self,*args):
+        pass
+
+
+_NULL_TIMER=_NullTimer()
@@ -0,0 +1,373 @@
+import os
+import threading
+from collections import OrderedDict
+import imagebox.config as config
+#
+# CONSTANTS
+#
+CACHE_PRIORITY=0
+LOADER_PRIORITY=10
+GDAL_PRIORITY=20
+MB=1024**2
+BUDGET_ERROR='imagebox.resources: memory budget exceeded'
+
+
+#
+# Governor
+#
+class Governor(object):
+    """ Governor
+
+    Process-wide memory and worker budgets shared by the io, handler,
+    loader and caching subsystems.
+
+    Memory is drawn by consumers. A consumer has a name, a priority, its
+    current size in bytes (`nbytes`) and optionally an `evict(nbytes)` method
+    that frees (at least) nbytes and returns the number of bytes freed.
+    When a request does not fit, evictable consumers with a lower priority
+    than the request are evicted, lowest priority first.
+
+    Workers are granted (not shared) per name: `workers(name,requested)`
+    returns at most the unused worker budget (but at least 1).
+
+    Usage:
+        import imagebox.resources as resources
+        resources.configure(memory_budget=8*1024**3,worker_budget=16)
+        resources.usage()
+        # {'memory': {'budget':..., 'used':..., 'consumers': {...}}, 'workers': {...}}
+
+    Args:
+        memory_budget<int|None>: bytes (None for unlimited)
+        worker_budget<int|None>: number of threads/processes (defaults to os.cpu_count())
+    """
+    def __init__(self,memory_budget=None,worker_budget=None):
+        self.memory_budget=memory_budget
+        self.worker_budget=worker_budget or os.cpu_count() or 1
+        self._consumers=[]
+        self._workers={}
+        self._lock=threading.RLock()
+
+
+    @property
+    def lock(self):
+        """ re-entrant lock guarding the budgets """
+        return self._lock
+
+
+    def register(self,consumer):
+        """ add a memory consumer """
+        with self._lock:
+            if consumer not in self._consumers:
+                self._consumers.append(consumer)
+        return consumer
+
+
+    def unregister(self,consumer):
+        """ remove a memory consumer """
+        with self._lock:
+            if consumer in self._consumers:
+                self._consumers.remove(consumer)
+
+
+    def used(self):
+        """ bytes used by all consumers """
+        with self._lock:
+            return sum(c.nbytes for c in self._consumers)
+
+
+    def available(self):
+        """ unused bytes (None if unlimited) """
+        if self.memory_budget is None:
+            return None
+        return max(self.memory_budget-self.used(),0)
+
+
+    def request(self,nbytes,priority=0,exclude=None):
+        """ make room for nbytes by evicting lower priority consumers
+
+        Args:
+            nbytes<int>: bytes needed
+            priority<int|float>: priority of the request
+            exclude<consumer|None>: consumer that should not be evicted (the requester)
+        Returns:
+            <bool> True if nbytes fit in the budget
+
+        The bytes are not reserved: use `reserve`, or hold `lock` while 
+        requesting and allocating.
+        """
+        if self.memory_budget is None:
+            return True
+        with self._lock:
+            needed=self.used()+nbytes-self.memory_budget
+            if needed<=0:
+                return True
+            candidates=sorted(
+                [
+                    c for c in self._consumers
+                    if (c is not exclude) and
+                        (c.priority<priority) and
+                        hasattr(c,'evict') ],
+                key=lambda c: c.priority)
+            for consumer in candidates:
+                needed-=consumer.evict(needed)
+                if needed<=0:
+                    return True
+            return False
+
+
+    def reserve(self,name,nbytes,priority=0,strict=True):
+        """ reserve a fixed number of bytes
+
+        Checking the budget and reserving are one atomic step (under the 
+        governor lock), so concurrent reservations can not overcommit it.
+
+        Args:
+            name<str>: reservation name (shown in usage)
+            nbytes<int>: bytes
+            priority<int|float>: priority (lower priority consumers are evicted to make room)
+            strict<bool>: if True raise MemoryError if the bytes do not fit
+        Returns:
+            <Reservation> (release with reservation.release())
+        """
+        with self._lock:
+            if not self.request(nbytes,priority) and strict:
+                raise MemoryError(f'{BUDGET_ERROR}: {name} ({nbytes} bytes)')
+            return self.register(Reservation(self,name,nbytes,priority))
+
+
+    def workers(self,name,requested):
+        """ grant up to `requested` workers from the unused worker budget (at least 1) """
+        with self._lock:
+            self._workers.pop(name,None)
+            used=sum(self._workers.values())
+            granted=max(1,min(int(requested),self.worker_budget-used))
+            self._workers[name]=granted
+            return granted
+
+
+    def release_workers(self,name):
+        with self._lock:
+            self._workers.pop(name,None)
+
+
+    def usage(self):
+        """ live usage """
+        with self._lock:
+            consumers={}
+            for c in self._consumers:
+                consumers[c.name]=consumers.get(c.name,0)+c.nbytes
+            return {
+                'memory': {
+                    'budget': self.memory_budget,
+                    'used': sum(consumers.values()),
+                    'consumers': consumers },
+                'workers': {
+                    'budget': self.worker_budget,
+                    'used': sum(self._workers.values()),
+                    'grants': dict(self._workers) }}
+
+
+
+
+class Reservation(object):
+    """ fixed size (non-evictable) memory consumer """
+    def __init__(self,governor,name,nbytes,priority=0):
+        self.governor=governor
+        self.name=name
+        self.nbytes=nbytes
+        self.priority=priority
+
+
+    def release(self):
+        self.governor.unregister(self)
+        self.nbytes=0
+
+
+
+
+class ArrayCache(object):
+    """ ArrayCache
+
+    Thread-safe LRU cache of arrays (or tuples/dicts containing arrays) whose
+    bytes are drawn from the governor's memory budget. The cache is an
+    evictable consumer: higher priority requests (e.g. loader buffers) evict
+    its least recently used entries.
+
+    Args:
+        max_bytes<int|None>: cache size limit (in addition to the memory budget)
+        name<str>: consumer name
+        priority<int>: eviction priority
+        governor<Governor|None>: defaults to the global governor
+    """
+    def __init__(self,max_bytes=None,name='cache',priority=CACHE_PRIORITY,governor=None):
+        self.max_bytes=max_bytes
+        self.name=name
+        self.priority=priority
+        self.nbytes=0
+        self.hits=0
+        self.misses=0
+        self._governor=governor
+        self._entries=OrderedDict()
+        self._lock=threading.Lock()
+        self.governor.register(self)
+
+
+    @property
+    def governor(self):
+        return self._governor or governor()
+
+
+    def get(self,key):
+        with self._lock:
+            entry=self._entries.get(key)
+            if entry is None:
+                self.misses+=1
+                return None
+            self._entries.move_to_end(key)
+            self.hits+=1
+            return entry[0]
+
+
+    def put(self,key,value):
+        """ cache value (if it fits in max_bytes and the memory budget) """
+        nbytes=_nbytes(value)
+        self.governor.register(self)
+        if (self.max_bytes is not None) and (nbytes>self.max_bytes):
+            return False
+        with self._lock:
+            if key in self._entries:
+                return True
+            if self.max_bytes is not None:
+                self._evict(self.nbytes+nbytes-self.max_bytes)
+        # request and insert atomically (governor lock before cache lock, as in evictions)
+        with self.governor.lock:
+            if not self.governor.request(nbytes,self.priority,exclude=self):
+                self.evict(nbytes)
+                if not self.governor.request(nbytes,self.priority,exclude=self):
+                    return False
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key]=(value,nbytes)
+                    self.nbytes+=nbytes
+        return True
+
+
+    def evict(self,nbytes):
+        """ evict least recently used entries. returns bytes freed """
+        with self._lock:
+            return self._evict(nbytes)
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes=0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        state['_entries']=OrderedDict()
+        state['nbytes']=0
+        del state['_lock']
+        return state
+
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock=threading.Lock()
+        self.governor.register(self)
+
+
+    def _evict(self,nbytes):
+        freed=0
+        while (freed<nbytes) and self._entries:
+            _,(_,size)=self._entries.popitem(last=False)
+            freed+=size
+        self.nbytes-=freed
+        return freed
+
+
+
+
+#
+# GLOBAL GOVERNOR
+#
+_GOVERNOR=None
+_GOVERNOR_LOCK=threading.Lock()
+_GDAL={}
+
+
+def governor():
+    """ global governor (created from config on first use) """
+    global _GOVERNOR
+    with _GOVERNOR_LOCK:
+        if _GOVERNOR is None:
+            _GOVERNOR=Governor(
+                memory_budget=config.MEMORY_BUDGET,
+                worker_budget=config.WORKER_BUDGET)
+    return _GOVERNOR
+
+
+def configure(memory_budget=None,worker_budget=None):
+    """ update the global budgets (None keeps the current value) """
+    gov=governor()
+    with gov._lock:
+        if memory_budget is not None:
+            gov.memory_budget=memory_budget
+        if worker_budget is not None:
+            gov.worker_budget=worker_budget
+    return gov
+
+
+def usage():
+    """ live usage of the global governor """
+    return governor().usage()
+
+
+def configure_gdal():
+    """ size the GDAL block cache from config.GDAL_CACHE (once, before the first read)
+
+    The size is set as a GDAL config option (and exported as GDAL_CACHEMAX for
+    child processes). It is reserved in the global memory budget. An existing
+    GDAL_CACHEMAX environment variable takes precedence.
+    """
+    if _GDAL:
+        return
+    _GDAL['configured']=True
+    nbytes=config.GDAL_CACHE
+    if (nbytes is None) or ('GDAL_CACHEMAX' in os.environ):
+        return
+    from rasterio.env import set_gdal_config
+    cache_max=max(int(nbytes//MB),1)
+    set_gdal_config('GDAL_CACHEMAX',cache_max)
+    os.environ['GDAL_CACHEMAX']=str(cache_max)
+    _GDAL['reservation']=governor().reserve(
+        'gdal.cache',
+        nbytes,
+        priority=GDAL_PRIORITY,
+        strict=False)
+
+
+#
+# INTERNAL
+#
+def _nbytes(value):
+    if isinstance(value,(list,tuple)):
+        return sum(_nbytes(v) for v in value)
+    elif isinstance(value,dict):
+        return sum(_nbytes(v) for v in value.values())
+    else:
+        return getattr(value,'nbytes',0)
+
+
+def _reset():
+    global _GOVERNOR
+    _GOVERNOR=None
+    _GDAL.clear()
+
+
+os.register_at_fork(after_in_child=_reset)
@@ -0,0 +1,169 @@
+import math
+import numpy as np
+#
+# CONSTANTS
+#
+GROUP_SIZE=4
+NB_FILES_ERROR='imagebox.sampler: nb_files required when passing a single tiller'
+SHARD_ERROR='imagebox.sampler: rank must be in [0, world_size)'
+
+
+#
+# LocalitySampler
+#
+class LocalitySampler(object):
+    """ LocalitySampler
+
+    Shuffled-but-local epoch order over the tiller windows of a set of files.
+
+    Rather than drawing (file, window) pairs uniformly at random, the order is
+    shuffled hierarchically: files are shuffled, then the groups of 
+    neighbouring tiles within each file, then the tiles within each group. 
+    Consecutive samples therefore mostly hit the same file and nearby blocks
+    (warm OS page-cache, GDAL block-cache, dataset handles) while every
+    window is still visited once per epoch in a random order.
+
+    Usage:
+        sampler=LocalitySampler(tiller,nb_files=len(pairs),group_size=4,seed=123)
+        for file_index,window_index in sampler.order(epoch):
+            input_path,target_path=pairs[file_index]
+            ...
+        # specs for handler.batch/loader.Loader
+        specs=sampler.specs(pairs,epoch=epoch)
+
+    Args:
+        tillers<Tiller|list>: a tiller shared by all files, or one tiller per file
+        nb_files<int|None>: number of files (required if tillers is a single Tiller)
+        group_size<int|tuple>: 
+            - number of tiles (cols, rows) per group
+            - choose so that a group spans the raster's block size
+        mix_files<bool>: 
+            - if False keep all groups of a file contiguous
+            - if True shuffle groups across files
+        seed<int|None>: seed. the order for (seed, epoch) is deterministic
+    """
+    def __init__(self,
+            tillers,
+            nb_files=None,
+            group_size=GROUP_SIZE,
+            mix_files=False,
+            seed=None):
+        if not isinstance(tillers,(list,tuple)):
+            if nb_files is None:
+                raise ValueError(NB_FILES_ERROR)
+            tillers=[tillers]*nb_files
+        self.tillers=list(tillers)
+        if isinstance(group_size,int):
+            group_size=(group_size,group_size)
+        self.group_cols,self.group_rows=group_size
+        self.mix_files=mix_files
+        self.seed=seed
+        self.epoch=0
+        self.length=sum(len(t) for t in self.tillers)
+
+
+    def order(self,epoch=None):
+        """ (file_index, window_index) order for epoch
+
+        Returns:
+            <np.array> (N,2) int array of file-index, window-index pairs
+        """
+        if epoch is None:
+            epoch=self.epoch
+        if self.seed is None:
+            rng=np.random.default_rng()
+        else:
+            rng=np.random.default_rng((self.seed,epoch))
+        files=[]
+        ranks=[]
+        windows=[]
+        groups=[]
+        nb_groups=0
+        for rank,file_index in enumerate(rng.permutation(len(self.tillers))):
+            index,group,size=self._groups(self.tillers[file_index])
+            files.append(np.full(index.shape,file_index))
+            ranks.append(np.full(index.shape,rank))
+            windows.append(index)
+            groups.append(group+nb_groups)
+            nb_groups+=size
+        if not windows:
+            return np.empty((0,2),dtype=int)
+        files=np.concatenate(files)
+        windows=np.concatenate(windows)
+        group_rank=rng.permutation(nb_groups)[np.concatenate(groups)]
+        keys=[rng.random(len(windows)),group_rank]
+        if not self.mix_files:
+            keys.append(np.concatenate(ranks))
+        order=np.lexsort(keys)
+        return np.stack([files[order],windows[order]],axis=1)
+
+
+    def shard(self,rank,world_size,epoch=None):
+        """ contiguous shard of the epoch order
+
+        Shards are contiguous slices of `order(epoch)` so each worker keeps
+        the locality of the order. Shard sizes differ by at most one.
+
+        Args:
+            rank<int>: shard index
+            world_size<int>: number of shards
+            epoch<int|None>: epoch (defaults to the current epoch)
+        """
+        if not (0<=rank<world_size):
+            raise ValueError(SHARD_ERROR)
+        order=self.order(epoch)
+        start=(rank*len(order))//world_size
+        end=((rank+1)*len(order))//world_size
+        return order[start:end]
+
+
+    def specs(self,pairs,epoch=None,rank=None,world_size=None):
+        """ handler.batch/loader.Loader specs for epoch
+
+        Args:
+            pairs<list>: (input_path, target_path) for each file
+            epoch<int|None>: epoch (defaults to the current epoch)
+            rank,world_size<int|None>: if passed return specs for shard
+        Returns:
+            <list> (input_path, target_path, window) tuples
+            - window is the window-index if all files share a tiller (the 
+              handler's tiller), otherwise the window tuple of the file's tiller
+        """
+        if world_size:
+            order=self.shard(rank,world_size,epoch)
+        else:
+            order=self.order(epoch)
+        if self._shared_tiller():
+            return [ 
+                (pairs[f][0],pairs[f][1],int(w)) for f,w in order ]
+        return [
+            (pairs[f][0],pairs[f][1],tuple(int(v) for v in self.tillers[f][int(w)]))
+            for f,w in order ]
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __iter__(self):
+        order=self.order()
+        self.epoch+=1
+        for file_index,window_index in order:
+            yield int(file_index), int(window_index)
+
+
+    #
+    # INTERNAL
+    #
+    def _shared_tiller(self):
+        return all(t is self.tillers[0] for t in self.tillers)
+
+
+    def _groups(self,tiller):
+        index=np.arange(len(tiller))
+        col=index//tiller.rows
+        row=index-col*tiller.rows
+        group_rows=math.ceil(tiller.rows/self.group_rows)
+        group_cols=math.ceil(tiller.cols/self.group_cols)
+        group=(col//self.group_cols)*group_rows+(row//self.group_rows)
+        return index, group, group_cols*group_rows
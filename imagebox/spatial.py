@@ -0,0 +1,218 @@
+import numpy as np
+import imagebox.io as io
+import imagebox.utils as utils
+from imagebox.handler import Tiller, MultiTiller
+#
+# CONSTANTS
+#
+CRS_ERROR='imagebox.spatial: all rasters must have the same crs'
+TRANSFORMS_ERROR='imagebox.spatial: a transform is required for each file'
+
+
+#
+# SpatialIndex
+#
+class SpatialIndex(object):
+    """ SpatialIndex
+
+    Spatial index over the tiles of one or many rasters.
+
+    Tile bounds (in the rasters' crs) are hashed into a uniform grid of
+    cells. The (cell, tile) pairs are kept as sorted numpy arrays, so a
+    query looks up its cells with a binary search and only tests the
+    candidate tiles. Point queries are fully vectorized over the points.
+
+    Usage:
+        tiller=hand.MultiTiller(paths,size=256,overlap=16,catalog=catalog)
+        index=SpatialIndex(tiller,catalog=catalog)
+        tile_indices=index.query((minx,miny,maxx,maxy))
+        index.hits(tile_indices)                # [(path, window), ...]
+        point_indices,tile_indices=index.query_points(xs,ys)
+        point_indices,file_indices,windows=index.point_windows(xs,ys,size=64)
+
+    Args:
+        tiller<MultiTiller|Tiller>:
+            - tiller for the rasters. tile indices are the tiller's (global) indices
+            - a Tiller requires `transforms=[transform]` (and optionally `paths`)
+        transforms<list|None>:
+            - affine transform for each file
+            - if None, transforms are read from the catalog (or file headers)
+        crs<str|list|None>: crs (or a crs for each file) used to check the rasters match
+        catalog<catalog.Catalog|None>: catalog used for transforms/crs
+        cell_size<float|None>: grid cell size (defaults to the median tile size)
+    """
+    def __init__(self,tiller,transforms=None,crs=None,catalog=None,cell_size=None):
+        if isinstance(tiller,Tiller):
+            tiller=MultiTiller([None],tillers=[tiller])
+        self.tiller=tiller
+        self.paths=tiller.input_paths
+        if transforms is None:
+            transforms,crs=self._metadata(catalog)
+        if len(transforms)!=tiller.nb_files:
+            raise ValueError(TRANSFORMS_ERROR)
+        self.transforms=list(transforms)
+        self.crs=self._check_crs(crs)
+        self.bounds=self._tile_bounds()
+        self.cell_size=cell_size or self._default_cell_size()
+        self._build_grid()
+
+
+    def query(self,bounds):
+        """ global tile-indices of the tiles intersecting bounds (minx, miny, maxx, maxy) """
+        minx,miny,maxx,maxy=bounds
+        if not len(self):
+            return np.empty(0,dtype=np.int64)
+        (cx0,cx1),(cy0,cy1)=self._cell_range(minx,maxx,0),self._cell_range(miny,maxy,1)
+        nb_cells=(cx1-cx0+1)*(cy1-cy0+1)
+        if nb_cells>len(self):
+            candidates=np.arange(len(self))
+        else:
+            cx,cy=np.meshgrid(np.arange(cx0,cx1+1),np.arange(cy0,cy1+1))
+            candidates=np.unique(self._cell_tiles(self._cell_ids(cx.ravel(),cy.ravel()))[1])
+        tb=self.bounds[candidates]
+        hit=(tb[:,0]<=maxx)&(tb[:,2]>=minx)&(tb[:,1]<=maxy)&(tb[:,3]>=miny)
+        return candidates[hit]
+
+
+    def query_points(self,xs,ys):
+        """ (point-indices, tile-indices) for every tile containing each point """
+        xs=np.atleast_1d(np.asarray(xs,dtype=np.float64))
+        ys=np.atleast_1d(np.asarray(ys,dtype=np.float64))
+        cx=np.floor((xs-self.origin[0])/self.cell_size).astype(np.int64)
+        cy=np.floor((ys-self.origin[1])/self.cell_size).astype(np.int64)
+        inside=(cx>=0)&(cx<self.shape[0])&(cy>=0)&(cy<self.shape[1])
+        points=np.flatnonzero(inside)
+        cells=self._cell_ids(cx[points],cy[points])
+        points,tiles=self._cell_tiles(cells,points)
+        tb=self.bounds[tiles]
+        x,y=xs[points],ys[points]
+        hit=(tb[:,0]<=x)&(tb[:,2]>=x)&(tb[:,1]<=y)&(tb[:,3]>=y)
+        return points[hit], tiles[hit]
+
+
+    def point_windows(self,xs,ys,size):
+        """ pixel windows centered on the points for each file containing them
+
+        Returns:
+            point-indices, file-indices, (N,4) windows
+        """
+        point_indices,tile_indices=self.query_points(xs,ys)
+        file_indices,_=self.tiller.locate(tile_indices)
+        pairs=np.unique(np.stack([point_indices,file_indices],axis=1),axis=0)
+        point_indices,file_indices=pairs[:,0],pairs[:,1]
+        xs=np.atleast_1d(np.asarray(xs,dtype=np.float64))[point_indices]
+        ys=np.atleast_1d(np.asarray(ys,dtype=np.float64))[point_indices]
+        windows=np.empty((len(point_indices),4),dtype=np.int64)
+        for file_index in np.unique(file_indices):
+            sel=file_indices==file_index
+            windows[sel]=utils.points_to_windows(
+                self.transforms[file_index],
+                xs[sel],
+                ys[sel],
+                size)
+        return point_indices, file_indices, windows
+
+
+    def hits(self,tile_indices):
+        """ [(path, window), ...] for global tile-indices """
+        file_indices,_=self.tiller.locate(np.asarray(tile_indices,dtype=np.int64))
+        windows=self.tiller[np.asarray(tile_indices,dtype=np.int64)]
+        return [
+            (self.paths[f],tuple(int(v) for v in w))
+            for f,w in zip(file_indices.tolist(),windows) ]
+
+
+    def __len__(self):
+        return len(self.bounds)
+
+
+    #
+    # INTERNAL
+    #
+    def _metadata(self,catalog):
+        transforms,crs=[],[]
+        for path in self.paths:
+            if catalog:
+                profile=catalog.profile(path)
+            else:
+                profile=io.info(path)
+            transforms.append(profile['transform'])
+            crs.append(profile['crs'])
+        return transforms, crs
+
+
+    def _check_crs(self,crs):
+        if isinstance(crs,(list,tuple)):
+            values={str(c) for c in crs if c is not None}
+            if len(values)>1:
+                raise ValueError(CRS_ERROR)
+            crs=values.pop() if values else None
+        return crs
+
+
+    def _tile_bounds(self):
+        if not len(self.tiller):
+            return np.empty((0,4))
+        return np.concatenate([
+            utils.windows_to_bounds(affine,tiller.windows)
+            for affine,tiller in zip(self.transforms,self.tiller.tillers) ])
+
+
+    def _default_cell_size(self):
+        if not len(self.bounds):
+            return 1.0
+        sizes=np.maximum(
+            self.bounds[:,2]-self.bounds[:,0],
+            self.bounds[:,3]-self.bounds[:,1])
+        return float(np.median(sizes)) or 1.0
+
+
+    def _build_grid(self):
+        """ sorted (cell, tile) pairs """
+        bounds=self.bounds
+        if len(bounds):
+            self.origin=bounds[:,0].min(),bounds[:,1].min()
+            extent=bounds[:,2].max()-self.origin[0],bounds[:,3].max()-self.origin[1]
+        else:
+            self.origin=(0.0,0.0)
+            extent=(0.0,0.0)
+        self.shape=(
+            int(extent[0]//self.cell_size)+1,
+            int(extent[1]//self.cell_size)+1)
+        cx0,cx1=self._cell_range(bounds[:,0],bounds[:,2],0)
+        cy0,cy1=self._cell_range(bounds[:,1],bounds[:,3],1)
+        nx,ny=cx1-cx0+1,cy1-cy0+1
+        counts=nx*ny
+        tiles=np.repeat(np.arange(len(bounds)),counts)
+        starts=np.repeat(np.cumsum(counts)-counts,counts)
+        k=np.arange(counts.sum())-starts
+        nx=np.repeat(nx,counts)
+        cells=self._cell_ids(
+            np.repeat(cx0,counts)+k%nx,
+            np.repeat(cy0,counts)+k//nx)
+        order=np.argsort(cells,kind='stable')
+        self.cells=cells[order]
+        self.cell_tiles=tiles[order]
+
+
+    def _cell_range(self,low,high,axis):
+        size=self.shape[axis]
+        low=np.clip(np.floor((np.asarray(low)-self.origin[axis])/self.cell_size),0,size-1)
+        high=np.clip(np.floor((np.asarray(high)-self.origin[axis])/self.cell_size),0,size-1)
+        return low.astype(np.int64), high.astype(np.int64)
+
+
+    def _cell_ids(self,cx,cy):
+        return np.asarray(cy,dtype=np.int64)*self.shape[0]+np.asarray(cx,dtype=np.int64)
+
+
+    def _cell_tiles(self,cells,keys=None):
+        """ (keys, tiles) for every tile in each cell. keys default to the cell position """
+        if keys is None:
+            keys=np.arange(len(cells))
+        lo=np.searchsorted(self.cells,cells,side='left')
+        hi=np.searchsorted(self.cells,cells,side='right')
+        counts=hi-lo
+        starts=np.repeat(lo-(np.cumsum(counts)-counts),counts)
+        positions=np.arange(counts.sum())+starts
+        return np.repeat(keys,counts), self.cell_tiles[positions]
@@ -0,0 +1,291 @@
+import numpy as np
+import imagebox.io as io
+import imagebox.processor as proc
+from imagebox.config import FIRST
+#
+# CONSTANTS
+#
+PATH_REQUIRED_ERROR='imagebox.tile_index: target_path or input_path required'
+NO_HISTOGRAM_ERROR='imagebox.tile_index: class histograms require nb_categories'
+
+
+#
+# TileIndex
+#
+class TileIndex(object):
+    """ TileIndex
+
+    Per-window content statistics for the windows of a Tiller.
+
+    The index is built in a single streaming pass: each row of tiles is read 
+    as one strip and the statistics for every window in the strip are 
+    recorded. Windows that are empty (nodata) or only contain background 
+    classes can then be filtered out or down-weighted before any training 
+    or inference reads.
+
+    Statistics (arrays with one row per tiller window):
+        - valid: fraction of valid (not nodata/nan) pixels
+        - histogram: (target) class counts (requires nb_categories)
+        - means/stdevs: (input) band-wise means/stdevs of valid pixels
+
+    Usage:
+        index=TileIndex.build(
+            tiller,
+            target_path=target_path,
+            input_path=input_path,
+            nb_categories=4)
+        index.save('tiles.npz')
+        window_indices=index.select(min_valid=0.9,classes=[1,2],min_class_fraction=0.05)
+        window_indices=index.sample(64,weights=index.weights(class_weights=[0,1,5,5]),seed=1)
+
+    Args:
+        windows<np.array>: (N,4) tiller windows
+        valid<np.array>: (N,) valid pixel fractions
+        histogram<np.array|None>: (N,nb_categories) class counts
+        means,stdevs<np.array|None>: (N,nb_bands) band statistics
+    """
+    @classmethod
+    def build(cls,
+            tiller,
+            target_path=None,
+            input_path=None,
+            nb_categories=None,
+            value_map=None,
+            target_nodata=None,
+            input_nodata=None,
+            input_bands=None):
+        """ build index with one streaming pass over the target/input rasters
+
+        Args:
+            tiller<Tiller>: tiller for the rasters
+            target_path<str|None>: single band categorical target
+            input_path<str|None>: input image
+            nb_categories<int|None>: number of target classes (for histograms)
+            value_map<dict|None>: value map applied to target before the histogram
+            target/input_nodata<number|None>: nodata value (defaults to file nodata)
+            input_bands<list|None>: input bands for band statistics
+        """
+        if not (target_path or input_path):
+            raise ValueError(PATH_REQUIRED_ERROR)
+        windows=np.array(tiller.windows,dtype=np.int64)
+        nb_windows=len(windows)
+        valid=np.ones(nb_windows)
+        histogram=means=stdevs=None
+        if target_path:
+            target_valid,histogram=_target_stats(
+                target_path,
+                windows,
+                nb_categories,
+                value_map,
+                target_nodata)
+            valid*=target_valid
+        if input_path:
+            input_valid,means,stdevs=_input_stats(
+                input_path,
+                windows,
+                input_nodata,
+                input_bands)
+            valid=np.minimum(valid,input_valid)
+        return cls(windows,valid,histogram,means,stdevs)
+
+
+    @classmethod
+    def load(cls,path):
+        """ load index saved with TileIndex.save """
+        data=np.load(path)
+        return cls(**{
+            k: (data[k] if k in data else None) 
+            for k in ['windows','valid','histogram','means','stdevs'] })
+
+
+    def __init__(self,windows,valid,histogram=None,means=None,stdevs=None):
+        self.windows=windows
+        self.valid=valid
+        self.histogram=histogram
+        self.means=means
+        self.stdevs=stdevs
+
+
+    def save(self,path):
+        """ save index as npz """
+        arrays={
+            k: v for k,v in [
+                ('windows',self.windows),
+                ('valid',self.valid),
+                ('histogram',self.histogram),
+                ('means',self.means),
+                ('stdevs',self.stdevs)] if v is not None }
+        np.savez_compressed(path,**arrays)
+
+
+    def class_fractions(self):
+        """ (N,nb_categories) fraction of each class per window """
+        if self.histogram is None:
+            raise ValueError(NO_HISTOGRAM_ERROR)
+        totals=self.histogram.sum(axis=1,keepdims=True)
+        return np.divide(
+            self.histogram,
+            totals,
+            out=np.zeros(self.histogram.shape),
+            where=totals>0)
+
+
+    def mask(self,min_valid=0,classes=None,min_class_fraction=0):
+        """ boolean mask of windows that pass the filters
+
+        Args:
+            min_valid<float>: minimum valid pixel fraction
+            classes<list|None>: 
+                - if passed, the windows must contain these classes
+                - (at least min_class_fraction of the window in total)
+            min_class_fraction<float>: see classes
+        """
+        mask=self.valid>=min_valid
+        if classes is not None:
+            fractions=self.class_fractions()[:,classes].sum(axis=1)
+            if min_class_fraction:
+                mask&=fractions>=min_class_fraction
+            else:
+                mask&=fractions>0
+        return mask
+
+
+    def select(self,min_valid=0,classes=None,min_class_fraction=0):
+        """ window indices of windows that pass the filters (see mask) """
+        return np.flatnonzero(self.mask(
+            min_valid=min_valid,
+            classes=classes,
+            min_class_fraction=min_class_fraction))
+
+
+    def weights(self,class_weights=None,min_valid=0,power=1):
+        """ sampling weights
+
+        Args:
+            class_weights<list|None>:
+                - per class weights. window weight is the class-fraction weighted sum
+                - if None the valid fraction is used
+            min_valid<float>: windows with valid fraction below min_valid get weight 0
+            power<float>: weights are raised to this power
+        Returns:
+            <np.array> normalized (N,) weights
+        """
+        if class_weights is None:
+            weights=self.valid.copy()
+        else:
+            weights=self.class_fractions().dot(np.asarray(class_weights,dtype=float))
+            weights*=self.valid
+        weights[self.valid<min_valid]=0
+        weights=weights**power
+        total=weights.sum()
+        if total>0:
+            weights=weights/total
+        return weights
+
+
+    def sample(self,size,weights=None,mask=None,replace=True,seed=None):
+        """ sample window indices
+
+        Args:
+            size<int>: number of window indices
+            weights<np.array|None>: sampling weights (see weights)
+            mask<np.array|None>: boolean mask (see mask). ignored if weights
+            replace<bool>: sample with replacement
+            seed<int|None>: random seed
+        """
+        rng=np.random.default_rng(seed)
+        if weights is None:
+            candidates=np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+            return rng.choice(candidates,size=size,replace=replace)
+        else:
+            return rng.choice(len(self),size=size,replace=replace,p=weights)
+
+
+    def __len__(self):
+        return len(self.windows)
+
+
+#
+# INTERNAL
+#
+def _strips(path,windows):
+    """ yield (window-indices, strip, row-offset, nodata) for each row of windows """
+    with io.rio.open(path) as src:
+        nodata=src.nodata
+        width=src.width
+    row_offsets=np.unique(windows[:,1])
+    for row_off in row_offsets:
+        indices=np.flatnonzero(windows[:,1]==row_off)
+        height=windows[indices,3].max()
+        strip=io.read(
+            path,
+            window=(0,int(row_off),width,int(height)),
+            return_profile=False,
+            band_ordering=FIRST)
+        yield indices, strip, row_off, nodata
+
+
+def _tile(strip,window,row_off):
+    """ window of a strip (cropped to the image for padded windows) """
+    col,row,width,height=window
+    row=row-row_off
+    return strip[:,row:row+height,col:col+width]
+
+
+def _valid(im,nodata):
+    valid=np.ones(im.shape[1:],dtype=bool)
+    if nodata is not None:
+        valid&=(im!=nodata).all(axis=0)
+    if np.issubdtype(im.dtype,np.floating):
+        valid&=~np.isnan(im).any(axis=0)
+    return valid
+
+
+def _valid_fraction(mask,window):
+    """ valid fraction of the full window (pixels beyond the image are invalid) """
+    area=int(window[2])*int(window[3])
+    return mask.sum()/area if area else 0
+
+
+def _target_stats(path,windows,nb_categories,value_map,nodata):
+    valid=np.zeros(len(windows))
+    histogram=None
+    if nb_categories:
+        histogram=np.zeros((len(windows),nb_categories),dtype=np.int64)
+    for indices,strip,row_off,file_nodata in _strips(path,windows):
+        if nodata is None:
+            nodata=file_nodata
+        for i in indices:
+            im=_tile(strip,windows[i],row_off)
+            mask=_valid(im,nodata)
+            valid[i]=_valid_fraction(mask,windows[i])
+            if histogram is not None:
+                im=im[0]
+                if value_map:
+                    im=proc.map_values(im,value_map)
+                values=im[mask].astype(np.int64)
+                values=values[(values>=0)&(values<nb_categories)]
+                histogram[i]=np.bincount(values,minlength=nb_categories)
+    return valid, histogram
+
+
+def _input_stats(path,windows,nodata,bands):
+    valid=np.zeros(len(windows))
+    means=stdevs=None
+    for indices,strip,row_off,file_nodata in _strips(path,windows):
+        if nodata is None:
+            nodata=file_nodata
+        if bands is not None:
+            strip=strip[bands]
+        if means is None:
+            means=np.full((len(windows),strip.shape[0]),np.nan)
+            stdevs=np.full((len(windows),strip.shape[0]),np.nan)
+        for i in indices:
+            im=_tile(strip,windows[i],row_off)
+            mask=_valid(im,nodata)
+            valid[i]=_valid_fraction(mask,windows[i])
+            if mask.any():
+                values=im[:,mask].astype(np.float64)
+                means[i]=values.mean(axis=1)
+                stdevs[i]=values.std(axis=1)
+    return valid, means, stdevs
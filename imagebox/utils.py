@@ -1,6 +1,11 @@
+import numpy as np
 import rasterio.transform as transform
 from rasterio.crs import CRS
-from imagebox.config import FIRST, LAST, BAND_ORDERING
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+import imagebox.config as config
+from imagebox.config import FIRST, LAST
 
 
 
@@ -69,7 +74,7 @@ def profile(
 #
 def order_bands(image,band_ordering=None):
     if band_ordering is None:
-        band_ordering=BAND_ORDERING 
+        band_ordering=config.BAND_ORDERING 
     if band_ordering.lower()==LAST:
         image=image.transpose(1,2,0)
     return image
@@ -80,8 +85,8 @@ def order_bands(image,band_ordering=None):
 #
 def window_origin(src_transform,target_transform):
     """ origin of window from src and window affine-transform """
-    x=(target_transform.c-src_transform.c)/target_transform.a
-    y=(target_transform.f-src_transform.f)/target_transform.e
+    x=(target_transform.c-src_transform.c)/src_transform.a
+    y=(target_transform.f-src_transform.f)/src_transform.e
     return round(x),round(y)
 
 
@@ -91,14 +96,185 @@ def profiles_to_window(src_profile,target_profile):
     return Window(x,y,target_profile['width'],target_profile['height'])
 
 
-def crop_src_by_target_profile(src,target_profile):
-    im=src.read()
-    window=profiles_to_window(src.profile,target_profile)
-    imin=window.row_off
-    jmin=window.col_off
-    imax=imin+window.width
-    jmax=jmin+window.height
-    return im[:,imin:imax,jmin:jmax]
+def grids_aligned(src_profile,target_profile,tolerance=1e-6):
+    """ True if the target grid is a (pixel-aligned) window of the src grid
 
+    The crs, resolution and orientation must match and the target origin
+    must fall on a src pixel corner.
+    """
+    src_crs,target_crs=src_profile.get('crs'),target_profile.get('crs')
+    if (src_crs is not None) and (target_crs is not None):
+        if CRS.from_user_input(src_crs)!=CRS.from_user_input(target_crs):
+            return False
+    st,tt=src_profile['transform'],target_profile['transform']
+    scale=max(abs(st.a),abs(st.e))
+    for a,b in [(st.a,tt.a),(st.b,tt.b),(st.d,tt.d),(st.e,tt.e)]:
+        if abs(a-b)>tolerance*scale:
+            return False
+    if st.b or st.d:
+        return False
+    x=(tt.c-st.c)/st.a
+    y=(tt.f-st.f)/st.e
+    return (abs(x-round(x))<=tolerance) and (abs(y-round(y))<=tolerance)
 
 
+def read_aligned(
+        src,
+        target_profile,
+        bands=None,
+        resampling=None,
+        fill_value=None,
+        masked=False):
+    """ read the src data aligned pixel-for-pixel to the target grid
+
+    Only the data covering the target is read:
+        - if the grids are aligned (see grids_aligned) the target window is 
+          read (boundless: pixels outside the src are set to fill_value)
+        - otherwise the src is warped to the target grid through a WarpedVRT
+          (GDAL only reads/warps the source blocks that cover the target)
+
+    Args:
+        src<rasterio dataset>: open source dataset
+        target_profile<dict>: profile with crs, transform, width and height
+        bands<int|list|None>: band index (or indices) to read
+        resampling<Resampling|None>: 
+            - resampling used when warping
+            - if None: nearest for integer sources, bilinear otherwise
+        fill_value<number|None>: 
+            - fill value (defaults to the src nodata value or 0)
+            - warps only set a nodata value if the src has one or fill_value is passed
+        masked<bool>: 
+            - if True return a masked array. pixels outside the src or (if the
+              src has a nodata value) nodata pixels are masked
+            - warps of srcs without nodata are masked with an alpha band, so 
+              no data value is reserved
+    Returns:
+        <np.array> bands-first array with shape (bands, height, width)
+    """
+    if resampling is None:
+        resampling=default_resampling(src.dtypes[0])
+    if grids_aligned(src.profile,target_profile):
+        if fill_value is None:
+            fill_value=src.nodata if src.nodata is not None else 0
+        window=profiles_to_window(src.profile,target_profile)
+        image=src.read(
+            indexes=bands,
+            window=window,
+            boundless=True,
+            fill_value=fill_value)
+        if masked:
+            image=np.ma.masked_array(
+                image,
+                mask=~src.read_masks(indexes=bands,window=window,boundless=True).astype(bool))
+        return image
+    crs=target_profile.get('crs') or src.crs
+    kwargs={}
+    if fill_value is not None:
+        kwargs['nodata']=fill_value
+    elif src.nodata is not None:
+        kwargs['nodata']=src.nodata
+    alpha=masked and (src.nodata is None)
+    with WarpedVRT(
+            src,
+            crs=CRS.from_user_input(crs),
+            transform=target_profile['transform'],
+            width=target_profile['width'],
+            height=target_profile['height'],
+            resampling=resampling,
+            add_alpha=alpha,
+            **kwargs) as vrt:
+        if bands is None:
+            bands=list(range(1,src.count+1))
+        image=vrt.read(indexes=bands)
+        if alpha:
+            mask=np.broadcast_to(vrt.read(vrt.count)==0,image.shape)
+            image=np.ma.masked_array(image,mask=mask)
+        elif masked:
+            image=np.ma.masked_array(image,mask=~vrt.read_masks(indexes=bands).astype(bool))
+        return image
+
+
+def default_resampling(dtype):
+    """ nearest for integer (e.g. categorical) dtypes, bilinear otherwise """
+    if np.issubdtype(np.dtype(dtype),np.floating):
+        return Resampling.bilinear
+    return Resampling.nearest
+
+
+def crop_src_by_target_profile(src,target_profile,resampling=None):
+    """ src data for the target profile (see read_aligned) """
+    return read_aligned(src,target_profile,resampling=resampling)
+
+
+#
+# VECTORIZED COORDINATE HELPERS
+#
+def coords_to_pixels(affine,xs,ys,snap=True):
+    """ geographic coordinates => pixel (cols, rows) 
+
+    Args:
+        affine<Affine>: image transform
+        xs,ys<array-like>: coordinates
+        snap<bool>: if True return (floored) int pixel indices else float pixel coords
+    """
+    inverse=~affine
+    xs=np.asarray(xs,dtype=np.float64)
+    ys=np.asarray(ys,dtype=np.float64)
+    cols=inverse.a*xs+inverse.b*ys+inverse.c
+    rows=inverse.d*xs+inverse.e*ys+inverse.f
+    if snap:
+        cols=np.floor(cols).astype(np.int64)
+        rows=np.floor(rows).astype(np.int64)
+    return cols, rows
+
+
+def pixels_to_coords(affine,cols,rows,offset=0.5):
+    """ pixel (cols, rows) => geographic coordinates (xs, ys)
+
+    Args:
+        affine<Affine>: image transform
+        cols,rows<array-like>: pixel indices
+        offset<float>: 0.5 for pixel centers, 0 for the upper-left corners
+    """
+    cols=np.asarray(cols,dtype=np.float64)+offset
+    rows=np.asarray(rows,dtype=np.float64)+offset
+    xs=affine.a*cols+affine.b*rows+affine.c
+    ys=affine.d*cols+affine.e*rows+affine.f
+    return xs, ys
+
+
+def windows_to_bounds(affine,windows):
+    """ (N,4) windows (col_off, row_off, width, height) => (N,4) bounds (minx, miny, maxx, maxy) """
+    windows=np.asarray(windows,dtype=np.float64).reshape(-1,4)
+    cols=np.stack([windows[:,0],windows[:,0]+windows[:,2]]*2,axis=1)
+    rows=np.repeat(np.stack([windows[:,1],windows[:,1]+windows[:,3]],axis=1),2,axis=1)
+    xs,ys=pixels_to_coords(affine,cols,rows,offset=0)
+    return np.stack([xs.min(axis=1),ys.min(axis=1),xs.max(axis=1),ys.max(axis=1)],axis=1)
+
+
+def bounds_to_windows(affine,bounds):
+    """ (N,4) bounds (minx, miny, maxx, maxy) => (N,4) int windows covering the bounds """
+    bounds=np.asarray(bounds,dtype=np.float64).reshape(-1,4)
+    xs=bounds[:,[0,2,0,2]]
+    ys=bounds[:,[1,1,3,3]]
+    cols,rows=coords_to_pixels(affine,xs,ys,snap=False)
+    col_off=np.floor(cols.min(axis=1)+1e-9).astype(np.int64)
+    row_off=np.floor(rows.min(axis=1)+1e-9).astype(np.int64)
+    width=np.ceil(cols.max(axis=1)-1e-9).astype(np.int64)-col_off
+    height=np.ceil(rows.max(axis=1)-1e-9).astype(np.int64)-row_off
+    return np.stack([col_off,row_off,width,height],axis=1)
+
+
+def points_to_windows(affine,xs,ys,size):
+    """ (N,4) windows of size (int or (width, height)) centered on the points """
+    if isinstance(size,(tuple,list)):
+        width,height=size
+    else:
+        width=height=size
+    cols,rows=coords_to_pixels(affine,xs,ys)
+    cols,rows=np.atleast_1d(cols),np.atleast_1d(rows)
+    return np.stack([
+            cols-width//2,
+            rows-height//2,
+            np.full(cols.shape,width),
+            np.full(rows.shape,height)],axis=1)
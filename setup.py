@@ -26,6 +26,7 @@ setup(
   classifiers = [],
   entry_points={
       'console_scripts': [
+        'imagebox=imagebox.cli:main'
       ]
   }
 )
\ No newline at end of file